@@ -11,7 +11,8 @@ def create_app():
     app.config['MAIL_DEFAULT_SENDER'] = ('Bin Spa', app.config.get('MAIL_FROM'))
     CORS(app, supports_credentials=True, origins=['http://127.0.0.1:5000', 'http://localhost:5000', 'https://binspa.id.vn'])
     db.init_app(app)
-    migrate.init_app(app, db)
+    from .services.tinnhan_partition_service import include_object
+    migrate.init_app(app, db, include_object=include_object)
     jwt.init_app(app)
     mail.init_app(app)
 
@@ -24,6 +25,7 @@ def create_app():
     from .routes.appointment_bp import appointment_bp
     from .routes.customer_bp import customer_bp
     from .routes.staff_bp import staff_bp
+    from .routes.notification_bp import notification_bp
 
     app.register_blueprint(dashboard_api_bp, url_prefix='/api/dashboard')
     app.register_blueprint(customer_bp, url_prefix='/')
@@ -34,6 +36,7 @@ def create_app():
     app.register_blueprint(payment_bp, url_prefix="/api/payment")
     app.register_blueprint(appointment_bp, url_prefix="/api/appointments")
     app.register_blueprint(staff_bp, url_prefix="/api")
+    app.register_blueprint(notification_bp, url_prefix="/api/notifications")
 
     # Đăng ký blueprints admin
     from .admin.staff_manage_bp import staff_manage_bp
@@ -56,6 +59,18 @@ def create_app():
     app.register_blueprint(appointment_manage_bp, url_prefix="/api/admin")
     app.register_blueprint(chat_manage_bp, url_prefix="/api/admin")
 
+    # Đăng ký sự kiện Session duy trì cột tóm tắt / giờ kết thúc của LichHen
+    from .services import appointment_summary_service  # noqa: F401
+    from .services import availability_service, shift_service
+    availability_service.init_app(app)
+    shift_service.init_app(app)
+    from .services import tinnhan_partition_service
+    tinnhan_partition_service.register_cli(app)
+
+    # Tài nguyên tĩnh có hash + nén sẵn (asset_url trong template, `flask assets build`)
+    from . import assets
+    assets.init_app(app)
+
     print("MOMO Config check (from Config object):")
     print("PARTNER_CODE:", app.config.get('MOMO_PARTNER_CODE_SANDBOX'))
     print("ACCESS_KEY:", app.config.get('MOMO_ACCESS_KEY_SANDBOX'))
@@ -3,10 +3,11 @@ from ..extensions import db
 from ..models import LichHen, KhachHang, DichVu, NhanVien, ChiTietLichHen, ChucVu # THÊM ChucVu
 from ..decorators import roles_required
 from datetime import datetime, date, timedelta
-from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError
 from flask_mail import Message
 import threading
 from app.services.email_service import send_email
+from app.services import availability_service, booking_service, shift_service
 
 appointment_manage_bp = Blueprint("appointment_manage", __name__)
 
@@ -20,58 +21,35 @@ def send_async_email_complete(app, recipient, subject, body):
             current_app.logger.error(f"Lỗi khi gửi mail cảm ơn hoàn thành dịch vụ: {e}")
 
 
+def format_conflicts(conflicts):
+    """Định dạng danh sách khoảng bận (BusyInterval) để trả về cho trang quản trị"""
+    details = availability_service.describe_conflicts(conflicts)
+    return [{
+        'malh': apt.malh,
+        'ngaygio': apt.start.strftime('%H:%M'),
+        'ketthuc': apt.end.strftime('%H:%M'),
+        'khachhang': details[apt.malh]['khachhang'] or 'N/A',
+        'dichvu': ', '.join(details[apt.malh]['services'])
+    } for apt in conflicts]
+
 def check_staff_availability(manv, ngaygio, thoiluong_phut):
     """
-    ✅ FIXED: Kiểm tra nhân viên có rảnh không - CHÍNH XÁC
-    (Hàm này giữ nguyên)
+    Kiểm tra nhân viên có rảnh không.
+    Dùng chung chỉ mục lịch bận với routes/appointment_bp (availability_service).
+    Ngoài ca làm -> (False, []) (không có lịch trùng nhưng cũng không làm việc).
     """
     if not manv:
         return True, []
     
-    # Thời gian lịch hẹn mới
-    gio_batdau = ngaygio
-    gio_ketthuc = ngaygio + timedelta(minutes=thoiluong_phut)
-    
-    # Lấy tất cả lịch hẹn của nhân viên trong ngày
-    ngay = ngaygio.date()
-    ngay_sau = ngay + timedelta(days=1)
-    
-    existing_appointments = LichHen.query.filter(
-        and_(
-            LichHen.manv == manv,
-            LichHen.ngaygio >= ngay,
-            LichHen.ngaygio < ngay_sau,
-            LichHen.trangthai.in_(['pending', 'confirmed', 'in_progress'])
-        )
-    ).all()
-    
-    conflicting = []
+    end = ngaygio + timedelta(minutes=thoiluong_phut)
+    if not shift_service.is_on_shift(manv, ngaygio, end):
+        return False, []
     
-    for apt in existing_appointments:
-        # ✅ Tính TỔNG thời lượng của tất cả dịch vụ trong lịch hẹn
-        tong_thoiluong = 0
-        for detail in apt.chitiet:
-            if detail.dichvu and detail.dichvu.thoiluong:
-                tong_thoiluong += detail.dichvu.thoiluong
-        
-        # Nếu không có thời lượng, mặc định 60 phút
-        if tong_thoiluong == 0:
-            tong_thoiluong = 60
-        
-        apt_batdau = apt.ngaygio
-        apt_ketthuc = apt.ngaygio + timedelta(minutes=tong_thoiluong)
-        
-        # ✅ Kiểm tra xung đột: Hai khoảng thời gian giao nhau
-        if gio_batdau < apt_ketthuc and gio_ketthuc > apt_batdau:
-            conflicting.append({
-                'malh': apt.malh,
-                'ngaygio': apt.ngaygio.strftime('%H:%M'),
-                'ketthuc': apt_ketthuc.strftime('%H:%M'),
-                'khachhang': apt.khachhang.hoten if apt.khachhang else 'N/A',
-                'dichvu': ', '.join([d.dichvu.tendv for d in apt.chitiet if d.dichvu])
-            })
+    conflicts = availability_service.find_conflicts(manv, ngaygio, thoiluong_phut)
+    if not conflicts:
+        return True, []
     
-    return len(conflicting) == 0, conflicting
+    return False, format_conflicts(conflicts)
 
 # def send_appointment_confirmation_email(...) # Giữ nguyên như logic cũ
 
@@ -113,6 +91,9 @@ def get_available_staff_for_appointment():
             db.joinedload(NhanVien.chucvu)
         ).all()
         
+        # Nạp trước chỉ mục lịch bận của tất cả nhân viên trong 1 truy vấn
+        availability_service.get_day_indexes([s.manv for s in available_staff_list], ngaygio.date())
+        
         staff_results = []
         for staff in available_staff_list:
             # Sử dụng hàm kiểm tra tính khả dụng đã có
@@ -147,35 +128,30 @@ def get_my_appointments():
         if not customer or not hasattr(customer, 'makh'):
             return jsonify({"success": False, "msg": "Vui lòng đăng nhập"}), 401
         
-        appointments = LichHen.query.filter_by(
-            makh=customer.makh
+        # Dịch vụ lấy từ cột tóm tắt của LichHen -> 1 truy vấn, không nạp chitiet/dichvu;
+        # danh sách dịch vụ từng lịch hẹn xem ở GET /appointments/<malh>
+        appointments = db.session.query(
+            LichHen, NhanVien.hoten
+        ).outerjoin(
+            NhanVien, LichHen.manv == NhanVien.manv
+        ).filter(
+            LichHen.makh == customer.makh
         ).order_by(
             LichHen.ngaygio.desc()
         ).all()
         
         result = []
-        for apt in appointments:
-            services = []
-            total_duration = 0
-            for detail in apt.chitiet:
-                if detail.dichvu:
-                    services.append({
-                        "madv": detail.madv,
-                        "tendv": detail.dichvu.tendv,
-                        "gia": str(detail.dichvu.gia),
-                        "thoiluong": detail.dichvu.thoiluong
-                    })
-                    if detail.dichvu.thoiluong:
-                        total_duration += detail.dichvu.thoiluong
-            
+        for apt, nhanvien_hoten in appointments:
             result.append({
                 "malh": apt.malh,
                 "ngaygio": apt.ngaygio.isoformat(),
-                "dichvu": ", ".join([s['tendv'] for s in services]),
-                "services": services,
-                "nhanvien": apt.nhanvien.hoten if apt.nhanvien else "Chưa phân công",
+                "dichvu": apt.ten_dichvu or "",
+                "dichvu_ten": apt.nhan_dichvu or "",
+                "so_dichvu": apt.so_dichvu,
+                "nhanvien": nhanvien_hoten or "Chưa phân công",
                 "trangthai": apt.trangthai,
-                "total_duration": total_duration,
+                "total_duration": apt.tong_thoiluong,
+                "total_price": str(apt.tong_gia),
                 "created_at": apt.created_at.isoformat() if hasattr(apt, 'created_at') and apt.created_at else None
             })
         
@@ -229,7 +205,8 @@ def check_appointment_availability():
                 return jsonify({
                     "success": False,
                     "available": False,
-                    "message": f"Nhân viên {nhanvien.hoten if nhanvien else 'này'} đã bận trong khung giờ {ngaygio.strftime('%H:%M')} - {end_time}",
+                    "message": f"Nhân viên {nhanvien.hoten if nhanvien else 'này'} "
+                               f"{'đã bận' if conflicts else 'không có ca làm'} trong khung giờ {ngaygio.strftime('%H:%M')} - {end_time}",
                     "conflicts": conflicts,
                     "suggestion": "Vui lòng chọn khung giờ khác hoặc chọn nhân viên khác",
                     "total_duration": total_duration,
@@ -275,58 +252,28 @@ def create_appointment():
         if total_duration == 0:
             total_duration = 60
         
-        
-        assigned_staff_manv = manv 
-        
-        if not manv:
-            available_staff_list = NhanVien.query.filter(
-                NhanVien.trangthai == True,
-                NhanVien.role == 'staff'
-            ).order_by(func.random()).all()
-            
-            found_staff = False
-            for staff in available_staff_list:
-                # Dùng hàm kiểm tra đã có
-                is_available, _ = check_staff_availability(staff.manv, ngaygio, total_duration)
-                
-                if is_available:
-                    assigned_staff_manv = staff.manv 
-                    found_staff = True
-                    break 
-            
-            if not found_staff:
+        # Kiểm tra + tạo lịch trong cùng giao dịch, có khóa theo (nhân viên, ngày)
+        try:
+            new_apt = booking_service.book_appointment(
+                makh, ngaygio, madv_list, total_duration, manv=manv, trangthai='confirmed'
+            )
+        except booking_service.BookingConflict as conflict:
+            db.session.rollback()
+            if not manv:
                 return jsonify({
                     "success": False, 
                     "msg": "Không có nhân viên rảnh vào khung giờ này. Vui lòng chọn giờ khác."
                 }), 409
-        
-        else:
-            is_available, conflicts = check_staff_availability(manv, ngaygio, total_duration)
-            if not is_available:
-                nhanvien = NhanVien.query.get(manv)
-                return jsonify({
-                    "success": False,
-                    "msg": f"Nhân viên {nhanvien.hoten if nhanvien else 'này'} đã bận trong khung giờ này",
-                    "conflicts": conflicts
-                }), 409 
-                
-        new_apt = LichHen(
-            makh=makh,
-            ngaygio=ngaygio,
-            manv=assigned_staff_manv,
-            trangthai='confirmed'
-        )
-        db.session.add(new_apt)
-        db.session.flush()
-        
-        for madv in madv_list:
-            detail = ChiTietLichHen(
-                malh=new_apt.malh,
-                madv=madv
-            )
-            db.session.add(detail)
+            nhanvien = NhanVien.query.get(manv)
+            return jsonify({
+                "success": False,
+                "msg": f"Nhân viên {nhanvien.hoten if nhanvien else 'này'} "
+                       f"{'không có ca làm' if conflict.off_shift else 'đã bận'} trong khung giờ này",
+                "conflicts": format_conflicts(conflict.conflicts)
+            }), 409 
         
         db.session.commit()
+        assigned_staff_manv = new_apt.manv
         
         return jsonify({
             "success": True,
@@ -334,6 +281,12 @@ def create_appointment():
             "malh": new_apt.malh,
             "manv_assigned": assigned_staff_manv
         }), 201
+    except IntegrityError as e:
+        db.session.rollback()
+        if availability_service.is_double_booking_error(e):
+            return jsonify({"success": False, "msg": "Nhân viên đã bận trong khung giờ này"}), 409
+        current_app.logger.error(f"Lỗi tạo lịch hẹn: {e}")
+        return jsonify({"msg": "Đặt lịch hẹn thất bại"}), 500
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Lỗi tạo lịch hẹn: {e}")
@@ -346,8 +299,13 @@ def create_appointment():
 def get_all_appointments_admin():
 # ... (Nội dung hàm giữ nguyên) ...
     try:
-        query = db.session.query(LichHen).outerjoin(
+        # Tên dịch vụ lấy từ cột tóm tắt -> chỉ 1 truy vấn, không nạp chitiet/dichvu từng dòng
+        query = db.session.query(
+            LichHen, KhachHang.hoten, NhanVien.hoten
+        ).outerjoin(
             KhachHang, LichHen.makh == KhachHang.makh
+        ).outerjoin(
+            NhanVien, LichHen.manv == NhanVien.manv
         )
         
         start_date_str = request.args.get("start_date")
@@ -368,30 +326,13 @@ def get_all_appointments_admin():
         appointments = query.order_by(LichHen.ngaygio.desc()).all()
         
         result = []
-        for apt in appointments:
-            dichvu_ten = "N/A"
-            
-            # Lấy tên nhân viên từ apt (LichHen)
-            nhanvien_ten = "Chưa gán"
-            if apt.nhanvien: 
-                nhanvien_ten = apt.nhanvien.hoten
-            
-            dichvu_count = len(apt.chitiet)
-            
-            if dichvu_count > 0:
-                first_detail = apt.chitiet[0]
-                
-                if first_detail and first_detail.dichvu:
-                    dichvu_ten = first_detail.dichvu.tendv
-                    if dichvu_count > 1:
-                        dichvu_ten += f" (+{dichvu_count - 1})"
-            
+        for apt, khachhang_hoten, nhanvien_hoten in appointments:
             result.append({
                 "malh": apt.malh,
                 "ngaygio": apt.ngaygio.isoformat(),
-                "khachhang_hoten": apt.khachhang.hoten if apt.khachhang else "N/A",
-                "dichvu_ten": dichvu_ten,
-                "nhanvien_hoten": nhanvien_ten, 
+                "khachhang_hoten": khachhang_hoten or "N/A",
+                "dichvu_ten": apt.nhan_dichvu or "N/A",
+                "nhanvien_hoten": nhanvien_hoten or "Chưa gán", 
                 "trangthai": apt.trangthai
             })
         
@@ -427,36 +368,27 @@ def get_my_schedule_by_date_range():
         else:
             end_date = start_date + timedelta(days=1) 
         
-        query = LichHen.query.filter(
+        appointments = db.session.query(
+            LichHen, KhachHang.hoten
+        ).outerjoin(
+            KhachHang, LichHen.makh == KhachHang.makh
+        ).filter(
             LichHen.manv == staff.manv,
             LichHen.ngaygio >= start_date,
             LichHen.ngaygio < end_date,
-        )
-
-        appointments = query.options(
-            db.joinedload(LichHen.khachhang),
-            db.joinedload(LichHen.chitiet).joinedload(ChiTietLichHen.dichvu) 
         ).order_by(LichHen.ngaygio).all()
         
         result = []
-        for apt in appointments:
-            # Xử lý dịch vụ để hiển thị
-            dichvu_ten = "N/A"
-            dichvu_count = len(apt.chitiet)
-            if dichvu_count > 0 and apt.chitiet[0].dichvu:
-                dichvu_ten = apt.chitiet[0].dichvu.tendv
-                if dichvu_count > 1:
-                        dichvu_ten += f" (+{dichvu_count - 1})"
-            
+        for apt, khachhang_hoten in appointments:
             # Trả về format chuẩn (giống yêu cầu của frontend)
             result.append({
                 "malh": apt.malh,
                 "ngaygio": apt.ngaygio.isoformat(),
-                "khachhang_hoten": apt.khachhang.hoten if apt.khachhang else "Khách vãng lai",
-                "dichvu_ten": dichvu_ten,
+                "khachhang_hoten": khachhang_hoten or "Khách vãng lai",
+                "dichvu_ten": apt.nhan_dichvu or "N/A",
                 "nhanvien_hoten": staff.hoten, 
                 "trangthai": apt.trangthai,
-                "ghichu": apt.ghichu if apt.ghichu else "" # Đảm bảo key ghichu có
+                "ghichu": getattr(apt, 'ghichu', None) or "" # Đảm bảo key ghichu có
             })
         
         return jsonify({"success": True, "appointments": result}), 200
@@ -540,16 +472,35 @@ def update_appointment(malh):
         
         data = request.get_json()
         
-        if "ngaygio" in data:
-            apt.ngaygio = datetime.strptime(data["ngaygio"], "%Y-%m-%dT%H:%M")
-        if "manv" in data:
-            apt.manv = data["manv"]
         if "trangthai" in data:
             apt.trangthai = data["trangthai"]
+        if "manv" in data and not data["manv"]:
+            apt.manv = None  # bỏ gán nhân viên: không cần kiểm tra lịch
+        if "ngaygio" in data or data.get("manv"):
+            ngaygio = datetime.strptime(data["ngaygio"], "%Y-%m-%dT%H:%M") if data.get("ngaygio") else None
+            try:
+                # Cùng kiểm tra ca làm + khóa + kiểm tra lại trên DB như khi đặt lịch
+                booking_service.move_appointment(apt, manv=data.get("manv"), ngaygio=ngaygio)
+            except booking_service.BookingConflict as conflict:
+                db.session.rollback()
+                return jsonify({
+                    "msg": "Nhân viên không có ca làm trong khung giờ này" if conflict.off_shift
+                           else "Nhân viên đã bận trong khung giờ này",
+                    "conflicts": format_conflicts(conflict.conflicts)
+                }), 409
         
         db.session.commit()
         
         return jsonify({"success": True, "msg": "Cập nhật lịch hẹn thành công"}), 200
+    except ValueError:
+        db.session.rollback()
+        return jsonify({"msg": "Ngày giờ hoặc mã nhân viên không hợp lệ"}), 400
+    except IntegrityError as e:
+        db.session.rollback()
+        if availability_service.is_double_booking_error(e):
+            return jsonify({"msg": "Nhân viên đã bận trong khung giờ này"}), 409
+        current_app.logger.error(f"Lỗi cập nhật lịch hẹn: {e}")
+        return jsonify({"msg": "Cập nhật thất bại"}), 500
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Lỗi cập nhật lịch hẹn: {e}")
@@ -568,6 +519,7 @@ def confirm_appointment(malh):
             return jsonify({"msg": "Lịch hẹn không ở trạng thái chờ xác nhận"}), 400
         
         apt.trangthai = 'confirmed'
+        booking_service.notify_appointments('confirmed', apt.makh, [(apt.malh, apt.manv, apt.ngaygio)])
         db.session.commit()
         
         return jsonify({"success": True, "msg": "Xác nhận lịch hẹn thành công"}), 200
@@ -655,10 +607,24 @@ def assign_staff_to_appointment(malh):
         if not staff_member:
             return jsonify({"msg": "Không tìm thấy nhân viên"}), 404
 
-        apt.manv = manv
+        try:
+            booking_service.move_appointment(apt, manv=manv)
+        except booking_service.BookingConflict as conflict:
+            db.session.rollback()
+            return jsonify({
+                "msg": f"Nhân viên {staff_member.hoten} "
+                       f"{'không có ca làm' if conflict.off_shift else 'đã bận'} trong khung giờ của lịch hẹn này",
+                "conflicts": format_conflicts(conflict.conflicts)
+            }), 409
         db.session.commit()
 
         return jsonify({"success": True, "msg": "Gán nhân viên thành công"}), 200
+    except IntegrityError as e:
+        db.session.rollback()
+        if availability_service.is_double_booking_error(e):
+            return jsonify({"msg": "Nhân viên đã bận trong khung giờ của lịch hẹn này"}), 409
+        current_app.logger.error(f"Lỗi gán nhân viên: {e}")
+        return jsonify({"msg": "Lỗi hệ thống"}), 500
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Lỗi gán nhân viên: {e}")
@@ -722,6 +688,22 @@ def get_appointment_statistics():
         return jsonify({"success": False, "msg": "Lỗi hệ thống"}), 500
 
 
+def _create_unassigned_appointment(makh, ngaygio, madv_list, total_duration):
+    """Lịch hẹn chưa gán nhân viên: không cần khóa vì không chiếm lịch của ai"""
+    new_apt = LichHen(
+        makh=makh,
+        ngaygio=ngaygio,
+        ngayketthuc=ngaygio + timedelta(minutes=total_duration),
+        manv=None,
+        trangthai='confirmed',
+    )
+    db.session.add(new_apt)
+    db.session.flush()
+    db.session.add_all([ChiTietLichHen(malh=new_apt.malh, madv=madv) for madv in madv_list])
+    booking_service.notify_appointments('created', makh, [(new_apt.malh, None, ngaygio)])
+    return new_apt
+
+
 @appointment_manage_bp.route("/appointments/book", methods=["POST"])
 def book_appointment_customer():
 # ... (Nội dung hàm giữ nguyên) ...
@@ -765,35 +747,22 @@ def book_appointment_customer():
         if total_duration == 0:
             total_duration = 60
         
-        if manv:
-            is_available, conflicts = check_staff_availability(manv, ngaygio, total_duration)
-            if not is_available:
-                nhanvien = NhanVien.query.get(manv)
-                end_time = (ngaygio + timedelta(minutes=total_duration)).strftime('%H:%M')
-                return jsonify({
-                    "success": False,
-                    "msg": f"Nhân viên {nhanvien.hoten if nhanvien else 'này'} đã bận trong khung giờ {ngaygio.strftime('%H:%M')} - {end_time}. Vui lòng chọn khung giờ khác hoặc chọn nhân viên khác.",
-                    "conflicts": conflicts,
-                    "total_duration": total_duration
-                }), 409
-        
-        # Tạo lịch hẹn mới
-        new_apt = LichHen(
-            makh=customer.makh,
-            ngaygio=ngaygio,
-            manv=manv,
-            trangthai='confirmed',
-        )
-        db.session.add(new_apt)
-        db.session.flush()
-        
-        # Thêm chi tiết dịch vụ
-        for madv in madv_list:
-            detail = ChiTietLichHen(
-                malh=new_apt.malh,
-                madv=madv
-            )
-            db.session.add(detail)
+        # Tạo lịch hẹn mới (kiểm tra trùng lịch dưới khóa (nhân viên, ngày))
+        try:
+            new_apt = booking_service.book_appointment(
+                customer.makh, ngaygio, madv_list, total_duration, manv=manv, trangthai='confirmed'
+            ) if manv else _create_unassigned_appointment(customer.makh, ngaygio, madv_list, total_duration)
+        except booking_service.BookingConflict as conflict:
+            db.session.rollback()
+            nhanvien = NhanVien.query.get(manv)
+            end_time = (ngaygio + timedelta(minutes=total_duration)).strftime('%H:%M')
+            return jsonify({
+                "success": False,
+                "msg": f"Nhân viên {nhanvien.hoten if nhanvien else 'này'} "
+                       f"{'không có ca làm' if conflict.off_shift else 'đã bận'} trong khung giờ {ngaygio.strftime('%H:%M')} - {end_time}. Vui lòng chọn khung giờ khác hoặc chọn nhân viên khác.",
+                "conflicts": format_conflicts(conflict.conflicts),
+                "total_duration": total_duration
+            }), 409
         
         db.session.commit()
         
@@ -820,6 +789,15 @@ def book_appointment_customer():
             }
         }), 201
         
+    except IntegrityError as e:
+        db.session.rollback()
+        if availability_service.is_double_booking_error(e):
+            return jsonify({
+                "success": False,
+                "msg": "Nhân viên vừa được đặt trong khung giờ này. Vui lòng chọn khung giờ khác."
+            }), 409
+        current_app.logger.error(f"Lỗi đặt lịch hẹn: {e}")
+        return jsonify({"msg": "Đặt lịch hẹn thất bại. Vui lòng thử lại"}), 500
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Lỗi đặt lịch hẹn: {e}")
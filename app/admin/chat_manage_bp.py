@@ -1,7 +1,8 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, g
 from ..extensions import db
-from ..models import Hoithoai, NhanVien
+from ..models import Hoithoai, NhanVien, KhachHang
 from ..decorators import roles_required
+from ..services import chat_service
 
 chat_manage_bp = Blueprint("chat_manage", __name__)
 
@@ -29,7 +30,9 @@ def assign_conversation(maht):
         return jsonify({"msg": "Chỉ có thể gán cho Kỹ thuật viên (nhanvien)"}), 400
 
     try:
+        old_manv = conversation.manv
         conversation.manv = manv_to_assign
+        chat_service.notify_assignment(conversation, old_manv)
         db.session.commit()
         return jsonify({"msg": f"Đã gán hội thoại {maht} cho nhân viên {staff.hoten}"}), 200
     except Exception as e:
@@ -48,10 +51,58 @@ def unassign_conversation(maht):
         return jsonify({"msg": "Không tìm thấy hội thoại"}), 404
 
     try:
+        old_manv = conversation.manv
         conversation.manv = None
+        chat_service.notify_assignment(conversation, old_manv)
         db.session.commit()
         return jsonify({"msg": f"Đã gỡ gán hội thoại {maht}, đưa về Hộp thư chung"}), 200
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Lỗi khi gỡ gán hội thoại: {e}")
-        return jsonify({"msg": "Gỡ gán hội thoại thất bại"}), 500
\ No newline at end of file
+        return jsonify({"msg": "Gỡ gán hội thoại thất bại"}), 500
+
+@chat_manage_bp.route("/conversations/broadcast", methods=["POST"])
+@roles_required('letan', 'manager', 'admin')
+def broadcast_message():
+    """
+    Gửi một tin nhắn tới nhiều khách (vd. thông báo nghỉ lễ).
+    Body: {"noidung": "...", "makh_list": [1, 2, ...]} hoặc {"noidung": "...", "all_customers": true}
+    (mọi khách đang hoạt động). Hội thoại chưa có sẽ được tạo.
+    """
+    data = request.get_json() or {}
+    noidung = (data.get("noidung") or "").strip()
+    if not noidung:
+        return jsonify({"msg": "Nội dung không được trống"}), 400
+
+    if data.get("all_customers") is True:
+        # Không giới hạn: chat_service ghi theo lô BROADCAST_BATCH_SIZE khách
+        makh_list = [makh for (makh,) in db.session.query(KhachHang.makh).filter(
+            KhachHang.trangthai == 'active'
+        ).all()]
+    else:
+        makh_list = data.get("makh_list")
+        if not isinstance(makh_list, list) or not makh_list or \
+                not all(isinstance(makh, int) and not isinstance(makh, bool) for makh in makh_list):
+            return jsonify({"msg": "Cần 'makh_list' (danh sách mã khách hàng) hoặc 'all_customers': true"}), 400
+        limit = current_app.config.get('CHAT_BROADCAST_MAX', 5000)
+        if len(set(makh_list)) > limit:
+            return jsonify({"msg": f"Tối đa {limit} khách hàng mỗi lần gửi (dùng 'all_customers': true để gửi mọi khách)"}), 400
+        makh_list = [makh for (makh,) in db.session.query(KhachHang.makh).filter(
+            KhachHang.makh.in_(set(makh_list))
+        ).all()]
+
+    if not makh_list:
+        return jsonify({"msg": "Không có khách hàng nào để gửi"}), 404
+
+    try:
+        sent, created = chat_service.broadcast_message(makh_list, noidung, g.current_user)
+        db.session.commit()
+        return jsonify({
+            "msg": f"Đã gửi tin nhắn tới {sent} khách hàng",
+            "sent": sent,
+            "created_conversations": created
+        }), 201
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Lỗi khi gửi tin nhắn hàng loạt: {e}", exc_info=True)
+        return jsonify({"msg": "Gửi tin nhắn hàng loạt thất bại"}), 500
@@ -2,7 +2,7 @@ from flask import Blueprint, request, jsonify, current_app
 from ..extensions import db
 from ..models import DichVu
 from ..decorators import roles_required 
-import base64
+from ..services import image_service
 
 service_manage_bp = Blueprint("service_manage", __name__)
 
@@ -19,7 +19,7 @@ def get_services_admin():
             "thoiluong": s.thoiluong,
             "mota": s.mota,
             "active": s.active,
-            "anhdichvu": base64.b64encode(s.anhdichvu).decode('utf-8') if s.anhdichvu else None
+            "anhdichvu_url": image_service.service_image_url(s)
         } for s in services]
         return jsonify(result), 200
     except Exception as e:
@@ -55,6 +55,8 @@ def create_service():
 
         db.session.add(new_service)
         db.session.commit()
+        if anhdichvu:
+            image_service.schedule_service_variants(current_app._get_current_object(), new_service.madv)
         return jsonify({"msg": "Thêm dịch vụ thành công", "madv": new_service.madv}), 201
     except Exception as e:
         db.session.rollback()
@@ -90,6 +92,8 @@ def update_service(madv):
             service.anhdichvu = anhdichvu_data
 
         db.session.commit()
+        if anhdichvu:
+            image_service.schedule_service_variants(current_app._get_current_object(), madv)
         return jsonify({"msg": "Cập nhật dịch vụ thành công"}), 200
     except Exception as e:
         db.session.rollback()
@@ -4,6 +4,7 @@ from flask import Blueprint, request, jsonify, current_app, g
 from ..extensions import db
 from ..models import CaLam, NhanVien, DangKyCaLam, nhanvien_calam, ChucVu,BangLuongChiTiet, Luong
 from ..decorators import roles_required 
+from ..services import shift_service
 from datetime import date, datetime
 from decimal import Decimal
 from .. import mail
@@ -235,6 +236,7 @@ def update_shift(maca):
         return jsonify({"msg": "Không tìm thấy ca làm"}), 404
 
     data = request.get_json()
+    old_ngay = shift.ngay
     
     try:
         # 2. Cập nhật các trường
@@ -256,6 +258,8 @@ def update_shift(maca):
             shift.sogio = duration.total_seconds() / 3600.0
         # 4. Lưu thay đổi
         db.session.commit()
+        shift_service.invalidate(old_ngay)
+        shift_service.invalidate(shift.ngay)
         return jsonify({"msg": "Cập nhật ca làm thành công"}), 200
         
     except Exception as e:
@@ -276,8 +280,10 @@ def delete_shift(maca):
         stmt = nhanvien_calam.delete().where(nhanvien_calam.c.maca == maca)
         db.session.execute(stmt)
         # Xóa ca làm
+        ngay = shift.ngay
         db.session.delete(shift)
         db.session.commit()
+        shift_service.invalidate(ngay)
         return jsonify({"msg": "Xóa ca làm thành công"}), 200
     except Exception as e:
         db.session.rollback(); current_app.logger.error(f"Lỗi khi xóa ca làm: {e}"); return jsonify({"msg": "Xóa thất bại"}), 500
@@ -349,6 +355,7 @@ def unassign_staff_from_shift():
 
         # 4. Commit tất cả
         db.session.commit()
+        shift_service.invalidate(shift.ngay)
         return jsonify({"msg": f"Đã xóa NV {manv} khỏi ca {maca} (Đã hoàn trả lương)."}), 200
         
     except Exception as e:
@@ -381,6 +388,7 @@ def assign_staff_to_shift():
         if not _calculate_and_save_daily_salary(staff, shift):
             raise Exception("Tính lương ngày thất bại, xem log để biết chi tiết.")
         db.session.commit()
+        shift_service.invalidate(shift.ngay)
         try:
             send_shift_notification_email(staff.email, staff.hoten, shift)
         except Exception as e:
@@ -413,6 +421,7 @@ def approve_shift_registration(reg_id):
         if not _calculate_and_save_daily_salary(staff, shift):
             raise Exception("Tính lương ngày thất bại, xem log để biết chi tiết.")
         db.session.commit()
+        shift_service.invalidate(shift.ngay)
         try:
             send_shift_notification_email(staff.email, staff.hoten, shift)
         except Exception as e:
@@ -1,29 +1,27 @@
-import os
 from flask import Blueprint, request, jsonify, current_app
 from ..extensions import db
 from ..models import KhachHang, NhanVien, ChucVu
 from ..decorators import roles_required
+from ..services import shift_service, image_service, storage_service
 from werkzeug.security import generate_password_hash
-from werkzeug.utils import secure_filename
 
 staff_manage_bp = Blueprint("staff_manage", __name__)
 
 def save_staff_avatar(file):
+    """
+    Lưu ảnh nhân viên theo nội dung (storage_service), trả về khóa - tăng một tham chiếu
+    trong giao dịch hiện tại. Raise storage_service.UploadRejected nếu không phải ảnh hợp lệ.
+    """
     if not file:
         return None
-    upload_folder = current_app.config.get('UPLOAD_FOLDER')
-    if not upload_folder:
-        current_app.logger.error("UPLOAD_FOLDER chưa được cấu hình trong Config.")
-        return None
-        
-    if not os.path.exists(upload_folder):
-        os.makedirs(upload_folder)
-        
-    filename = secure_filename(file.filename)
-    file_path = os.path.join(upload_folder, f"staff_{filename}")
-    
-    file.save(file_path)
-    return f"staff_{filename}"
+    return storage_service.store(file.stream, max_bytes=current_app.config['AVATAR_MAX_BYTES'])
+
+def _after_avatar_commit(new_key, orphaned_key=None):
+    """Sau commit: xóa ảnh cũ hết tham chiếu, tạo biến thể ?w= cho ảnh mới."""
+    if orphaned_key:
+        storage_service.purge(orphaned_key)
+    if new_key and not storage_service.get_backend().remote:
+        image_service.schedule_file_variants(current_app._get_current_object(), new_key)
 
 @staff_manage_bp.route("/staff/add", methods=["POST"])
 @roles_required('admin')
@@ -44,11 +42,10 @@ def add_staff():
     
     avatar_file = request.files.get('anhnhanvien')
     avatar_filename = None
-    if avatar_file:
-        avatar_filename = save_staff_avatar(avatar_file)
     trangthai_str = data.get("trangthai", "true") 
     trangthai_bool = trangthai_str.lower() == 'true'
     try:
+        avatar_filename = save_staff_avatar(avatar_file)
         new_staff = NhanVien(
             taikhoan=taikhoan, 
             matkhau=generate_password_hash(matkhau), 
@@ -62,9 +59,13 @@ def add_staff():
         )
         db.session.add(new_staff)
         db.session.commit()
+        _after_avatar_commit(avatar_filename)
         return jsonify({"msg": "Đã tạo tài khoản thành công", "manv": new_staff.manv}), 201
+    except storage_service.UploadRejected as e:
+        db.session.rollback(); return jsonify({"msg": str(e)}), e.status
     except Exception as e:
-        db.session.rollback(); current_app.logger.error(f"Lỗi khi tạo nhân viên: {e}"); return jsonify({"msg": "Tạo tài khoản thất bại"}), 500
+        db.session.rollback(); storage_service.purge(avatar_filename)
+        current_app.logger.error(f"Lỗi khi tạo nhân viên: {e}"); return jsonify({"msg": "Tạo tài khoản thất bại"}), 500
 
 @staff_manage_bp.route("/staff/<int:manv>", methods=["PUT"])
 @roles_required('admin')
@@ -79,6 +80,7 @@ def update_staff(manv):
         if NhanVien.query.filter(NhanVien.taikhoan == new_taikhoan, NhanVien.manv != manv).first():
             return jsonify({"msg": "Tên tài khoản mới đã tồn tại"}), 409
         staff.taikhoan = new_taikhoan
+    new_avatar = None
     try:
         staff.hoten = data.get("hoten", staff.hoten)
         staff.email = data.get("email", staff.email) or None
@@ -97,12 +99,22 @@ def update_staff(manv):
 
         avatar_file = request.files.get('anhnhanvien')
         if avatar_file:
-            staff.anhnhanvien = save_staff_avatar(avatar_file)
+            old_avatar = staff.anhnhanvien
+            new_avatar = staff.anhnhanvien = save_staff_avatar(avatar_file)
+            orphaned_avatar = old_avatar if storage_service.release(old_avatar) else None
 
         db.session.commit()
+        if avatar_file:
+            _after_avatar_commit(new_avatar, orphaned_avatar)
+        if "role" in data or "trangthai" in data:
+            # Giờ làm việc chỉ tính KTV đang hoạt động
+            shift_service.invalidate()
         return jsonify({"msg": "Cập nhật thông tin nhân viên thành công"}), 200
+    except storage_service.UploadRejected as e:
+        db.session.rollback(); return jsonify({"msg": str(e)}), e.status
     except Exception as e:
-        db.session.rollback(); current_app.logger.error(f"Lỗi khi cập nhật nhân viên: {e}"); return jsonify({"msg": "Cập nhật thất bại"}), 500
+        db.session.rollback(); storage_service.purge(new_avatar)
+        current_app.logger.error(f"Lỗi khi cập nhật nhân viên: {e}"); return jsonify({"msg": "Cập nhật thất bại"}), 500
 
 @staff_manage_bp.route("/staff/<int:manv>", methods=["DELETE"])
 @roles_required('admin')
@@ -112,6 +124,7 @@ def deactivate_staff(manv):
     try:
         staff.trangthai = False
         db.session.commit()
+        shift_service.invalidate()
         return jsonify({"msg": "Đã vô hiệu hóa tài khoản nhân viên thành công"}), 200
     except Exception as e:
         db.session.rollback(); current_app.logger.error(f"Lỗi khi vô hiệu hóa nhân viên: {e}"); return jsonify({"msg": "Vô hiệu hóa thất bại"}), 500
@@ -0,0 +1,167 @@
+# app/assets.py
+"""
+Tài nguyên tĩnh có dấu vân tay (fingerprint) + nén sẵn.
+
+Build (`flask assets build`, chạy trong build.sh sau khi cài gói):
+- Mỗi tệp .js / .css trong static/ được chép sang static/dist/ với tên kèm hash
+  nội dung (js/admin/chat.js -> dist/js/admin/chat.<hash>.js), cùng hai bản nén
+  .br (brotli, quality 11) và .gz (zopfli) nếu nhỏ hơn bản gốc.
+- CSS: url() / @import tới CSS khác được đổi sang tên có hash (tệp được import
+  đổi nội dung thì tệp import nó cũng đổi hash); tài nguyên khác (ảnh, font)
+  đổi sang đường dẫn tương đối trỏ về tệp gốc ngoài dist/.
+- static/dist/manifest.json: {"js/admin/chat.js": "dist/js/admin/chat.<hash>.js", ...}
+
+Chạy:
+- Template dùng asset_url('js/admin/chat.js'); chưa build (máy dev) thì trả URL gốc.
+- Endpoint static phục vụ dist/ với .br / .gz theo Accept-Encoding, cache vĩnh
+  viễn (immutable) vì nội dung đổi thì tên đổi.
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+import click
+from flask import request, send_from_directory, url_for
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+EXTENSIONS = ('.js', '.css')
+HASH_LENGTH = 12
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+# (mã Accept-Encoding, đuôi tệp) theo thứ tự ưu tiên
+_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+# ========== BUILD ==========
+def _sources(static_folder):
+    for root, dirs, files in os.walk(static_folder):
+        rel_root = os.path.relpath(root, static_folder)
+        if rel_root == DIST or rel_root.startswith(DIST + os.sep):
+            dirs[:] = []
+            continue
+        for name in files:
+            if name.endswith(EXTENSIONS):
+                yield posixpath.normpath(posixpath.join(rel_root.replace(os.sep, '/'), name))
+
+
+def _fingerprint(path, content):
+    stem, ext = posixpath.splitext(path)
+    return f"{DIST}/{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def _compress(target, content):
+    import brotli
+    import zopfli.gzip
+
+    for suffix, packed in (
+        ('.br', brotli.compress(content, mode=brotli.MODE_TEXT, quality=11)),
+        ('.gz', zopfli.gzip.compress(content)),
+    ):
+        if len(packed) < len(content):
+            with open(target + suffix, 'wb') as out:
+                out.write(packed)
+
+
+def build(static_folder):
+    """Tạo static/dist/ và manifest. Trả về manifest."""
+    sources = set(_sources(static_folder))
+    manifest = {}
+
+    def process(path, stack=()):
+        if path in manifest:
+            return manifest[path]
+        with open(os.path.join(static_folder, path), 'rb') as f:
+            content = f.read()
+
+        if path.endswith('.css'):
+            base = posixpath.dirname(path)
+
+            def rewrite(match):
+                quote, ref = match.group(1), match.group(2).strip()
+                if ref.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+                    return match.group(0)
+                clean = ref.split('?')[0].split('#')[0]
+                target = posixpath.normpath(posixpath.join(base, clean))
+                if target in sources and target not in stack:
+                    target = process(target, stack + (path,))
+                    suffix = ''
+                else:
+                    suffix = ref[len(clean):]
+                # dist/ giữ cấu trúc thư mục của static/: đường dẫn tương đối tính từ dist/<base>
+                return f"url({quote}{posixpath.relpath(target, posixpath.join(DIST, base))}{suffix}{quote})"
+
+            content = _CSS_URL.sub(rewrite, content.decode('utf-8')).encode('utf-8')
+
+        hashed = _fingerprint(path, content)
+        target = os.path.join(static_folder, *hashed.split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as out:
+            out.write(content)
+        _compress(target, content)
+        manifest[path] = hashed
+        return hashed
+
+    for path in sorted(sources):
+        process(path)
+
+    with open(os.path.join(static_folder, DIST, MANIFEST), 'w', encoding='utf-8') as out:
+        json.dump(manifest, out, indent=2, sort_keys=True)
+    return manifest
+
+
+# ========== CHẠY ==========
+def _load_manifest(app):
+    path = os.path.join(app.static_folder, DIST, MANIFEST)
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def init_app(app):
+    manifest = _load_manifest(app)
+    app.extensions['assets_manifest'] = manifest
+    built = set(manifest.values())
+    max_age = app.config.get('ASSETS_MAX_AGE', 365 * 24 * 3600)
+    if not manifest:
+        app.logger.info("Chưa có static/dist/manifest.json: dùng tài nguyên tĩnh gốc (chạy `flask assets build`)")
+
+    @app.context_processor
+    def asset_helpers():
+        def asset_url(filename):
+            """URL tài nguyên tĩnh: bản có hash nếu đã build, ngược lại tệp gốc."""
+            return url_for('static', filename=manifest.get(filename, filename))
+        return {"asset_url": asset_url}
+
+    def serve_static(filename):
+        if filename not in built:
+            return app.send_static_file(filename)
+        mimetype = mimetypes.guess_type(filename)[0]
+        response = None
+        for encoding, suffix in _ENCODINGS:
+            if request.accept_encodings[encoding] and \
+                    os.path.isfile(os.path.join(app.static_folder, filename + suffix)):
+                response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = send_from_directory(app.static_folder, filename, mimetype=mimetype)
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+        return response
+
+    app.view_functions['static'] = serve_static
+
+    @app.cli.group('assets')
+    def assets_cli():
+        """Tài nguyên tĩnh có hash + nén sẵn."""
+
+    @assets_cli.command('build')
+    def build_command():
+        """Tạo static/dist/ (tên có hash, .br / .gz) và manifest.json."""
+        result = build(app.static_folder)
+        click.echo(f"Đã build {len(result)} tệp vào {os.path.join(app.static_folder, DIST)}")
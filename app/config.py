@@ -17,6 +17,12 @@ class Config:
     # Sử dụng biến đã được kiểm tra và điều chỉnh tiền tố
     SQLALCHEMY_DATABASE_URI = DATABASE_URL 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Pool kết nối: mỗi giao dịch đặt lịch giữ 1 kết nối cho tới khi nhả khóa advisory
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        "pool_pre_ping": True,
+    }
 
     SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret")
     JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "jwt-secret")
@@ -50,5 +56,55 @@ class Config:
     VIETQR_ACCOUNT_NAME = os.getenv("VIETQR_ACCOUNT_NAME", "DANG VAN KHOA")
     SEPAY_API_KEY = os.getenv("SEPAY_API_KEY", "VIHNBKD2N8CDS68I1NVZQTOBSUO0PJ5SPKZRL6ANERCSYJGM2VF9WHXTYKRZJFJ3")
     
+    # Lịch bận nhân viên (giây). Các worker báo nhau xóa qua event_bus khi lịch hẹn đổi;
+    # TTL chỉ giới hạn độ cũ khi sự kiện bị lỡ (và giờ ca làm của shift_service)
+    AVAILABILITY_CACHE_TTL = int(os.getenv("AVAILABILITY_CACHE_TTL", 60))
+    # Giới hạn thời gian cho tìm kiếm khung giờ trống sớm nhất (mili giây)
+    SLOT_SEARCH_BUDGET_MS = int(os.getenv("SLOT_SEARCH_BUDGET_MS", 200))
+
+    # Chat realtime (SSE /api/chat/stream). Mỗi kết nối giữ một luồng worker:
+    # gunicorn.conf.py ở thư mục gốc đặt worker gthread (không dùng worker sync).
+    CHAT_STREAM_HEARTBEAT = int(os.getenv("CHAT_STREAM_HEARTBEAT", 15))          # giây
+    CHAT_STREAM_MAX_AGE = int(os.getenv("CHAT_STREAM_MAX_AGE", 300))             # giây, hết thì client nối lại
+    CHAT_STREAM_QUEUE_SIZE = int(os.getenv("CHAT_STREAM_QUEUE_SIZE", 256))
+    CHAT_STREAM_REPLAY_LIMIT = int(os.getenv("CHAT_STREAM_REPLAY_LIMIT", 200))
+    # Số mã khách tối đa trong makh_list của một lần gửi tin hàng loạt
+    # (/api/admin/conversations/broadcast); all_customers: true không bị giới hạn
+    CHAT_BROADCAST_MAX = int(os.getenv("CHAT_BROADCAST_MAX", 5000))
+    # Bus sự kiện giữa các worker (Postgres LISTEN/NOTIFY); mỗi worker có stream giữ thêm 1 kết nối DB
+    EVENT_BUS_CHANNEL = os.getenv("EVENT_BUS_CHANNEL", "spa_events")
+    # tinnhan phân vùng theo tháng (`flask tinnhan maintain` từ cron): tạo trước N tháng,
+    # chuyển phân vùng cũ hơn TINNHAN_RETENTION_MONTHS tháng sang tinnhan_luutru.
+    # 0 = giữ hết: chat không đọc tinnhan_luutru, tin đã lưu trữ không còn hiện trong lịch sử
+    TINNHAN_PARTITIONS_AHEAD = int(os.getenv("TINNHAN_PARTITIONS_AHEAD", 2))
+    TINNHAN_RETENTION_MONTHS = int(os.getenv("TINNHAN_RETENTION_MONTHS", 0))
+    TINNHAN_PARTITION_CACHE_TTL = int(os.getenv("TINNHAN_PARTITION_CACHE_TTL", 300))    # giây
+    # Badge thông báo (/api/notifications/summary): giữ kết quả mỗi người dùng N giây (2-5)
+    NOTIFICATION_SUMMARY_TTL = int(os.getenv("NOTIFICATION_SUMMARY_TTL", 3))
+
     # config Upload
-    UPLOAD_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', 'uploads')
\ No newline at end of file
+    UPLOAD_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', 'uploads')
+    # Tệp đính kèm chat (ảnh, PDF): lưu ở attachments/<năm>/<tháng>/, tải xuống qua URL có chữ ký.
+    # Nằm ngoài UPLOAD_FOLDER vì /avatar/<path> phục vụ công khai mọi tệp trong UPLOAD_FOLDER.
+    ATTACHMENT_FOLDER = os.getenv(
+        "ATTACHMENT_FOLDER",
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', 'attachments'),
+    )
+    ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", 10 * 1024 * 1024))
+    ATTACHMENT_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp', 'application/pdf')
+    ATTACHMENT_CACHE_MAX_AGE = int(os.getenv("ATTACHMENT_CACHE_MAX_AGE", 365 * 24 * 3600))   # giây
+    # Biến thể ảnh dịch vụ / ảnh đại diện (WebP + JPEG) cho ?w=, theo chiều rộng (px)
+    IMAGE_VARIANT_WIDTHS = tuple(int(w) for w in os.getenv("IMAGE_VARIANT_WIDTHS", "160,320,640,1280").split(","))
+    # Lưu ảnh đại diện theo nội dung (services/storage_service.py): 'local' | 's3' (cần boto3)
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+    STORAGE_S3_BUCKET = os.getenv("STORAGE_S3_BUCKET")
+    STORAGE_S3_ENDPOINT = os.getenv("STORAGE_S3_ENDPOINT")       # MinIO / dịch vụ tương thích S3
+    STORAGE_S3_PREFIX = os.getenv("STORAGE_S3_PREFIX", "")
+    AVATAR_MAX_BYTES = int(os.getenv("AVATAR_MAX_BYTES", 5 * 1024 * 1024))
+    # Phục vụ tệp tải lên (ảnh đại diện): 'flask' | 'x-accel' (nginx) | 'x-sendfile' (Apache / lighttpd)
+    FILE_SERVE_MODE = os.getenv("FILE_SERVE_MODE", "flask")
+    X_ACCEL_PREFIX = os.getenv("X_ACCEL_PREFIX", "/_uploads/")      # location internal của nginx
+    FILE_CACHE_MAX_AGE = int(os.getenv("FILE_CACHE_MAX_AGE", 365 * 24 * 3600))   # giây, tên tệp theo nội dung
+    FILE_MISSING_TTL = int(os.getenv("FILE_MISSING_TTL", 60))       # giây, nhớ tệp không tồn tại
+    # Tài nguyên tĩnh có hash + nén sẵn (app/assets.py, `flask assets build`): cache vĩnh viễn
+    ASSETS_MAX_AGE = int(os.getenv("ASSETS_MAX_AGE", 365 * 24 * 3600))   # giây
@@ -2,6 +2,8 @@ from .extensions import db
 from datetime import datetime
 from sqlalchemy import UniqueConstraint
 from sqlalchemy.schema import FetchedValue
+from sqlalchemy.dialects.postgresql import TSRANGE, TSVECTOR
+from sqlalchemy.orm import deferred
 nhanvien_calam = db.Table('nhanvien_calam',
     db.Column('manv', db.Integer, db.ForeignKey('nhanvien.manv'), primary_key=True),
     db.Column('maca', db.Integer, db.ForeignKey('calam.maca'), primary_key=True)
@@ -60,7 +62,10 @@ class DichVu(db.Model):
     gia = db.Column(db.Numeric(12, 2), nullable=False)
     thoiluong = db.Column(db.Integer) # Thời lượng tính bằng phút
     donvitinh = db.Column(db.String(50))
-    anhdichvu = db.Column(db.LargeBinary) # Sử dụng LargeBinary cho kiểu bytea
+    # bytea; deferred: danh sách dịch vụ không kéo blob ảnh, ảnh phục vụ qua /api/services/<madv>/image
+    anhdichvu = deferred(db.Column(db.LargeBinary))
+    # md5(anhdichvu) - cột sinh tự động, dùng làm ETag / tham số ?v= của URL ảnh
+    anhdichvu_hash = db.Column(db.Text, server_default=FetchedValue(), server_onupdate=FetchedValue())
     active = db.Column(db.Boolean, default=True)
     mota = db.Column(db.Text)
 
@@ -72,10 +77,31 @@ class LichHen(db.Model):
     trangthai = db.Column(db.String(50), default='Chờ xác nhận')
     makh = db.Column(db.Integer, db.ForeignKey('khachhang.makh'), nullable=False)
     manv = db.Column(db.Integer, db.ForeignKey('nhanvien.manv'), nullable=True)
+    # Giờ kết thúc = ngaygio + tổng thoiluong dịch vụ, được cập nhật tự động khi flush
+    # (xem services/appointment_summary_service.py). Thời lượng chốt lúc đặt / đổi dịch vụ
+    # của lịch hẹn: sửa DichVu.thoiluong sau đó không đổi ngayketthuc / tong_thoiluong
+    ngayketthuc = db.Column(db.DateTime, nullable=False)
+    # tsrange(ngaygio, ngayketthuc) - cột sinh tự động, có GiST index + EXCLUDE chống trùng lịch
+    khoangthoigian = db.Column(TSRANGE, server_default=FetchedValue())
+    # Cột tóm tắt dịch vụ, duy trì tự động (xem services/appointment_summary_service.py)
+    dichvu_dau = db.Column(db.String(100))
+    ten_dichvu = db.Column(db.Text)
+    so_dichvu = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    tong_thoiluong = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    tong_gia = db.Column(db.Numeric(12, 2), nullable=False, default=0, server_default='0')
     khachhang = db.relationship('KhachHang', backref='lichhen', lazy=True)
     chitiet = db.relationship('ChiTietLichHen', backref='lichhen', lazy=True, cascade="all, delete-orphan")
     nhanvien = db.relationship('NhanVien', lazy=True)
 
+    @property
+    def nhan_dichvu(self):
+        """Nhãn hiển thị: "Dịch vụ đầu (+n)", None nếu chưa có dịch vụ."""
+        if not self.so_dichvu or not self.dichvu_dau:
+            return None
+        if self.so_dichvu > 1:
+            return f"{self.dichvu_dau} (+{self.so_dichvu - 1})"
+        return self.dichvu_dau
+
 # bảng chi tiết lịch hẹn
 class ChiTietLichHen(db.Model):
     __tablename__ = 'chitietlichhen'
@@ -127,18 +153,84 @@ class Hoithoai(db.Model):
     # True nếu khách gửi, False nếu NV gửi
     tin_nhan_cuoi_la_khach_gui = db.Column(db.Boolean, nullable=True)
 
-# bảng tin nhắn
+    # Hộp thư: ORDER BY tin_nhan_cuoi_thoi_gian DESC NULLS LAST, maht DESC (phân trang keyset)
+    __table_args__ = (
+        db.Index('ix_hoithoai_inbox', tin_nhan_cuoi_thoi_gian.desc().nullslast(), maht.desc()),
+        db.Index('ix_hoithoai_manv_inbox', manv, tin_nhan_cuoi_thoi_gian.desc().nullslast(), maht.desc()),
+        db.Index('ix_hoithoai_makh', makh),
+    )
+
+# bảng tin nhắn (phân vùng RANGE theo tháng trên thoigiangui - tinnhan_partition_service)
 class TinNhan(db.Model):
     __tablename__ = 'tinnhan'
-    matn = db.Column(db.Integer, primary_key=True) 
+    matn = db.Column(db.Integer, autoincrement=True)
     noidung = db.Column(db.Text, nullable=False)
-    thoigiangui = db.Column(db.DateTime, default=datetime.utcnow)
+    thoigiangui = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     maht = db.Column(db.Integer, db.ForeignKey('hoithoai.maht'), nullable=False)
     nguoigui_makh = db.Column(db.Integer, db.ForeignKey('khachhang.makh'), nullable=True)
     nguoigui_manv = db.Column(db.Integer, db.ForeignKey('nhanvien.manv'), nullable=True)
     da_doc = db.Column(db.Boolean, default=False, nullable=False)
+    # to_tsvector('vn_unaccent', noidung) - cột sinh tự động, GIN index, tìm kiếm không dấu
+    # (deferred: không nạp khi đọc tin nhắn thông thường)
+    noidung_tsv = deferred(db.Column(TSVECTOR, server_default=FetchedValue()))
     khachhang_gui = db.relationship('KhachHang', foreign_keys=[nguoigui_makh])
     nhanvien_gui = db.relationship('NhanVien', foreign_keys=[nguoigui_manv])
+    # Khóa chính của bảng phân vùng phải chứa cột phân vùng; ORM vẫn định danh theo matn
+    # Phân trang keyset theo hội thoại: WHERE maht = ? AND matn > / < ? ORDER BY matn
+    # Partial index chỉ chứa tin chưa đọc (nhỏ): đếm chưa đọc theo hội thoại bằng một GROUP BY
+    __table_args__ = (
+        db.PrimaryKeyConstraint('matn', 'thoigiangui', name='tinnhan_pkey'),
+        db.Index('ix_tinnhan_maht_matn', 'maht', 'matn'),
+        db.Index('ix_tinnhan_unread_khach', 'maht',
+                 postgresql_where=db.text("da_doc = false AND nguoigui_makh IS NOT NULL")),
+        db.Index('ix_tinnhan_unread_nhanvien', 'maht',
+                 postgresql_where=db.text("da_doc = false AND nguoigui_manv IS NOT NULL")),
+        db.Index('ix_tinnhan_noidung_tsv', 'noidung_tsv', postgresql_using='gin'),
+        {'postgresql_partition_by': 'RANGE (thoigiangui)'},
+    )
+    __mapper_args__ = {'primary_key': [matn]}
+
+# bảng lưu trữ tin nhắn cũ (chép từ các phân vùng tinnhan quá hạn TINNHAN_RETENTION_MONTHS)
+class TinNhanLuuTru(db.Model):
+    __tablename__ = 'tinnhan_luutru'
+    matn = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    maht = db.Column(db.Integer, nullable=False)
+    noidung = db.Column(db.Text, nullable=False)
+    thoigiangui = db.Column(db.DateTime, nullable=False)
+    nguoigui_makh = db.Column(db.Integer, nullable=True)
+    nguoigui_manv = db.Column(db.Integer, nullable=True)
+    da_doc = db.Column(db.Boolean, nullable=False, default=False, server_default='false')
+    __table_args__ = (
+        db.Index('ix_tinnhan_luutru_maht_matn', 'maht', 'matn'),
+    )
+
+# bảng tệp đính kèm tin nhắn (nội dung tệp nằm trên đĩa, ATTACHMENT_FOLDER)
+class TepDinhKem(db.Model):
+    __tablename__ = 'tepdinhkem'
+    matdk = db.Column(db.Integer, primary_key=True)
+    maht = db.Column(db.Integer, db.ForeignKey('hoithoai.maht'), nullable=False)
+    # Không FK: khóa chính tinnhan là (matn, thoigiangui) và tin có thể đã chuyển sang tinnhan_luutru
+    matn = db.Column(db.Integer, nullable=False)
+    tenfile = db.Column(db.String(255), nullable=False)
+    loai = db.Column(db.String(100), nullable=False)
+    kichthuoc = db.Column(db.BigInteger, nullable=False)
+    duongdan = db.Column(db.String(255), nullable=False)
+    anhnho = db.Column(db.String(255), nullable=True)
+    rong = db.Column(db.Integer, nullable=True)
+    cao = db.Column(db.Integer, nullable=True)
+    ngaytao = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_tepdinhkem_matn', 'matn'),
+        db.Index('ix_tepdinhkem_maht', 'maht'),
+    )
+
+# bảng tệp lưu theo nội dung (services/storage_service.py): khoa = <2 ký tự>/<sha256><đuôi>
+class TepLuuTru(db.Model):
+    __tablename__ = 'tepluutru'
+    khoa = db.Column(db.String(255), primary_key=True)
+    kichthuoc = db.Column(db.BigInteger, nullable=False)
+    soluot = db.Column(db.Integer, nullable=False, default=1, server_default='1')   # số tham chiếu
+    ngaytao = db.Column(db.DateTime, default=datetime.utcnow)
 
 # bảng ca làm việc
 class CaLam(db.Model):
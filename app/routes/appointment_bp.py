@@ -2,9 +2,9 @@ import os
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from ..extensions import db
-from ..models import ChucVu, LichHen, KhachHang, DichVu, NhanVien, ChiTietLichHen
+from ..models import ChucVu, LichHen, KhachHang, DichVu, NhanVien
 from datetime import datetime, timedelta
-from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError
 from flask_mail import Message
 from ..extensions import mail
 import threading
@@ -12,6 +12,7 @@ import threading
 appointment_bp = Blueprint("appointment", __name__)
 
 from ..services.email_service import send_email
+from ..services import availability_service, availability_bitmap, appointment_service, booking_service, shift_service
 
 # HÀM GỬI EMAIL BẤT ĐỒNG BỘ QUA RESEND
 def send_async_email(app, customer_email, subject, html_content):
@@ -91,49 +92,83 @@ def send_appointment_confirmation_email(customer_email, customer_name, appointme
         current_app.logger.error(f"Lỗi gửi email xác nhận: {e}")
         return False
 
+def send_batch_confirmation_email(customer_email, customer_name, appointments):
+    """Gửi MỘT email tổng hợp cho cả lô lịch hẹn (đặt nhóm / lịch lặp lại)"""
+    try:
+        app = current_app._get_current_object()
+        subject = f"Xác nhận {len(appointments)} lịch hẹn - Bin Spa"
+
+        rows_html = ""
+        for apt in appointments:
+            rows_html += f"""
+            <tr>
+                <td style='padding: 10px; border-bottom: 1px solid #eee;'>#{apt['malh']}</td>
+                <td style='padding: 10px; border-bottom: 1px solid #eee;'>{apt['ngaygio'].strftime("%d/%m/%Y %H:%M")} - {apt['end'].strftime("%H:%M")}</td>
+                <td style='padding: 10px; border-bottom: 1px solid #eee;'>{", ".join(apt['services'])}</td>
+                <td style='padding: 10px; border-bottom: 1px solid #eee;'>{apt['staff_name']}</td>
+            </tr>
+            """
+
+        html_content = f"""
+        <p>Xin chào <strong>{customer_name}</strong>,</p>
+        <p>Cảm ơn bạn đã đặt lịch tại <strong>Bin Spa</strong>. Dưới đây là {len(appointments)} lịch hẹn của bạn:</p>
+
+        <table style="width: 100%; border-collapse: collapse; margin-top: 25px;">
+            <thead>
+                <tr>
+                    <th style="padding: 10px; border-bottom: 2px solid #C9A961; text-align: left;">Mã</th>
+                    <th style="padding: 10px; border-bottom: 2px solid #C9A961; text-align: left;">Thời gian</th>
+                    <th style="padding: 10px; border-bottom: 2px solid #C9A961; text-align: left;">Dịch vụ</th>
+                    <th style="padding: 10px; border-bottom: 2px solid #C9A961; text-align: left;">Nhân viên</th>
+                </tr>
+            </thead>
+            <tbody>
+                {rows_html}
+            </tbody>
+        </table>
+
+        <p style="margin-top: 20px;">Bạn không cần phản hồi email này.</p>
+        <p>Trân trọng,<br><strong>Bin Spa</strong></p>
+        """
+
+        thr = threading.Thread(target=send_async_email, args=[app, customer_email, subject, html_content])
+        thr.start()
+
+        current_app.logger.info(f"Email xác nhận {len(appointments)} lịch hẹn đã khởi tạo gửi cho {customer_email}")
+        return True
+
+    except Exception as e:
+        current_app.logger.error(f"Lỗi gửi email xác nhận lô lịch hẹn: {e}")
+        return False
+
 # HÀM CHECK LỊCH
+def format_conflicts(conflicts):
+    """Chuyển danh sách khoảng bận (BusyInterval) sang định dạng trả về cho frontend"""
+    details = availability_service.describe_conflicts(conflicts)
+    return [{
+        'malh': existing.malh,
+        'ngaygio': existing.start.strftime("%H:%M %d/%m/%Y"),
+        'end_time': existing.end.strftime("%H:%M"),
+        'services': details[existing.malh]['services']
+    } for existing in conflicts]
+
 def check_staff_availability(manv, ngaygio, thoiluong_minutes):
-    """Kiểm tra nhân viên có rảnh không"""
+    """
+    Kiểm tra nhân viên có rảnh không (chỉ mục giờ làm việc + lịch bận theo ngày).
+    Ngoài ca làm -> (False, []).
+    """
     if not manv:
         return True, [] 
     
-    end_time = ngaygio + timedelta(minutes=thoiluong_minutes)
-
-    is_available = True
-    conflicting_list = []
+    end = ngaygio + timedelta(minutes=thoiluong_minutes)
+    if not shift_service.is_on_shift(manv, ngaygio, end):
+        return False, []
     
-    all_staff_appointments = LichHen.query.filter(
-        and_(
-            LichHen.manv == manv,
-            LichHen.trangthai.in_(['confirmed', 'pending', 'in_progress'])
-        )
-    ).all()
+    conflicts = availability_service.find_conflicts(manv, ngaygio, thoiluong_minutes)
+    if not conflicts:
+        return True, []
 
-    for existing_apt in all_staff_appointments:
-        existing_duration = 0
-        for detail in existing_apt.chitiet:
-            if detail.dichvu and detail.dichvu.thoiluong:
-                existing_duration += detail.dichvu.thoiluong
-        
-        if existing_duration == 0:
-            existing_duration = 60
-            
-        existing_start = existing_apt.ngaygio
-        existing_end = existing_apt.ngaygio + timedelta(minutes=existing_duration)
-        
-        new_start = ngaygio
-        new_end = end_time
-        
-        if not (new_end <= existing_start or new_start >= existing_end):
-            is_available = False
-            conflicting_list.append({
-                'malh': existing_apt.malh,
-                'ngaygio': existing_apt.ngaygio.strftime("%H:%M %d/%m/%Y"),
-                'end_time': existing_end.strftime("%H:%M"),
-                'services': [detail.dichvu.tendv for detail in existing_apt.chitiet if detail.dichvu]
-            })
-    
-    return is_available, conflicting_list
+    return False, format_conflicts(conflicts)
 
 @appointment_bp.route("/create", methods=["POST"])
 @jwt_required()
@@ -186,74 +221,33 @@ def create_appointment():
             total_duration = 60
         
         
-        assigned_staff_manv = manv 
-
         if not manv:
             current_app.logger.info(f"Khách hàng {makh} yêu cầu tự sắp xếp. Bắt đầu tìm nhân viên rảnh...")
-            
-            available_staff_list = NhanVien.query.filter(
-                NhanVien.trangthai == True,
-                NhanVien.role == 'staff'
-            ).order_by(func.random()).all()
-            
-            if not available_staff_list:
-                current_app.logger.warning("Không tìm thấy nhân viên nào đang hoạt động.")
-                return jsonify({
-                    "success": False, 
-                    "message": "Không có nhân viên nào trong hệ thống. Vui lòng thử lại sau."
-                }), 404
-            
-            found_staff = False
-            for staff in available_staff_list:
-                is_available, _ = check_staff_availability(staff.manv, ngaygio, total_duration)
-                
-                if is_available:
-                    assigned_staff_manv = staff.manv
-                    found_staff = True
-                    current_app.logger.info(f"Đã tìm thấy nhân viên rảnh: {staff.hoten} (ID: {staff.manv})")
-                    break # Dừng vòng lặp
-            
-            if not found_staff:
+
+        # Kiểm tra + tạo lịch trong cùng giao dịch, có khóa theo (nhân viên, ngày)
+        try:
+            new_appointment = booking_service.book_appointment(
+                makh, ngaygio, dichvu_ids, total_duration, manv=manv, trangthai='confirmed'
+            )
+        except booking_service.BookingConflict as conflict:
+            db.session.rollback()
+            if not manv:
                 current_app.logger.warning(f"Không tìm thấy nhân viên nào rảnh vào lúc {ngaygio_str}")
                 return jsonify({
                     "success": False, 
                     "message": "Không có nhân viên rảnh vào khung giờ này. Vui lòng chọn giờ khác hoặc chọn nhân viên cụ thể."
                 }), 409
-        
-        else:
-            is_available, conflicts = check_staff_availability(manv, ngaygio, total_duration)
-            if not is_available:
-                staff = NhanVien.query.get(manv)
-                staff_name = staff.hoten if staff else "Nhân viên này"
-                return jsonify({
-                    "success": False,
-                    "message": f"{staff_name} đã bận trong khung giờ này!",
-                    "conflicts": conflicts
-                }), 409 
-
-        new_appointment = LichHen(
-            # pyrefly: ignore [unexpected-keyword]
-            makh=makh,
-            # pyrefly: ignore [unexpected-keyword]
-            ngaygio=ngaygio,
-            # pyrefly: ignore [unexpected-keyword]
-            manv=assigned_staff_manv, 
-            # pyrefly: ignore [unexpected-keyword]
-            trangthai='confirmed', 
-        )
-        db.session.add(new_appointment)
-        db.session.flush() 
-        
-        for madv in dichvu_ids:
-            detail = ChiTietLichHen(
-                # pyrefly: ignore [unexpected-keyword]
-                malh=new_appointment.malh,
-                # pyrefly: ignore [unexpected-keyword]
-                madv=madv
-            )
-            db.session.add(detail)
+            staff = NhanVien.query.get(manv)
+            staff_name = staff.hoten if staff else "Nhân viên này"
+            return jsonify({
+                "success": False,
+                "message": f"{staff_name} không có ca làm trong khung giờ này!" if conflict.off_shift
+                           else f"{staff_name} đã bận trong khung giờ này!",
+                "conflicts": format_conflicts(conflict.conflicts)
+            }), 409 
         
         db.session.commit()
+        assigned_staff_manv = new_appointment.manv
         
         staff = NhanVien.query.get(assigned_staff_manv) if assigned_staff_manv else None
         
@@ -285,6 +279,15 @@ def create_appointment():
             }
         }), 201
         
+    except IntegrityError as e:
+        db.session.rollback()
+        if availability_service.is_double_booking_error(e):
+            return jsonify({
+                "success": False,
+                "message": "Nhân viên vừa được đặt trong khung giờ này. Vui lòng chọn giờ khác!"
+            }), 409
+        current_app.logger.error(f"Error creating appointment: {e}")
+        return jsonify({"success": False, "message": "Đặt lịch thất bại. Vui lòng thử lại!"}), 500
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error creating appointment: {e}")
@@ -292,6 +295,137 @@ def create_appointment():
         traceback.print_exc() 
         return jsonify({"success": False, "message": "Đặt lịch thất bại. Vui lòng thử lại!"}), 500
 
+def _parse_madv_list(value):
+    """Danh sách mã dịch vụ (bỏ trùng, giữ thứ tự). Raise ValueError / TypeError nếu sai định dạng."""
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise TypeError("madv_list phải là mảng")
+    return list(dict.fromkeys(int(madv) for madv in value))
+
+@appointment_bp.route("/batch", methods=["POST"])
+@jwt_required()
+def create_appointment_batch():
+    """
+    Đặt nhiều lịch hẹn trong một giao dịch (tất cả hoặc không gì cả).
+    Body: {"items": [{"ngaygio", "madv_list", "manv"}, ...]}
+       hoặc {"ngaygio", "madv_list", "manv", "recurrence": {"freq": "weekly", "interval": 1, "count": 6}}
+    """
+    try:
+        identity = get_jwt_identity() 
+        makh = None
+        try:
+            identity_str = str(identity)
+            if ':' in identity_str:
+                makh = int(identity_str.split(':')[1])
+            else:
+                makh = int(identity_str)
+        except (IndexError, ValueError, TypeError) as e:
+            current_app.logger.error(f"Không thể parse makh từ JWT identity: {identity} - Lỗi: {e}")
+            return jsonify({"success": False, "message": "Định dạng token không hợp lệ"}), 401
+
+        customer = KhachHang.query.get(makh) if makh else None
+        if not customer:
+            return jsonify({"success": False, "message": "Không tìm thấy thông tin khách hàng"}), 401
+
+        data = request.get_json() or {}
+        try:
+            # madv / manv ép kiểu ngay tại đây: dữ liệu sai -> 400, không phải 500
+            if data.get("recurrence"):
+                base = datetime.strptime(data.get("ngaygio", ""), "%Y-%m-%dT%H:%M")
+                madv_list = _parse_madv_list(data.get("madv_list"))
+                manv = int(data["manv"]) if data.get("manv") else None
+                raw_items = [
+                    {"ngaygio": ngaygio, "madv_list": madv_list, "manv": manv}
+                    for ngaygio in booking_service.expand_recurrence(base, data["recurrence"])
+                ]
+            else:
+                raw_items = [{
+                    "ngaygio": datetime.strptime(item.get("ngaygio", ""), "%Y-%m-%dT%H:%M"),
+                    "madv_list": _parse_madv_list(item.get("madv_list")),
+                    "manv": int(item["manv"]) if item.get("manv") else None
+                } for item in data.get("items", [])]
+        except (ValueError, TypeError, AttributeError) as e:
+            return jsonify({"success": False, "message": f"Dữ liệu không hợp lệ: {e}"}), 400
+
+        if not raw_items:
+            return jsonify({"success": False, "message": "Không có lịch hẹn nào để đặt"}), 400
+        if len(raw_items) > booking_service.MAX_BATCH_ITEMS:
+            return jsonify({"success": False, "message": f"Tối đa {booking_service.MAX_BATCH_ITEMS} lịch hẹn mỗi lần đặt"}), 400
+
+        now = datetime.now()
+        all_madv = {madv for item in raw_items for madv in item["madv_list"]}
+        services = {s.madv: s for s in DichVu.query.filter(DichVu.madv.in_(all_madv)).all()} if all_madv else {}
+
+        items = []
+        for pos, item in enumerate(raw_items):
+            madv_list = item["madv_list"]
+            if not madv_list or any(madv not in services for madv in madv_list):
+                return jsonify({"success": False, "message": f"Lịch hẹn #{pos + 1}: dịch vụ không hợp lệ", "item": pos}), 400
+            if item["ngaygio"] < now:
+                return jsonify({"success": False, "message": f"Lịch hẹn #{pos + 1}: không thể đặt lịch trong quá khứ", "item": pos}), 400
+            items.append({
+                "ngaygio": item["ngaygio"],
+                "madv_list": madv_list,
+                "thoiluong_phut": sum(services[madv].thoiluong or 0 for madv in madv_list) or 60,
+                "manv": item["manv"]
+            })
+
+        try:
+            malh_list = booking_service.book_batch(makh, items, trangthai='confirmed')
+        except booking_service.BookingConflict as conflict:
+            db.session.rollback()
+            failed = items[conflict.item] if conflict.item is not None else None
+            when = failed["ngaygio"].strftime("%H:%M %d/%m/%Y") if failed else ""
+            return jsonify({
+                "success": False,
+                "message": f"Lịch hẹn #{(conflict.item or 0) + 1} ({when}): "
+                           f"{'nhân viên không có ca làm' if conflict.off_shift else 'không có nhân viên rảnh'}. Không lịch nào được đặt.",
+                "item": conflict.item,
+                "conflicts": format_conflicts(conflict.conflicts)
+            }), 409
+
+        db.session.commit()
+
+        names = dict(db.session.query(NhanVien.manv, NhanVien.hoten).filter(
+            NhanVien.manv.in_({item["manv"] for item in items})
+        ).all())
+        appointments = [{
+            "malh": malh,
+            "ngaygio": item["ngaygio"],
+            "end": item["end"],
+            "services": [services[madv].tendv for madv in item["madv_list"]],
+            "staff_name": names.get(item["manv"], "Sẽ được sắp xếp")
+        } for malh, item in zip(malh_list, items)]
+
+        if customer.email:
+            send_batch_confirmation_email(customer.email, customer.hoten, appointments)
+
+        return jsonify({
+            "success": True,
+            "message": f"Đặt thành công {len(appointments)} lịch hẹn!",
+            "appointments": [{
+                "malh": apt["malh"],
+                "ngaygio": apt["ngaygio"].isoformat(),
+                "trangthai": "confirmed",
+                "nhanvien": apt["staff_name"]
+            } for apt in appointments]
+        }), 201
+
+    except IntegrityError as e:
+        db.session.rollback()
+        if availability_service.is_double_booking_error(e):
+            return jsonify({
+                "success": False,
+                "message": "Nhân viên vừa được đặt trong khung giờ này. Vui lòng chọn giờ khác!"
+            }), 409
+        current_app.logger.error(f"Error creating appointment batch: {e}")
+        return jsonify({"success": False, "message": "Đặt lịch thất bại. Vui lòng thử lại!"}), 500
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error creating appointment batch: {e}")
+        return jsonify({"success": False, "message": "Đặt lịch thất bại. Vui lòng thử lại!"}), 500
+
 @appointment_bp.route("/my-appointments", methods=["GET"])
 @jwt_required()
 def get_my_appointments():
@@ -312,27 +446,22 @@ def get_my_appointments():
         if not makh:
              return jsonify({"success": False, "message": "Không tìm thấy mã khách hàng trong token"}), 401
         
-        appointments = LichHen.query.filter_by(makh=makh).order_by(LichHen.ngaygio.desc()).all()
+        appointments = db.session.query(
+            LichHen, NhanVien.hoten
+        ).outerjoin(
+            NhanVien, LichHen.manv == NhanVien.manv
+        ).filter(LichHen.makh == makh).order_by(LichHen.ngaygio.desc()).all()
         
         result = []
-        for apt in appointments:
-            services = []
-            for detail in apt.chitiet:
-                if detail.dichvu:
-                    services.append(detail.dichvu.tendv)
-            
+        for apt, nhanvien_hoten in appointments:
             staff_name = "Chưa phân công"
-            if apt.manv: 
-                if apt.nhanvien:
-                    staff_name = apt.nhanvien.hoten
-                else:
-                    staff = NhanVien.query.get(apt.manv)
-                    if staff: staff_name = staff.hoten
+            if apt.manv and nhanvien_hoten:
+                staff_name = nhanvien_hoten
 
             result.append({
                 "malh": apt.malh,
                 "ngaygio": apt.ngaygio.isoformat(),
-                "dichvu": ", ".join(services) if services else "Không có dịch vụ",
+                "dichvu": apt.ten_dichvu or "Không có dịch vụ",
                 "nhanvien": staff_name,
                 "trangthai": apt.trangthai,
             })
@@ -396,51 +525,168 @@ def cancel_my_appointment(malh):
 
 @appointment_bp.route("/available-slots", methods=["GET"])
 def get_available_slots():
-    """Lấy các khung giờ còn trống"""
+    """
+    Lấy các khung giờ còn trống.
+    Query: date (bắt buộc), madv hoặc madv_list (vd: 1,2,3), manv (tùy chọn), days (mặc định 1, tối đa 14).
+    - Có manv: khung giờ trống của nhân viên đó.
+    - Không có manv: khung giờ có ít nhất 1 nhân viên rảnh, kèm danh sách nhân viên rảnh.
+    """
     try:
         date_str = request.args.get("date")
-        madv = request.args.get("madv")
-        manv = request.args.get("manv")
+        madv_param = request.args.get("madv_list") or request.args.get("madv")
+        manv = request.args.get("manv", type=int)
+        days = request.args.get("days", default=1, type=int)
         
         if not date_str:
             return jsonify({"success": False, "message": "Thiếu ngày"}), 400
         
-        target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-
-        duration = 60 
-        if madv:
-            service = DichVu.query.get(madv)
-            if service:
-                duration = service.thoiluong if service.thoiluong else 60
-
-        slots = []
-        for hour in range(8, 18): 
-            for minute in [0, 30]:
-                time_str = f"{hour:02d}:{minute:02d}"
-                slot_datetime = datetime.combine(target_date, datetime.strptime(time_str, "%H:%M").time())
-                
-                if slot_datetime < datetime.now():
-                    slots.append({
-                        "time": time_str,
-                        "available": False
-                    })
-                    continue
-
-                is_available = True
-                if manv:
-                    is_available, _ = check_staff_availability(manv, slot_datetime, duration)
-                
-                slots.append({
-                    "time": time_str,
-                    "available": is_available
-                })
-        
-        return jsonify({"success": True, "slots": slots}), 200
+        try:
+            target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+            _, duration = appointment_service.parse_service_duration(madv_param)
+        except ValueError:
+            return jsonify({"success": False, "message": "Tham số không hợp lệ"}), 400
+        
+        days = max(1, min(days or 1, 14))
+        target_dates = [target_date + timedelta(days=i) for i in range(days)]
+
+        if manv:
+            staff_ids = [manv]
+        else:
+            staff_ids = [row.manv for row in db.session.query(NhanVien.manv).filter(
+                NhanVien.trangthai == True,
+                NhanVien.role == 'staff'
+            ).all()]
+
+        grid, version = availability_service.compute_slot_grid(target_dates, duration, staff_ids)
+
+        now = datetime.now()
+        days_result = []
+        for ngay in target_dates:
+            slots = []
+            for slot_datetime, free_staff in grid[ngay]:
+                slot = {
+                    "time": slot_datetime.strftime("%H:%M"),
+                    "available": slot_datetime >= now and bool(free_staff)
+                }
+                if not manv:
+                    slot["free_staff"] = free_staff if slot_datetime >= now else []
+                slots.append(slot)
+            days_result.append({"date": ngay.isoformat(), "slots": slots})
+
+        # Khung giờ quá khứ phụ thuộc thời điểm gọi -> đưa ngày giờ hiện tại (theo khung) vào version
+        version = f"{version}-{now.strftime('%Y%m%d%H')}{now.minute // availability_service.SLOT_STEP_MINUTES}"
+
+        response = jsonify({
+            "success": True,
+            "version": version,
+            "duration": duration,
+            "slots": days_result[0]["slots"],
+            "days": days_result
+        })
+        response.set_etag(version)
+        return response.make_conditional(request)
         
     except Exception as e:
         current_app.logger.error(f"Error getting available slots: {e}")
         return jsonify({"success": False, "message": "Lỗi lấy khung giờ"}), 500
     
+@appointment_bp.route("/availability", methods=["GET"])
+def get_availability_heatmap():
+    """
+    Heatmap lịch rảnh theo khung 15 phút.
+    Query: from, to (YYYY-MM-DD, tối đa 31 ngày), madv hoặc madv_list, manv (tùy chọn).
+    Mỗi ngày trả về mảng counts: counts[i] = số KTV có thể bắt đầu dịch vụ lúc i*15 phút.
+    """
+    try:
+        from_str = request.args.get("from")
+        to_str = request.args.get("to") or from_str
+        madv_param = request.args.get("madv_list") or request.args.get("madv")
+        manv = request.args.get("manv", type=int)
+
+        if not from_str:
+            return jsonify({"success": False, "message": "Thiếu ngày bắt đầu"}), 400
+
+        try:
+            from_date = datetime.strptime(from_str, "%Y-%m-%d").date()
+            to_date = datetime.strptime(to_str, "%Y-%m-%d").date()
+            _, duration = appointment_service.parse_service_duration(madv_param)
+        except ValueError:
+            return jsonify({"success": False, "message": "Tham số không hợp lệ"}), 400
+
+        if to_date < from_date or (to_date - from_date).days > 30:
+            return jsonify({"success": False, "message": "Khoảng ngày không hợp lệ (tối đa 31 ngày)"}), 400
+
+        now = datetime.now()
+        days, version = availability_bitmap.heatmap(
+            from_date, to_date, duration, [manv] if manv else None, now=now
+        )
+        version = f"{version}-{now.strftime('%Y%m%d%H')}{now.minute // availability_bitmap.SLOT_MINUTES}"
+
+        response = jsonify({
+            "success": True,
+            "version": version,
+            "duration": duration,
+            "slot_minutes": availability_bitmap.SLOT_MINUTES,
+            "days": [{"date": ngay.isoformat(), "counts": counts.tolist()} for ngay, counts in days]
+        })
+        response.set_etag(version)
+        return response.make_conditional(request)
+
+    except Exception as e:
+        current_app.logger.error(f"Error building availability heatmap: {e}")
+        return jsonify({"success": False, "message": "Lỗi lấy lịch rảnh"}), 500
+
+@appointment_bp.route("/next-free-slots", methods=["GET"])
+def get_next_free_slots():
+    """
+    Tìm các khung giờ trống sớm nhất cho một giỏ dịch vụ.
+    Query: madv hoặc madv_list (bắt buộc), manv (tùy chọn), from (YYYY-MM-DD, mặc định hôm nay),
+           days (mặc định 14, tối đa 60), limit (mặc định 5, tối đa 20).
+    """
+    try:
+        madv_param = request.args.get("madv_list") or request.args.get("madv")
+        manv = request.args.get("manv", type=int)
+        from_str = request.args.get("from")
+        days = max(1, min(request.args.get("days", default=14, type=int) or 14, 60))
+        limit = max(1, min(request.args.get("limit", default=5, type=int) or 5, 20))
+
+        try:
+            madv_ids, duration = appointment_service.parse_service_duration(madv_param)
+            from_date = datetime.strptime(from_str, "%Y-%m-%d").date() if from_str else None
+        except ValueError:
+            return jsonify({"success": False, "message": "Tham số không hợp lệ"}), 400
+
+        if not madv_ids:
+            return jsonify({"success": False, "message": "Thiếu dịch vụ"}), 400
+
+        now = datetime.now()
+        start_from = max(now, datetime.combine(from_date, datetime.min.time())) if from_date else now
+
+        found, complete = appointment_service.find_next_free_slots(
+            duration, start_from, days=days, manv=manv, limit=limit,
+            budget_ms=current_app.config.get("SLOT_SEARCH_BUDGET_MS")
+        )
+
+        names = dict(db.session.query(NhanVien.manv, NhanVien.hoten).filter(
+            NhanVien.manv.in_({m for _, _, m in found})
+        ).all()) if found else {}
+
+        return jsonify({
+            "success": True,
+            "duration": duration,
+            "complete": complete,
+            "slots": [{
+                "manv": slot_manv,
+                "staff_name": names.get(slot_manv),
+                "ngaygio": start.strftime("%Y-%m-%dT%H:%M"),
+                "end_time": end.strftime("%H:%M")
+            } for start, end, slot_manv in found]
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Error searching next free slots: {e}")
+        return jsonify({"success": False, "message": "Lỗi tìm khung giờ trống"}), 500
+
 @appointment_bp.route("/check-availability", methods=["POST"])
 @jwt_required(optional=True) 
 def api_check_staff_availability():
@@ -475,7 +721,7 @@ def api_check_staff_availability():
             return jsonify({
                 "success": True, 
                 "available": False,
-                "message": "Nhân viên đã bận",
+                "message": "Nhân viên đã bận" if conflicts else "Nhân viên không có ca làm trong khung giờ này",
                 "conflicts": conflicts
             }), 200
             
@@ -1,8 +1,8 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from ..extensions import db
-from ..models import Hoithoai, KhachHang, NhanVien
-from ..services import chat_service
+from ..models import Hoithoai, KhachHang, NhanVien, TepDinhKem
+from ..services import chat_service, attachment_service
 
 chat_bp = Blueprint("chat", __name__, url_prefix="/api/chat")
 
@@ -24,17 +24,35 @@ def get_current_user_from_jwt():
 @chat_bp.route("/conversations", methods=["GET"])
 @jwt_required()
 def get_my_conversations():
+    """
+    Hộp thư, mới nhất trước. Query: limit (mặc định 50), cursor (= next_cursor trang trước),
+    unread_only, assigned_to ('me' | 'none' | manv - chỉ cho lễ tân / quản lý).
+    """
     user, user_type = get_current_user_from_jwt()
     
     if not user:
         return jsonify({"success": False, "message": "Người dùng không tồn tại"}), 404
     
+    limit = request.args.get("limit", type=int)
+    if limit is not None and limit <= 0:
+        return jsonify({"success": False, "message": "limit phải lớn hơn 0"}), 400
+    unread_only = request.args.get("unread_only", "").lower() in ("1", "true", "yes")
+    assigned_to = request.args.get("assigned_to") or None
+    if assigned_to not in (None, "me", "none") and not assigned_to.isdigit():
+        return jsonify({"success": False, "message": "assigned_to phải là 'me', 'none' hoặc mã nhân viên"}), 400
+    
     try:
-        conversations = chat_service.get_conversations_for_user(user, user_type)
+        conversations, next_cursor = chat_service.get_conversations_for_user(
+            user, user_type, limit=limit, cursor=request.args.get("cursor"),
+            unread_only=unread_only, assigned_to=assigned_to
+        )
         return jsonify({
             "success": True,
-            "conversations": conversations
+            "conversations": conversations,
+            "next_cursor": next_cursor
         }), 200
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Lỗi khi lấy hội thoại: {e}", exc_info=True)
         return jsonify({"success": False, "message": "Lỗi hệ thống"}), 500
@@ -70,12 +88,25 @@ def start_conversation():
 @chat_bp.route("/conversations/<int:maht>/messages", methods=["GET"])
 @jwt_required()
 def get_conversation_messages(maht):
-    """Lấy tin nhắn trong một cuộc trò chuyện."""
+    """
+    Lấy tin nhắn trong một cuộc trò chuyện.
+    Query: since_matn (chỉ tin mới) | before_matn (trang cũ hơn), limit (mặc định 50).
+    Không có tham số = trang cuối cùng.
+    """
     user, user_type = get_current_user_from_jwt()
+    since_matn = request.args.get("since_matn", type=int)
+    before_matn = request.args.get("before_matn", type=int)
+    limit = request.args.get("limit", type=int)
+    if since_matn is not None and before_matn is not None:
+        return jsonify({"success": False, "message": "Chỉ dùng since_matn hoặc before_matn"}), 400
+    if limit is not None and limit <= 0:
+        return jsonify({"success": False, "message": "limit phải lớn hơn 0"}), 400
     
     try:
-        messages, _ = chat_service.get_messages_for_conversation(maht, user, user_type)
-        return jsonify({"success": True, "messages": messages}), 200
+        messages, _, has_more = chat_service.get_messages_for_conversation(
+            maht, user, user_type, since_matn=since_matn, before_matn=before_matn, limit=limit
+        )
+        return jsonify({"success": True, "messages": messages, "has_more": has_more}), 200
     except PermissionError as e:
         return jsonify({"success": False, "message": str(e)}), 403
     except Exception as e:
@@ -94,8 +125,8 @@ def send_message(maht):
         return jsonify({"success": False, "message": "Nội dung không được trống"}), 400
     
     try:
-        # Kiểm tra quyền và lấy hội thoại
-        _, conversation = chat_service.get_messages_for_conversation(maht, user, user_type)
+        # Kiểm tra quyền và lấy hội thoại (không ghi DB)
+        conversation = chat_service.get_conversation_for_user(maht, user, user_type)
         
         # Gửi tin nhắn và cập nhật hội thoại
         new_message = chat_service.send_message_as_user(conversation, noidung, user, user_type)
@@ -112,4 +143,181 @@ def send_message(maht):
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Lỗi khi gửi tin nhắn: {e}", exc_info=True)
-        return jsonify({"success": False, "message": "Lỗi hệ thống"}), 500
\ No newline at end of file
+        return jsonify({"success": False, "message": "Lỗi hệ thống"}), 500
+
+@chat_bp.route("/conversations/<int:maht>/attachments", methods=["POST"])
+@jwt_required()
+def send_attachment(maht):
+    """
+    Gửi ảnh / PDF. Thân request là nội dung tệp (fetch(url, {body: file})), không multipart:
+    server ghi thẳng xuống đĩa từng khúc. Query: filename, caption (tùy chọn).
+    """
+    user, user_type = get_current_user_from_jwt()
+    if not user:
+        return jsonify({"success": False, "message": "Người dùng không tồn tại"}), 404
+
+    max_bytes = current_app.config['ATTACHMENT_MAX_BYTES']
+    # Báo quá lớn ngay từ header, không đọc thân request
+    if request.content_length is not None and request.content_length > max_bytes:
+        return jsonify({"success": False, "message": f"Tệp vượt quá {max_bytes // (1024 * 1024)} MB"}), 413
+    filename = (request.args.get("filename") or "").strip() or "tep"
+    caption = (request.args.get("caption") or "").strip()
+
+    try:
+        conversation = chat_service.get_conversation_for_user(maht, user, user_type)
+    except PermissionError as e:
+        return jsonify({"success": False, "message": str(e)}), 403
+
+    upload = None
+    try:
+        relative, mime, size = attachment_service.save_stream(request.stream, max_bytes)
+        upload = (relative, mime, size, filename)
+        new_message, attachment = chat_service.send_attachment_as_user(
+            conversation, upload, caption, user, user_type
+        )
+        db.session.commit()
+        if mime.startswith('image/'):
+            attachment_service.schedule_thumbnail(current_app._get_current_object(), attachment.matdk)
+        return jsonify({
+            "success": True,
+            "message": "Gửi tệp thành công",
+            "matn": new_message.matn,
+            "attachment": attachment_service.to_dict(attachment)
+        }), 201
+    except attachment_service.AttachmentRejected as e:
+        return jsonify({"success": False, "message": str(e)}), e.status
+    except Exception as e:
+        db.session.rollback()
+        if upload is not None:
+            attachment_service.discard_file(upload[0])
+        current_app.logger.error(f"Lỗi khi gửi tệp: {e}", exc_info=True)
+        return jsonify({"success": False, "message": "Lỗi hệ thống"}), 500
+
+def _serve_attachment(matdk, thumbnail):
+    if not attachment_service.verify_signature(matdk, request.args.get("sig")):
+        return jsonify({"success": False, "message": "Liên kết không hợp lệ"}), 403
+    attachment = TepDinhKem.query.get(matdk)
+    path = attachment_service.file_path(attachment, thumbnail) if attachment else None
+    if path is None:
+        return jsonify({"success": False, "message": "Không tìm thấy tệp"}), 404
+
+    serving_thumbnail = thumbnail and attachment.anhnho is not None
+    is_image = attachment.loai.startswith('image/')
+    # conditional=True: ETag / If-None-Match và Range (206) cho tệp lớn
+    response = send_file(
+        path, mimetype='image/webp' if serving_thumbnail else attachment.loai,
+        as_attachment=not is_image, download_name=attachment.tenfile,
+        conditional=True, etag=f"{matdk}-{'t' if serving_thumbnail else 'o'}"
+    )
+    if thumbnail and not serving_thumbnail:
+        # Ảnh nhỏ chưa tạo xong: trả ảnh gốc, không cho cache lâu
+        response.headers['Cache-Control'] = 'private, no-cache'
+    else:
+        max_age = current_app.config['ATTACHMENT_CACHE_MAX_AGE']
+        response.headers['Cache-Control'] = f'private, max-age={max_age}, immutable'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+@chat_bp.route("/attachments/<int:matdk>", methods=["GET"])
+def download_attachment(matdk):
+    """Tải tệp đính kèm. Không dùng JWT (thẻ <img> không gửi header): xác thực bằng ?sig=."""
+    return _serve_attachment(matdk, thumbnail=False)
+
+@chat_bp.route("/attachments/<int:matdk>/thumbnail", methods=["GET"])
+def download_attachment_thumbnail(matdk):
+    """Ảnh nhỏ (WebP, tối đa 320px) của tệp ảnh; chưa có thì trả ảnh gốc."""
+    return _serve_attachment(matdk, thumbnail=True)
+
+@chat_bp.route("/conversations/<int:maht>/read", methods=["POST"])
+@jwt_required()
+def mark_conversation_read(maht):
+    """
+    Biên nhận đã đọc: đánh dấu đã đọc các tin của phía bên kia tới read_up_to_matn
+    (matn lớn nhất client đã hiển thị).
+    """
+    user, user_type = get_current_user_from_jwt()
+    data = request.get_json(silent=True) or {}
+    read_up_to_matn = data.get("read_up_to_matn")
+    
+    if not isinstance(read_up_to_matn, int) or isinstance(read_up_to_matn, bool) or read_up_to_matn <= 0:
+        return jsonify({"success": False, "message": "read_up_to_matn phải là số nguyên dương"}), 400
+    
+    try:
+        marked = chat_service.mark_read(maht, user, user_type, read_up_to_matn)
+        return jsonify({"success": True, "marked": marked}), 200
+    except PermissionError as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 403
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Lỗi khi đánh dấu đã đọc: {e}", exc_info=True)
+        return jsonify({"success": False, "message": "Lỗi hệ thống"}), 500
+
+@chat_bp.route("/search", methods=["GET"])
+@jwt_required()
+def search_messages():
+    """
+    Tìm tin nhắn (không phân biệt dấu). Query: q, maht (tùy chọn, trong một hội thoại),
+    before_matn (= next_before của trang trước), limit (mặc định 20).
+    snippet là HTML đã escape, từ khớp nằm trong <mark>.
+    """
+    user, user_type = get_current_user_from_jwt()
+    if not user:
+        return jsonify({"success": False, "message": "Người dùng không tồn tại"}), 404
+
+    viewer = chat_service.viewer_for(user, user_type)
+    if viewer is None:
+        return jsonify({"success": False, "message": "Bạn không có quyền truy cập chức năng chat"}), 403
+
+    q = (request.args.get("q") or "").strip()
+    if len(q) < chat_service.SEARCH_MIN_LENGTH:
+        return jsonify({"success": False, "message": f"Từ khóa tối thiểu {chat_service.SEARCH_MIN_LENGTH} ký tự"}), 400
+    limit = request.args.get("limit", type=int)
+    if limit is not None and limit <= 0:
+        return jsonify({"success": False, "message": "limit phải lớn hơn 0"}), 400
+
+    try:
+        results, next_before = chat_service.search_messages(
+            viewer, q[:200], maht=request.args.get("maht", type=int),
+            before_matn=request.args.get("before_matn", type=int), limit=limit
+        )
+        return jsonify({"success": True, "results": results, "next_before": next_before}), 200
+    except Exception as e:
+        current_app.logger.error(f"Lỗi khi tìm tin nhắn: {e}", exc_info=True)
+        return jsonify({"success": False, "message": "Lỗi hệ thống"}), 500
+
+@chat_bp.route("/stream", methods=["GET"])
+@jwt_required()
+def stream():
+    """
+    Server-Sent Events: tin nhắn mới ("message"), đã đọc ("read"), đổi người phụ trách
+    ("assignment") của các hội thoại user được xem. Heartbeat là dòng chú thích ": ping".
+    Kết nối lại gửi header Last-Event-ID (= matn cuối đã nhận) để nhận bù tin nhắn.
+    """
+    user, user_type = get_current_user_from_jwt()
+    if not user:
+        return jsonify({"success": False, "message": "Người dùng không tồn tại"}), 404
+
+    viewer = chat_service.viewer_for(user, user_type)
+    if viewer is None:
+        return jsonify({"success": False, "message": "Bạn không có quyền truy cập chức năng chat"}), 403
+
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    try:
+        events = chat_service.open_stream(viewer, last_event_id)
+    except Exception as e:
+        current_app.logger.error(f"Lỗi khi mở luồng chat: {e}", exc_info=True)
+        return jsonify({"success": False, "message": "Lỗi hệ thống"}), 500
+    finally:
+        # Trả kết nối DB về pool trước khi giữ kết nối HTTP lâu dài
+        db.session.close()
+
+    return Response(events, mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",   # nginx: không đệm response
+    })
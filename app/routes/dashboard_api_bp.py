@@ -130,26 +130,24 @@ def get_today_appointments():
     try:
         today = date.today()
         
-        appointments = LichHen.query.filter(
+        appointments = db.session.query(
+            LichHen, KhachHang.hoten, NhanVien.hoten
+        ).outerjoin(
+            KhachHang, LichHen.makh == KhachHang.makh
+        ).outerjoin(
+            NhanVien, LichHen.manv == NhanVien.manv
+        ).filter(
             func.date(LichHen.ngaygio) == today
         ).order_by(LichHen.ngaygio).all()
         
         result = []
-        for apt in appointments:
-            # Lấy tên dịch vụ
-            dichvu_ten = "N/A"
-            dichvu_count = len(apt.chitiet)
-            if dichvu_count > 0 and apt.chitiet[0].dichvu:
-                dichvu_ten = apt.chitiet[0].dichvu.tendv
-                if dichvu_count > 1:
-                    dichvu_ten += f" (+{dichvu_count - 1})"
-            
+        for apt, khachhang_hoten, nhanvien_hoten in appointments:
             result.append({
                 "malh": apt.malh,
                 "ngaygio": apt.ngaygio.isoformat(),
-                "khachhang_hoten": apt.khachhang.hoten if apt.khachhang else "Khách vãng lai",
-                "dichvu_ten": dichvu_ten,
-                "nhanvien_hoten": apt.nhanvien.hoten if apt.nhanvien else "Chưa gán",
+                "khachhang_hoten": khachhang_hoten or "Khách vãng lai",
+                "dichvu_ten": apt.nhan_dichvu or "N/A",
+                "nhanvien_hoten": nhanvien_hoten or "Chưa gán",
                 "trangthai": apt.trangthai
             })
         
@@ -173,26 +171,22 @@ def get_my_schedule_today():
         staff = g.current_user
         today = date.today()
         
-        appointments = LichHen.query.filter(
+        appointments = db.session.query(
+            LichHen, KhachHang.hoten
+        ).outerjoin(
+            KhachHang, LichHen.makh == KhachHang.makh
+        ).filter(
             LichHen.manv == staff.manv,
             func.date(LichHen.ngaygio) == today
         ).order_by(LichHen.ngaygio).all()
         
         result = []
-        for apt in appointments:
-            # Lấy tên dịch vụ
-            dichvu_ten = "N/A"
-            dichvu_count = len(apt.chitiet)
-            if dichvu_count > 0 and apt.chitiet[0].dichvu:
-                dichvu_ten = apt.chitiet[0].dichvu.tendv
-                if dichvu_count > 1:
-                    dichvu_ten += f" (+{dichvu_count - 1})"
-            
+        for apt, khachhang_hoten in appointments:
             result.append({
                 "malh": apt.malh,
                 "ngaygio": apt.ngaygio.isoformat(),
-                "khachhang_hoten": apt.khachhang.hoten if apt.khachhang else "Khách vãng lai",
-                "dichvu_ten": dichvu_ten,
+                "khachhang_hoten": khachhang_hoten or "Khách vãng lai",
+                "dichvu_ten": apt.nhan_dichvu or "N/A",
                 "trangthai": apt.trangthai
             })
         
@@ -0,0 +1,26 @@
+from flask import Blueprint, request, jsonify, current_app, g
+from ..decorators import login_required
+from ..services import notification_service
+
+notification_bp = Blueprint("notification", __name__, url_prefix="/api/notifications")
+
+
+@notification_bp.route("/summary", methods=["GET"])
+@login_required
+def get_notification_summary():
+    """
+    Mọi số đếm badge của người dùng hiện tại trong một request (xem notification_service).
+    Có ETag: client gửi If-None-Match (trình duyệt tự làm với fetch) và nhận 304 khi không đổi.
+    """
+    try:
+        counts, etag = notification_service.get_summary(g.current_user, g.current_user_type)
+    except Exception as e:
+        current_app.logger.error(f"Lỗi khi lấy số đếm thông báo: {e}", exc_info=True)
+        return jsonify({"success": False, "message": "Lỗi hệ thống"}), 500
+
+    response = jsonify({"success": True, "counts": counts})
+    response.set_etag(etag)
+    # Luôn hỏi lại server (rẻ: 304), không dùng chung cache giữa các tài khoản
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Authorization')
+    return response.make_conditional(request)
@@ -1,13 +1,14 @@
 # app/routes/profile_bp.py
 import datetime
-from flask import Blueprint, request, jsonify, current_app, g, send_from_directory
+from flask import Blueprint, request, jsonify, current_app, g, send_from_directory, redirect, abort
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from ..extensions import db
 from ..models import CaLam, Luong, nhanvien_calam, NhanVien, KhachHang
 from ..decorators import login_required, roles_required
+from ..services import image_service, storage_service, file_service
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
-from werkzeug.utils import secure_filename
+import posixpath
 from datetime import datetime
 
 profile_bp = Blueprint("profile", __name__, url_prefix="/api/profile")
@@ -96,43 +97,75 @@ def upload_avatar():
     if file.filename == '':
         return jsonify({"success": False, "message": "Không chọn file nào"}), 400
 
-    upload_folder = current_app.config.get('UPLOAD_FOLDER')
-    if not upload_folder:
-        current_app.logger.error("UPLOAD_FOLDER không được cấu hình!")
-        return jsonify({"success": False, "message": "Lỗi cấu hình máy chủ"}), 500
-    
-    os.makedirs(upload_folder, exist_ok=True)
+    # Lưu theo nội dung (ảnh trùng chỉ lưu một lần), ảnh cũ bớt một tham chiếu
+    field = 'anhdaidien' if user_type == 'customer' else 'anhnhanvien'
+    old_key = getattr(user, field)
+    key = None
+    try:
+        key = storage_service.store(file.stream, max_bytes=current_app.config['AVATAR_MAX_BYTES'])
+        setattr(user, field, key)
+        orphaned = storage_service.release(old_key)
+        db.session.commit()
+    except storage_service.UploadRejected as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), e.status
+    except Exception as e:
+        db.session.rollback()
+        storage_service.purge(key)
+        current_app.logger.error(f"Lỗi lưu file avatar: {e}")
+        return jsonify({"success": False, "message": "Lưu file thất bại"}), 500
 
-    if file:
-        filename = secure_filename(f"{user_type}_{user.taikhoan}_{file.filename}")
-        path = os.path.join(upload_folder, filename)
-        
-        try:
-            file.save(path)
-            if user_type == 'customer':
-                user.anhdaidien = filename
-            elif user_type == 'staff':
-                user.anhnhanvien = filename
-            db.session.commit()
-            return jsonify({"success": True, "message": "Upload ảnh thành công", "filename": filename}), 200
-        except Exception as e:
-            db.session.rollback()
-            current_app.logger.error(f"Lỗi lưu file avatar: {e}")
-            return jsonify({"success": False, "message": "Lưu file thất bại"}), 500
+    if orphaned:
+        storage_service.purge(old_key)
+    if not storage_service.get_backend().remote:
+        image_service.schedule_file_variants(current_app._get_current_object(), key)
+    return jsonify({"success": True, "message": "Upload ảnh thành công", "filename": key}), 200
+
+# Tệp đính kèm chat từng lưu ở uploads/chat/ (trước khi ATTACHMENT_FOLDER tách khỏi
+# UPLOAD_FOLDER): không bao giờ phục vụ qua route ảnh đại diện công khai
+PRIVATE_PREFIXES = ('chat/',)
+
+# Ảnh mặc định cho ảnh đại diện thiếu: cache ngắn (người dùng có thể tải ảnh lên ngay sau đó)
+DEFAULT_AVATAR_MAX_AGE = 300
+
+def _default_avatar():
+    static_images = os.path.join(current_app.root_path, 'static', 'images')
+    return send_from_directory(static_images, 'default-avatar.svg', max_age=DEFAULT_AVATAR_MAX_AGE)
 
 @profile_bp.route("/avatar/<path:filename>", methods=["GET"])
 def get_avatar(filename):
-    upload_folder = current_app.config.get('UPLOAD_FOLDER')
-    static_images = os.path.join(current_app.root_path, 'static', 'images')
-    
+    """
+    Ảnh đại diện (file_service: X-Accel-Redirect / X-Sendfile nếu cấu hình, ETag mạnh,
+    cache vĩnh viễn với tên tệp theo nội dung). Thiếu tệp -> ảnh mặc định.
+    """
     if not filename or filename in ['placeholder.png', 'default-avatar.png', 'null', 'undefined', 'None']:
-        return send_from_directory(static_images, 'default-avatar.svg')
-    
-    filepath = os.path.join(upload_folder, filename) if upload_folder else None
-    if not filepath or not os.path.exists(filepath):
-        return send_from_directory(static_images, 'default-avatar.svg')
+        return _default_avatar()
+    # chuẩn hoá trước khi so (x/../chat/... cũng trỏ vào chat/)
+    if posixpath.normpath(filename.replace('\\', '/')).lstrip('/').startswith(PRIVATE_PREFIXES):
+        abort(404)
+
+    filepath = file_service.resolve(filename)
+    if filepath is None:
+        # Backend S3: ảnh mới không nằm trên đĩa, chuyển hướng tới URL ký sẵn
+        if storage_service.get_backend().remote and storage_service.is_content_key(filename):
+            return redirect(storage_service.remote_url(filename))
+        return _default_avatar()
+    immutable = storage_service.is_content_key(filename)
+
+    # ?w=<px>: biến thể thu nhỏ (WebP / JPEG theo Accept); chưa có thì trả ảnh gốc
+    # nhưng không cho cache dài hạn - lần sau trình duyệt hỏi lại và nhận biến thể
+    width = request.args.get("w", type=int)
+    if width and width > 0:
+        variant = image_service.file_variant(filename, width, request.headers.get("Accept"))
+        variant_path = file_service.resolve(variant[0]) if variant is not None else None
+        if variant_path is not None:
+            response = file_service.send_upload(variant[0], variant_path, immutable, mimetype=variant[1])
+        else:
+            response = file_service.send_upload(filename, filepath, immutable=False)
+        response.vary.add('Accept')
+        return response
 
-    return send_from_directory(upload_folder, filename)
+    return file_service.send_upload(filename, filepath, immutable)
 
 @profile_bp.route("/change-password", methods=["PUT"])
 @jwt_required()
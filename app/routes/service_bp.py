@@ -1,6 +1,6 @@
-from flask import Blueprint, jsonify, current_app, render_template
+from flask import Blueprint, Response, jsonify, current_app, render_template, request, send_file
 from ..models import DichVu
-import base64
+from ..services import image_service
 
 service_bp = Blueprint("service", __name__)
 
@@ -24,27 +24,14 @@ def get_services():
         result = []
         for s in active_services:
             try:
-                # Xử lý ảnh dịch vụ an toàn
-                image_data = None
-                if s.anhdichvu:
-                    try:
-                        if isinstance(s.anhdichvu, bytes):
-                            # Nếu là bytes, decode thành string
-                            image_data = base64.b64encode(s.anhdichvu).decode('utf-8')
-                        else:
-                            # Nếu đã là string
-                            image_data = s.anhdichvu
-                    except Exception as img_error:
-                        current_app.logger.warning(f"Lỗi xử lý ảnh dịch vụ {s.madv}: {img_error}")
-                        image_data = None
-                
+                # Chỉ trả URL ảnh (trình duyệt cache riêng từng ảnh), không nhúng base64
                 service_dict = {
                     "madv": s.madv, 
                     "tendv": s.tendv, 
                     "gia": str(s.gia), 
                     "thoiluong": s.thoiluong,
                     "mota": s.mota if s.mota else "",
-                    "anhdichvu": image_data
+                    "anhdichvu_url": image_service.service_image_url(s)
                 }
                 result.append(service_dict)
                 
@@ -90,17 +77,6 @@ def get_service_details(service_id):
                 "msg": "Không tìm thấy dịch vụ"
             }), 404
         
-        # Xử lý ảnh dịch vụ
-        image_data = None
-        if service.anhdichvu:
-            try:
-                if isinstance(service.anhdichvu, bytes):
-                    image_data = base64.b64encode(service.anhdichvu).decode('utf-8')
-                else:
-                    image_data = service.anhdichvu
-            except Exception as img_error:
-                current_app.logger.warning(f"Lỗi xử lý ảnh dịch vụ {service_id}: {img_error}")
-        
         response_data = {
             "success": True,
             "service": {
@@ -111,7 +87,7 @@ def get_service_details(service_id):
                 "donvitinh": service.donvitinh,
                 "mota": service.mota if service.mota else "", 
                 "active": service.active,
-                "anhdichvu": image_data
+                "anhdichvu_url": image_service.service_image_url(service)
             }
         }
         
@@ -126,3 +102,52 @@ def get_service_details(service_id):
             "msg": "Lỗi máy chủ nội bộ khi lấy chi tiết dịch vụ",
             "error": str(e)  # Chỉ để debug
         }), 500
+
+@service_bp.route("/<int:service_id>/image", methods=["GET"])
+def get_service_image(service_id):
+    """
+    Ảnh dịch vụ. ETag = md5 nội dung: If-None-Match khớp thì trả 304 mà không đọc blob.
+    URL kèm ?v=<hash> đúng hash hiện tại (URL trong danh sách dịch vụ) được cache vĩnh viễn.
+    ?w=<px>: biến thể WebP (nếu Accept có image/webp) / JPEG gần nhất với chiều rộng đó.
+    """
+    try:
+        digest = image_service.service_image_hash(service_id)
+        if digest is None:
+            return jsonify({"success": False, "msg": "Dịch vụ không có ảnh"}), 404
+
+        cacheable = request.args.get("v") == digest
+        width = request.args.get("w", type=int)
+        variant = None
+        if width and width > 0:
+            variant = image_service.service_variant(service_id, digest, width, request.headers.get("Accept"))
+            # Biến thể chưa tạo xong: trả ảnh gốc nhưng không cho cache lâu ở URL này
+            cacheable = cacheable and variant is not None
+
+        if variant is not None:
+            path, mimetype, variant_width = variant
+            etag = f"{digest}-w{variant_width}-{mimetype.split('/')[1]}"
+        else:
+            etag = digest
+
+        # Client đã có đúng ảnh này: 304 mà không kéo blob từ DB
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+        elif variant is not None:
+            response = send_file(path, mimetype=mimetype, conditional=True, etag=etag)
+        else:
+            data = image_service.service_image_data(service_id) or b''
+            response = Response(data, mimetype=image_service.image_mimetype(data))
+            response.set_etag(etag)
+            response = response.make_conditional(request)
+
+        if cacheable:
+            response.headers['Cache-Control'] = f'public, max-age={image_service.IMAGE_MAX_AGE}, immutable'
+        else:
+            response.headers['Cache-Control'] = 'public, no-cache'
+        if width:
+            response.vary.add('Accept')
+        return response
+    except Exception as e:
+        current_app.logger.error(f"Lỗi khi lấy ảnh dịch vụ {service_id}: {e}")
+        return jsonify({"success": False, "msg": "Lỗi máy chủ nội bộ"}), 500
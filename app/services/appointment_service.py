@@ -1,82 +1,180 @@
 # app/services/appointment_service.py
+import heapq
+import random
+import time
+from datetime import datetime, timedelta
+
 from flask import current_app
+from sqlalchemy import func
+
 from ..extensions import db
-from ..models import NhanVien, LichHen, ChiTietLichHen, CaLam, nhanvien_calam
-from sqlalchemy import func, case, outerjoin
-from datetime import datetime
+from ..models import DichVu, NhanVien
+from . import availability_service, shift_service
+
+
+def parse_service_duration(madv_param):
+    """
+    Query madv / madv_list dạng "1,2,3" -> (madv_ids, tổng thời lượng phút).
+    Không có dịch vụ hoặc tổng bằng 0 -> DEFAULT_DURATION. Raise ValueError nếu mã không phải số.
+    """
+    madv_ids = [int(x) for x in madv_param.split(',') if x.strip()] if madv_param else []
+    duration = 0
+    if madv_ids:
+        duration = db.session.query(
+            func.coalesce(func.sum(DichVu.thoiluong), 0)
+        ).filter(DichVu.madv.in_(madv_ids)).scalar() or 0
+    return madv_ids, duration or availability_service.DEFAULT_DURATION
+
+
+def rank_working_staff(booking_date):
+    """
+    KTV có ca trong ngày, sắp xếp theo chính sách công bằng:
+    ít phút đã được đặt trong ngày nhất lên trước (hòa thì ngẫu nhiên).
+    Trả về list (manv, booked_minutes, appointment_count).
+    """
+    windows = shift_service.get_windows([booking_date])[booking_date]
+    if not windows:
+        return []
+    indexes = availability_service.get_day_indexes(list(windows.keys()), booking_date)
+    ranked = [
+        (manv, indexes[(manv, booking_date)].booked_minutes(), len(indexes[(manv, booking_date)]))
+        for manv in windows
+    ]
+    ranked.sort(key=lambda item: (item[1], random.random()))
+    return ranked
+
 
-def get_available_staff_by_date(booking_date):
+def find_free_staff(ngaygio, thoiluong_phut):
+    """
+    Động cơ phân công: tìm các KTV rảnh cho khoảng [ngaygio, ngaygio + thoiluong).
+    - Ca làm (CaLam) phải bao trùm toàn bộ khoảng thời gian.
+    - Không trùng lịch hẹn đang hoạt động (chỉ mục lịch bận trong bộ nhớ).
+    Tổng cộng tối đa 2 truy vấn, không phụ thuộc số nhân viên.
+    Trả về list manv theo thứ tự ưu tiên (ít phút đã đặt trong ngày nhất trước).
     """
-    Lấy danh sách nhân viên Kỹ thuật viên (role='staff') làm việc trong ngày, 
-    sắp xếp theo số lịch hẹn ít nhất.
+    booking_date = ngaygio.date()
+    end = ngaygio + timedelta(minutes=thoiluong_phut)
+
+    windows = shift_service.get_windows([booking_date])[booking_date]
+    on_shift = [manv for manv, ranges in windows.items() if shift_service.covers(ranges, ngaygio, end)]
+    if not on_shift:
+        return []
+
+    indexes = availability_service.get_day_indexes(on_shift, booking_date)
+    free = []
+    for manv in on_shift:
+        idx = indexes[(manv, booking_date)]
+        if idx.is_free(ngaygio, end):
+            free.append((idx.booked_minutes(), random.random(), manv))
+    free.sort()
+    return [manv for _, _, manv in free]
+
+
+def _aligned(moment, step_minutes):
+    """Làm tròn lên tới mốc step_minutes gần nhất tính từ 0h."""
+    minutes = moment.hour * 60 + moment.minute + (1 if moment.second or moment.microsecond else 0)
+    rounded = -(-minutes // step_minutes) * step_minutes
+    return datetime.combine(moment.date(), datetime.min.time()) + timedelta(minutes=rounded)
+
+
+def find_next_free_slots(thoiluong_phut, start_from, days=14, manv=None, limit=5,
+                         budget_ms=None, step_minutes=None, chunk_days=7):
+    """
+    Tìm `limit` cặp (manv, giờ bắt đầu) sớm nhất kể từ start_from trong `days` ngày.
+
+    Mỗi lô chunk_days ngày: giờ làm việc + lịch bận (mỗi thứ tối đa 1 truy vấn), sau đó với mỗi
+    KTV quét một lượt ca làm trộn với khoảng bận (StaffDayIndex.free_gaps).
+    Dừng khi đủ kết quả (các ngày sau chắc chắn muộn hơn) hoặc hết budget_ms.
+
+    Trả về (slots, complete): slots = [(start, end, manv)] tăng dần theo giờ;
+    complete = False nếu dừng vì hết thời gian trước khi quét xong cửa sổ.
+    """
+    step_minutes = step_minutes or availability_service.SLOT_STEP_MINUTES
+    step = timedelta(minutes=step_minutes)
+    duration = timedelta(minutes=thoiluong_phut)
+    deadline = time.perf_counter() + budget_ms / 1000.0 if budget_ms else None
+    first_day = start_from.date()
+    all_days = [first_day + timedelta(days=i) for i in range(days)]
+
+    found = []
+    for offset in range(0, len(all_days), chunk_days):
+        if deadline and time.perf_counter() > deadline:
+            return found, False
+        chunk = all_days[offset:offset + chunk_days]
+        windows = shift_service.get_windows(chunk)
+        staff = {m for day in windows.values() for m in day if manv is None or m == int(manv)}
+        if not staff:
+            continue
+        indexes = availability_service.get_day_indexes(staff, chunk)
+
+        for ngay in chunk:
+            if deadline and time.perf_counter() > deadline:
+                return found, False
+            day_slots = []
+            for staff_manv, ranges in windows[ngay].items():
+                if staff_manv not in staff:
+                    continue
+                idx = indexes[(staff_manv, ngay)]
+                for w_start, w_end in ranges:
+                    for gap_start, gap_end in idx.free_gaps(max(w_start, start_from), w_end):
+                        # Mỗi khoảng trống chỉ cần tối đa `limit` giờ bắt đầu sớm nhất
+                        start = _aligned(gap_start, step_minutes)
+                        for _ in range(limit):
+                            if start + duration > gap_end:
+                                break
+                            day_slots.append((start, start + duration, staff_manv))
+                            start += step
+            found.extend(heapq.nsmallest(limit - len(found), day_slots))
+            if len(found) >= limit:
+                return found, True
+
+    return found, True
+
+
+def get_available_staff_by_date(booking_date, ngaygio=None, thoiluong_phut=None):
+    """
+    Lấy danh sách nhân viên Kỹ thuật viên (role='staff') làm việc trong ngày,
+    sắp xếp theo số phút đã được đặt ít nhất.
+    Có ngaygio: chỉ giữ NV có ca bao trùm và rảnh trong [ngaygio, ngaygio + thoiluong_phut).
     """
     try:
-        # 1. Subquery để đếm số lịch hẹn của mỗi NV trong ngày đó
-        appointment_counts_sub = db.session.query(
-            ChiTietLichHen.manv,
-            func.count(LichHen.malh).label('appointment_count')
-        ).join(LichHen).filter(
-            db.func.date(LichHen.ngaygio) == booking_date,
-            LichHen.trangthai.in_(['Đã xác nhận', 'Chờ xác nhận'])
-        ).group_by(ChiTietLichHen.manv).subquery()
-
-        # 2. Query chính: Lấy NV làm việc VÀ LỌC THEO VAI TRÒ
-        working_staff_with_counts = db.session.query(
-            NhanVien,
-            func.coalesce(appointment_counts_sub.c.appointment_count, 0).label('total_appointments')
-        ).join(nhanvien_calam).join(CaLam).filter(
-            CaLam.ngay == booking_date,
-            NhanVien.trangthai == True,
-            NhanVien.role == 'staff' 
-        ).outerjoin(
-            appointment_counts_sub, NhanVien.manv == appointment_counts_sub.c.manv
-        ).order_by(
-            'total_appointments' # Sắp xếp theo NV ít việc nhất
-        ).all()
-
-        # 3. Trả về kết quả
-        available_staff = [
-            {"manv": staff.manv, "hoten": staff.hoten, "appointment_count": count}
-            for staff, count in working_staff_with_counts
+        ranked = rank_working_staff(booking_date)
+        if ngaygio is not None:
+            free = set(find_free_staff(ngaygio, thoiluong_phut or availability_service.DEFAULT_DURATION))
+            ranked = [item for item in ranked if item[0] in free]
+        if not ranked:
+            return []
+
+        names = dict(db.session.query(NhanVien.manv, NhanVien.hoten).filter(
+            NhanVien.manv.in_([manv for manv, _, _ in ranked])
+        ).all())
+
+        return [
+            {"manv": manv, "hoten": names.get(manv), "appointment_count": count, "booked_minutes": minutes}
+            for manv, minutes, count in ranked
         ]
-        
-        return available_staff
-        
+
     except Exception as e:
         current_app.logger.error(f"Lỗi khi lấy NV khả dụng: {e}", exc_info=True)
         raise e
 
-def auto_assign_staff(booking_date):
+def auto_assign_staff(booking_date, ngaygio=None, thoiluong_phut=None):
     """
-    Tìm và trả về 1 nhân viên Kỹ thuật viên (role='staff') rảnh nhất.
+    Tìm và trả về 1 nhân viên Kỹ thuật viên (role='staff') phù hợp nhất.
+    Nếu có ngaygio: NV phải có ca và rảnh trong khoảng [ngaygio, ngaygio + thoiluong_phut).
+    Nếu không: NV có ca trong ngày và ít phút đã đặt nhất.
     """
     try:
-        appointment_counts_sub = db.session.query(
-            ChiTietLichHen.manv,
-            func.count(LichHen.malh).label('appointment_count')
-        ).join(LichHen).filter(
-            db.func.date(LichHen.ngaygio) == booking_date,
-            LichHen.trangthai.in_(['Đã xác nhận', 'Chờ xác nhận'])
-        ).group_by(ChiTietLichHen.manv).subquery()
-        
-        least_busy_staff_tuple = db.session.query(
-            NhanVien,
-            func.coalesce(appointment_counts_sub.c.appointment_count, 0).label('total_appointments')
-        ).join(nhanvien_calam).join(CaLam).filter(
-            CaLam.ngay == booking_date,
-            NhanVien.trangthai == True,
-            NhanVien.role == 'staff'
-        ).outerjoin(
-            appointment_counts_sub, NhanVien.manv == appointment_counts_sub.c.manv
-        ).order_by(
-            'total_appointments'
-        ).first() # Chỉ lấy NV ít bận nhất
-
-        if not least_busy_staff_tuple:
-            return None 
-        
-        return least_busy_staff_tuple[0] 
-        
+        if ngaygio is not None:
+            candidates = find_free_staff(ngaygio, thoiluong_phut or availability_service.DEFAULT_DURATION)
+        else:
+            candidates = [manv for manv, _, _ in rank_working_staff(booking_date)]
+
+        if not candidates:
+            return None
+
+        return NhanVien.query.get(candidates[0])
+
     except Exception as e:
         current_app.logger.error(f"Lỗi khi tự động xếp lịch NV: {e}", exc_info=True)
-        raise e
\ No newline at end of file
+        raise e
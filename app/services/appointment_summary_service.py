@@ -0,0 +1,152 @@
+# app/services/appointment_summary_service.py
+"""
+Duy trì các cột tóm tắt của LichHen (tính từ ChiTietLichHen + DichVu):
+
+    ngayketthuc      = ngaygio + tổng thời lượng (mặc định 60 phút)
+    dichvu_dau       = tên dịch vụ đầu tiên (theo madv)
+    ten_dichvu       = tên mọi dịch vụ, ngăn cách bởi ", "
+    so_dichvu        = số dịch vụ
+    tong_thoiluong   = tổng thời lượng (phút)
+    tong_gia         = tổng giá
+
+Các màn hình danh sách đọc thẳng từ các cột này, không phải nạp chitiet/dichvu
+cho từng lịch hẹn. Giá trị được tính lại bằng MỘT câu UPDATE ngay sau flush
+khi lịch hẹn / chi tiết thay đổi (sự kiện Session), hoặc khi tên / giá dịch vụ
+thay đổi.
+
+Thời lượng được chốt lúc đặt: sửa DichVu.thoiluong KHÔNG đổi ngayketthuc lẫn
+tong_thoiluong của lịch hẹn đã có (khung giờ khách đã đặt, và kéo dài có thể
+đụng ràng buộc EXCLUDE với lịch kế tiếp). tong_thoiluong luôn khớp với
+khoangthoigian; chỉ khi đổi giờ / dịch vụ của chính lịch hẹn mới tính lại.
+"""
+from datetime import timedelta
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history, set_committed_value
+
+from ..extensions import db
+from ..models import LichHen, ChiTietLichHen, DichVu
+from .availability_service import DEFAULT_DURATION
+
+SUMMARY_COLUMNS = ('dichvu_dau', 'ten_dichvu', 'so_dichvu', 'tong_thoiluong', 'tong_gia')
+
+_SUMMARY_SELECT = """
+    SELECT lh.malh,
+           COUNT(dv.madv)::int AS so_dichvu,
+           COALESCE(SUM(dv.thoiluong), 0)::int AS tong_thoiluong,
+           COALESCE(SUM(dv.gia), 0) AS tong_gia,
+           string_agg(dv.tendv, ', ' ORDER BY dv.madv) AS ten_dichvu,
+           (array_agg(dv.tendv ORDER BY dv.madv))[1] AS dichvu_dau
+    FROM lichhen lh
+    LEFT JOIN chitietlichhen ct ON ct.malh = lh.malh
+    LEFT JOIN dichvu dv ON dv.madv = ct.madv
+    WHERE {where}
+    GROUP BY lh.malh
+"""
+
+_BY_MALH = _SUMMARY_SELECT.format(where="lh.malh = ANY(:malh_list)")
+_BY_MADV = _SUMMARY_SELECT.format(
+    where="lh.malh IN (SELECT malh FROM chitietlichhen WHERE madv = ANY(:madv_list))"
+)
+
+_RECOMPUTE_SQL = text(f"""
+    UPDATE lichhen AS lh
+    SET ngayketthuc = lh.ngaygio + make_interval(
+            mins => COALESCE(NULLIF(agg.tong_thoiluong, 0), :default_minutes)::int),
+        so_dichvu = agg.so_dichvu,
+        tong_thoiluong = agg.tong_thoiluong,
+        tong_gia = agg.tong_gia,
+        ten_dichvu = agg.ten_dichvu,
+        dichvu_dau = agg.dichvu_dau
+    FROM ({_BY_MALH}) AS agg
+    WHERE lh.malh = agg.malh
+    RETURNING lh.malh, lh.ngayketthuc, lh.dichvu_dau, lh.ten_dichvu,
+              lh.so_dichvu, lh.tong_thoiluong, lh.tong_gia
+""")
+
+# Không đụng tong_thoiluong / ngayketthuc: thời lượng chốt lúc đặt
+_REFRESH_BY_SERVICE_SQL = text(f"""
+    UPDATE lichhen AS lh
+    SET so_dichvu = agg.so_dichvu,
+        tong_gia = agg.tong_gia,
+        ten_dichvu = agg.ten_dichvu,
+        dichvu_dau = agg.dichvu_dau
+    FROM ({_BY_MADV}) AS agg
+    WHERE lh.malh = agg.malh
+    RETURNING lh.malh, lh.dichvu_dau, lh.ten_dichvu, lh.so_dichvu, lh.tong_gia
+""")
+SERVICE_COLUMNS = ('dichvu_dau', 'ten_dichvu', 'so_dichvu', 'tong_gia')
+
+
+def _sync_identity_map(session, rows, columns):
+    """Ghi giá trị vừa tính vào các đối tượng LichHen đang nằm trong session."""
+    for row in rows:
+        apt = session.identity_map.get(session.identity_key(LichHen, row.malh))
+        if apt is not None:
+            for column in columns:
+                set_committed_value(apt, column, getattr(row, column))
+
+
+def refresh(malh_list, session=None):
+    """
+    Tính lại giờ kết thúc + cột tóm tắt cho các lịch hẹn (1 câu UPDATE).
+    Dùng sau INSERT/UPDATE hàng loạt không đi qua flush của ORM.
+    """
+    session = session or db.session
+    if not malh_list:
+        return
+    rows = session.connection().execute(
+        _RECOMPUTE_SQL,
+        {'malh_list': sorted(set(malh_list)), 'default_minutes': DEFAULT_DURATION}
+    ).fetchall()
+    _sync_identity_map(session, rows, ('ngayketthuc',) + SUMMARY_COLUMNS)
+
+
+@event.listens_for(Session, 'before_flush')
+def _provisional_end_time(session, flush_context, instances):
+    """
+    Gán giờ kết thúc tạm cho lịch hẹn mới / đổi giờ để thỏa NOT NULL.
+    Giá trị chính xác được tính lại bằng SQL ngay sau flush; ràng buộc EXCLUDE
+    là DEFERRABLE nên chỉ giá trị cuối cùng lúc commit mới được kiểm tra.
+    """
+    for obj in session.new:
+        if isinstance(obj, LichHen) and obj.ngaygio and obj.ngayketthuc is None:
+            obj.ngayketthuc = obj.ngaygio + timedelta(minutes=DEFAULT_DURATION)
+    for obj in session.dirty:
+        if isinstance(obj, LichHen):
+            history = get_history(obj, 'ngaygio')
+            if history.added and history.deleted and obj.ngayketthuc:
+                obj.ngayketthuc = obj.ngayketthuc + (history.added[0] - history.deleted[0])
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_targets(session, flush_context):
+    targets = session.info.setdefault('lichhen_summary_recompute', set())
+    services = session.info.setdefault('lichhen_summary_services', set())
+    for obj in session.new:
+        if isinstance(obj, (LichHen, ChiTietLichHen)) and obj.malh:
+            targets.add(obj.malh)
+    for obj in session.deleted:
+        if isinstance(obj, ChiTietLichHen) and obj.malh:
+            targets.add(obj.malh)
+    for obj in session.dirty:
+        if isinstance(obj, LichHen) and get_history(obj, 'ngaygio').has_changes():
+            targets.add(obj.malh)
+        elif isinstance(obj, DichVu) and any(
+            get_history(obj, attr).has_changes() for attr in ('tendv', 'gia')
+        ):
+            services.add(obj.madv)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _recompute(session, flush_context):
+    targets = session.info.pop('lichhen_summary_recompute', None)
+    services = session.info.pop('lichhen_summary_services', None)
+    if targets:
+        refresh(targets, session)
+    if services:
+        rows = session.connection().execute(
+            _REFRESH_BY_SERVICE_SQL, {'madv_list': sorted(services)}
+        ).fetchall()
+        _sync_identity_map(session, rows, SERVICE_COLUMNS)
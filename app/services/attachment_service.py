@@ -0,0 +1,198 @@
+# app/services/attachment_service.py
+"""
+Tệp đính kèm tin nhắn chat (ảnh, PDF).
+
+- Tải lên: thân request là nội dung tệp (không multipart), đọc request.stream
+  từng khúc CHUNK_SIZE ghi thẳng xuống đĩa; vượt ATTACHMENT_MAX_BYTES là dừng
+  ngay - không bao giờ giữ cả tệp trong bộ nhớ. Loại tệp xác định theo các byte
+  đầu (không tin Content-Type của client).
+- Ảnh nhỏ: tạo bằng Pillow trong luồng nền (ThreadPoolExecutor giới hạn số luồng),
+  request tải lên không phải chờ. Chưa có ảnh nhỏ thì endpoint ảnh nhỏ trả ảnh gốc.
+- Tải xuống: URL có chữ ký (thẻ <img> không gửi được header Authorization),
+  nội dung tệp không bao giờ đổi nên được cache lâu dài; hỗ trợ Range (send_file).
+"""
+import hashlib
+import hmac
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+
+from ..extensions import db
+from ..models import TepDinhKem
+
+CHUNK_SIZE = 64 * 1024
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_WORKERS = 2
+
+# Chữ ký tệp -> (MIME, đuôi tệp)
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png', '.png'),
+    (b'GIF87a', 'image/gif', '.gif'),
+    (b'GIF89a', 'image/gif', '.gif'),
+    (b'%PDF-', 'application/pdf', '.pdf'),
+)
+
+_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix='chat-thumbnail')
+
+
+class AttachmentRejected(Exception):
+    """Tệp không được nhận: quá lớn (413), sai loại (415) hoặc rỗng (400)."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _sniff(head):
+    for signature, mime, ext in _SIGNATURES:
+        if head.startswith(signature):
+            return mime, ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp', '.webp'
+    return None, None
+
+
+def storage_root():
+    return current_app.config['ATTACHMENT_FOLDER']
+
+
+def _abs(relative):
+    return os.path.join(storage_root(), relative)
+
+
+def save_stream(stream, max_bytes):
+    """
+    Ghi stream xuống ATTACHMENT_FOLDER/<năm>/<tháng>/<uuid><đuôi>, từng khúc CHUNK_SIZE.
+    Trả về (đường dẫn tương đối, MIME, số byte). Raise AttachmentRejected nếu không hợp lệ.
+    """
+    now = datetime.now()
+    folder = os.path.join(f"{now:%Y}", f"{now:%m}")
+    os.makedirs(_abs(folder), exist_ok=True)
+    name = uuid.uuid4().hex
+    partial = _abs(os.path.join(folder, name + '.part'))
+
+    size, mime, ext = 0, None, None
+    try:
+        with open(partial, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if mime is None:
+                    mime, ext = _sniff(chunk[:16])
+                    if mime is None or mime not in current_app.config['ATTACHMENT_TYPES']:
+                        raise AttachmentRejected("Chỉ nhận ảnh (JPEG, PNG, GIF, WebP) hoặc PDF", 415)
+                size += len(chunk)
+                if size > max_bytes:
+                    raise AttachmentRejected(f"Tệp vượt quá {max_bytes // (1024 * 1024)} MB", 413)
+                out.write(chunk)
+        if size == 0:
+            raise AttachmentRejected("Tệp rỗng", 400)
+        relative = os.path.join(folder, name + ext)
+        os.replace(partial, _abs(relative))
+        return relative, mime, size
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+def create_attachment(message, relative, mime, size, filename):
+    """Thêm TepDinhKem cho tin nhắn vừa flush (chưa commit)."""
+    attachment = TepDinhKem(
+        maht=message.maht, matn=message.matn, tenfile=(filename or 'tep')[:255],
+        loai=mime, kichthuoc=size, duongdan=relative
+    )
+    db.session.add(attachment)
+    db.session.flush()
+    return attachment
+
+
+def discard_file(relative):
+    """Xóa tệp đã ghi khi giao dịch tạo tin nhắn thất bại."""
+    try:
+        os.remove(_abs(relative))
+    except OSError:
+        pass
+
+
+# ========== URL CÓ CHỮ KÝ ==========
+def _signature(matdk):
+    key = current_app.config['SECRET_KEY'].encode()
+    return hmac.new(key, f"tepdinhkem:{matdk}".encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def verify_signature(matdk, sig):
+    return bool(sig) and hmac.compare_digest(_signature(matdk), sig)
+
+
+def to_dict(attachment):
+    """Metadata trả về client (kèm trong tin nhắn). Cần app context (ký URL)."""
+    sig = _signature(attachment.matdk)
+    is_image = attachment.loai.startswith('image/')
+    return {
+        "matdk": attachment.matdk,
+        "tenfile": attachment.tenfile,
+        "loai": attachment.loai,
+        "kichthuoc": attachment.kichthuoc,
+        "rong": attachment.rong,
+        "cao": attachment.cao,
+        "url": f"/api/chat/attachments/{attachment.matdk}?sig={sig}",
+        "thumbnail_url": f"/api/chat/attachments/{attachment.matdk}/thumbnail?sig={sig}" if is_image else None
+    }
+
+
+def attachments_by_message(matn_list):
+    """{matn: [dict tệp đính kèm]} cho các tin nhắn (1 truy vấn, index ix_tepdinhkem_matn)."""
+    if not matn_list:
+        return {}
+    result = {}
+    for attachment in TepDinhKem.query.filter(
+        TepDinhKem.matn.in_(set(matn_list))
+    ).order_by(TepDinhKem.matdk).all():
+        result.setdefault(attachment.matn, []).append(to_dict(attachment))
+    return result
+
+
+def file_path(attachment, thumbnail=False):
+    """Đường dẫn tuyệt đối của tệp (ảnh nhỏ nếu thumbnail=True và đã có), None nếu mất tệp."""
+    relative = attachment.anhnho if thumbnail and attachment.anhnho else attachment.duongdan
+    path = _abs(relative)
+    return path if os.path.isfile(path) else None
+
+
+# ========== ẢNH NHỎ (LUỒNG NỀN) ==========
+def schedule_thumbnail(app, matdk):
+    """Tạo ảnh nhỏ sau khi tin nhắn đã commit; không chặn request."""
+    _executor.submit(_make_thumbnail, app, matdk)
+
+
+def _make_thumbnail(app, matdk):
+    from PIL import Image, ImageOps
+
+    with app.app_context():
+        try:
+            attachment = TepDinhKem.query.get(matdk)
+            if attachment is None or not attachment.loai.startswith('image/'):
+                return
+            source = _abs(attachment.duongdan)
+            target = os.path.splitext(attachment.duongdan)[0] + '_thumb.webp'
+            with Image.open(source) as image:
+                image = ImageOps.exif_transpose(image)
+                width, height = image.size
+                image.thumbnail(THUMBNAIL_SIZE)
+                if image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+                image.save(_abs(target), 'WEBP', quality=80)
+            attachment.anhnho = target
+            attachment.rong, attachment.cao = width, height
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning(f"Không tạo được ảnh nhỏ cho tệp {matdk}: {e}")
+        finally:
+            db.session.remove()
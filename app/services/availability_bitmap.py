@@ -0,0 +1,131 @@
+# app/services/availability_bitmap.py
+"""
+Bitmap lịch rảnh theo khung 15 phút.
+
+Mỗi (nhân viên, ngày) là một số nguyên 96 bit: bit i = 1 nếu khung
+[i*15', (i+1)*15') nằm trong ca làm và chưa có lịch hẹn. Câu hỏi kiểu
+"có KTV nào rảnh liền 90 phút lúc mấy giờ" chỉ còn là vài phép AND / OR / shift
+trên số nguyên, không phải duyệt danh sách.
+
+- Bit ca làm: tính từ chỉ mục giờ làm việc của shift_service.
+- Bit lịch bận: lấy từ StaffDayIndex của availability_service (đã tự làm mới
+  khi LichHen thay đổi).
+
+Bitmap tính khi cần (không có luồng làm ấm): busy_bits được nhớ trên từng
+StaffDayIndex nên chỉ tính lại sau khi chỉ mục đó bị xóa vì lịch hẹn đổi / hết TTL.
+"""
+import hashlib
+from array import array
+from datetime import datetime, timedelta
+
+from . import availability_service, shift_service
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+_SLOT = timedelta(minutes=SLOT_MINUTES)
+
+
+def slots_for(thoiluong_phut):
+    """Số khung 15 phút cần cho một dịch vụ (làm tròn lên)."""
+    return max(1, -(-int(thoiluong_phut) // SLOT_MINUTES))
+
+
+def slot_time(ngay, i):
+    return datetime.combine(ngay, datetime.min.time()) + i * _SLOT
+
+
+def window_bits(windows):
+    """Bit các khung 15 phút nằm trọn trong các khoảng làm việc [(start, end), ...] của một ngày."""
+    bits = 0
+    for start, end in windows:
+        day_start = datetime.combine(start.date(), datetime.min.time())
+        first = -((day_start - start) // _SLOT)   # làm tròn lên
+        last = min(SLOTS_PER_DAY, (end - day_start) // _SLOT)
+        if last > first:
+            bits |= ((1 << (last - first)) - 1) << first
+    return bits
+
+
+def get_free_bitmaps(ngay_list, manv_list=None):
+    """
+    {ngay: {manv: bits rảnh}} = bit ca làm AND NOT bit lịch bận.
+    manv_list: giới hạn nhân viên (mặc định mọi KTV có ca trong các ngày đó).
+    """
+    ngay_list = sorted(set(ngay_list))
+    windows = shift_service.get_windows(ngay_list)
+    wanted = {int(m) for m in manv_list} if manv_list else None
+
+    staff = set()
+    for by_manv in windows.values():
+        staff.update(m for m in by_manv if wanted is None or m in wanted)
+    indexes = availability_service.get_day_indexes(staff, ngay_list) if staff else {}
+
+    result = {}
+    for ngay in ngay_list:
+        day = {}
+        for manv, ranges in windows[ngay].items():
+            if manv in staff:
+                day[manv] = window_bits(ranges) & ~indexes[(manv, ngay)].busy_bits(SLOT_MINUTES)
+        result[ngay] = day
+    return result
+
+
+def run_starts(bits, length):
+    """
+    Bit i = 1 nếu các khung i .. i+length-1 đều rảnh (bắt đầu được dịch vụ dài length khung).
+    Gấp đôi độ dài mỗi bước: O(log length) phép AND / shift.
+    """
+    result, covered = bits, 1
+    while covered < length:
+        step = min(covered, length - covered)
+        result &= result >> step
+        covered += step
+    return result
+
+
+def count_by_slot(bitmaps):
+    """Đếm số bitmap có bit i = 1 cho từng khung, trả về array('H') độ dài SLOTS_PER_DAY."""
+    counts = array('H', bytes(2 * SLOTS_PER_DAY))
+    for bits in bitmaps:
+        while bits:
+            low = bits & -bits
+            counts[low.bit_length() - 1] += 1
+            bits ^= low
+    return counts
+
+
+def any_free_starts(ngay, thoiluong_phut, manv_list=None):
+    """Bitset các khung mà có ít nhất một KTV rảnh liền thoiluong_phut từ đó."""
+    length = slots_for(thoiluong_phut)
+    bits = 0
+    for free in get_free_bitmaps([ngay], manv_list)[ngay].values():
+        bits |= run_starts(free, length)
+    return bits
+
+
+def heatmap(from_date, to_date, thoiluong_phut, manv_list=None, now=None):
+    """
+    Số KTV có thể bắt đầu dịch vụ dài thoiluong_phut ở từng khung 15 phút,
+    cho mỗi ngày trong [from_date, to_date]. Khung đã qua được tính là 0.
+
+    Trả về (days, version): days = [(ngay, array('H'))], version = băm của bitmap.
+    """
+    ngay_list = [from_date + timedelta(days=i) for i in range((to_date - from_date).days + 1)]
+    length = slots_for(thoiluong_phut)
+    bitmaps = get_free_bitmaps(ngay_list, manv_list)
+    now = now or datetime.now()
+
+    digest = hashlib.sha1(f"{thoiluong_phut}:{manv_list}".encode())
+    days = []
+    for ngay in ngay_list:
+        mask = (1 << SLOTS_PER_DAY) - 1
+        if ngay < now.date():
+            mask = 0
+        elif ngay == now.date():
+            passed = -(-(now.hour * 60 + now.minute) // SLOT_MINUTES)
+            mask &= ~((1 << passed) - 1)
+        starts = [run_starts(free, length) & mask for _, free in sorted(bitmaps[ngay].items())]
+        digest.update(f"{ngay}:{starts};".encode())
+        days.append((ngay, count_by_slot(starts)))
+    return days, digest.hexdigest()[:16]
+
@@ -0,0 +1,529 @@
+# app/services/availability_service.py
+"""
+Chỉ mục lịch bận của nhân viên theo từng ngày.
+
+Mỗi cặp (manv, ngày) giữ một danh sách khoảng (start, end, malh) đã sắp xếp,
+được nạp bằng MỘT câu truy vấn và được làm mới khi LichHen / ChiTietLichHen
+thay đổi (qua sự kiện của SQLAlchemy Session). Kiểm tra trùng lịch chỉ còn
+là tìm kiếm nhị phân trên bộ nhớ.
+
+Giao dịch ghi lịch hẹn gửi kèm sự kiện 'availability' (pg_notify, tới nơi khi commit);
+worker ghi tự xóa chỉ mục khi commit, các worker khác xóa các khóa đó ngay khi nhận.
+Mất kết nối LISTEN thì xóa toàn bộ (có thể đã lỡ sự kiện). TTL chỉ còn là lưới an toàn.
+"""
+import hashlib
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import datetime, timedelta, date
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from ..extensions import db
+from ..models import LichHen, ChiTietLichHen, DichVu, KhachHang
+from . import event_bus, shift_service
+
+ACTIVE_STATUSES = ['pending', 'confirmed', 'in_progress']
+DEFAULT_DURATION = 60  # phút, dùng khi lịch hẹn không có thời lượng dịch vụ
+EXCLUSION_VIOLATION = '23P01'  # mã lỗi Postgres khi vi phạm ràng buộc EXCLUDE
+
+CHANNEL = 'availability'
+MAX_BROADCAST_KEYS = 200  # nhiều hơn thì yêu cầu các worker xóa toàn bộ
+
+BusyInterval = namedtuple('BusyInterval', ['start', 'end', 'malh'])
+
+
+class StaffDayIndex:
+    """Các khoảng bận của một nhân viên trong một ngày, sắp xếp theo giờ bắt đầu."""
+
+    __slots__ = ('manv', 'ngay', 'starts', 'ends', 'malhs', 'max_ends', 'loaded_at', '_busy_bits')
+
+    def __init__(self, manv, ngay, intervals):
+        intervals = sorted(intervals)
+        self.manv = manv
+        self.ngay = ngay
+        self.starts = [iv.start for iv in intervals]
+        self.ends = [iv.end for iv in intervals]
+        self.malhs = [iv.malh for iv in intervals]
+        # max_ends[i] = max(ends[0..i]) -> xử lý được cả dữ liệu cũ bị chồng lịch
+        self.max_ends = []
+        current_max = None
+        for end in self.ends:
+            current_max = end if current_max is None or end > current_max else current_max
+            self.max_ends.append(current_max)
+        self.loaded_at = time.monotonic()
+        self._busy_bits = {}
+
+    def __len__(self):
+        return len(self.starts)
+
+    def intervals(self):
+        return [BusyInterval(s, e, m) for s, e, m in zip(self.starts, self.ends, self.malhs)]
+
+    def is_free(self, start, end):
+        """True nếu [start, end) không giao với khoảng bận nào. O(log n)."""
+        i = bisect_left(self.starts, end)
+        return i == 0 or self.max_ends[i - 1] <= start
+
+    def conflicts(self, start, end):
+        """Danh sách khoảng bận giao với [start, end). O(log n + k)."""
+        result = []
+        j = bisect_left(self.starts, end) - 1
+        while j >= 0 and self.max_ends[j] > start:
+            if self.ends[j] > start:
+                result.append(BusyInterval(self.starts[j], self.ends[j], self.malhs[j]))
+            j -= 1
+        result.reverse()
+        return result
+
+    def free_mask(self, slot_starts, duration):
+        """
+        Quét một lượt: với danh sách giờ bắt đầu đã sắp xếp, trả về list bool
+        cho biết khung [slot, slot + duration) có trống không. O(n + m).
+        """
+        mask = []
+        j = 0
+        n = len(self.starts)
+        for slot_start in slot_starts:
+            slot_end = slot_start + duration
+            while j < n and self.starts[j] < slot_end:
+                j += 1
+            mask.append(j == 0 or self.max_ends[j - 1] <= slot_start)
+        return mask
+
+    def free_gaps(self, window_start, window_end):
+        """
+        Các khoảng trống trong [window_start, window_end): quét một lượt qua
+        các khoảng bận giao với cửa sổ. O(log n + k).
+        """
+        gaps = []
+        cursor = window_start
+        j = bisect_left(self.max_ends, window_start + timedelta(microseconds=1))
+        n = len(self.starts)
+        while j < n and self.starts[j] < window_end:
+            if self.starts[j] > cursor:
+                gaps.append((cursor, self.starts[j]))
+            if self.ends[j] > cursor:
+                cursor = self.ends[j]
+            j += 1
+        if cursor < window_end:
+            gaps.append((cursor, window_end))
+        return gaps
+
+    def booked_minutes(self):
+        return sum(int((e - s).total_seconds() // 60) for s, e in zip(self.starts, self.ends))
+
+    def busy_bits(self, slot_minutes):
+        """
+        Bitset (int) các khung slot_minutes phút trong ngày bị chiếm: bit i = 1 nếu
+        khung [i*slot, (i+1)*slot) giao với một lịch hẹn. Tính 1 lần rồi giữ lại
+        cùng chỉ mục (chỉ mục bị thay khi lịch hẹn đổi nên bitset không bị cũ).
+        """
+        bits = self._busy_bits.get(slot_minutes)
+        if bits is not None:
+            return bits
+        day_start = datetime.combine(self.ngay, datetime.min.time())
+        slot = timedelta(minutes=slot_minutes)
+        slots_per_day = 24 * 60 // slot_minutes
+        bits = 0
+        for start, end in zip(self.starts, self.ends):
+            first = max(0, (start - day_start) // slot)
+            last = min(slots_per_day, -((day_start - end) // slot))  # làm tròn lên
+            if last > first:
+                bits |= ((1 << (last - first)) - 1) << first
+        self._busy_bits[slot_minutes] = bits
+        return bits
+
+
+# ========== BỘ NHỚ ĐỆM ==========
+_cache = {}          # (manv, ngay) -> StaffDayIndex
+_malh_keys = {}      # malh -> set((manv, ngay)) để làm mới khi chỉ đổi chi tiết
+_lock = threading.Lock()
+# Thế hệ: seq tăng mỗi lần xóa; _dropped_at[key] = seq lúc key bị xóa gần nhất, 'all' = seq
+# lúc xóa toàn bộ. get_day_indexes chỉ ghi kết quả vừa nạp nếu key không bị xóa trong lúc
+# truy vấn - sự kiện xóa tới giữa truy vấn và lúc ghi không bị mất.
+_generation = {'seq': 0, 'all': 0}
+_dropped_at = {}
+MAX_DROPPED_ENTRIES = 10000
+
+
+def _cache_ttl():
+    try:
+        return current_app.config.get('AVAILABILITY_CACHE_TTL', 60)
+    except RuntimeError:
+        return 60
+
+
+def _day_bounds(ngay):
+    start = datetime.combine(ngay, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+
+def _load_indexes(manv_list, ngay_list):
+    """Nạp chỉ mục cho mọi (manv, ngày) được yêu cầu bằng một câu truy vấn."""
+    first_start, _ = _day_bounds(min(ngay_list))
+    _, last_end = _day_bounds(max(ngay_list))
+
+    # Truy vấn khoảng trên cột tsrange (GiST index), không cần join chi tiết/dịch vụ
+    rows = db.session.query(
+        LichHen.malh,
+        LichHen.manv,
+        LichHen.ngaygio,
+        LichHen.ngayketthuc
+    ).filter(
+        LichHen.manv.in_(manv_list),
+        LichHen.trangthai.in_(ACTIVE_STATUSES),
+        LichHen.khoangthoigian.overlaps(func.tsrange(first_start, last_end, '[)'))
+    ).all()
+
+    buckets = {(manv, ngay): [] for manv in manv_list for ngay in ngay_list}
+    wanted_days = set(ngay_list)
+    for malh, manv, ngaygio, end in rows:
+        ngay = ngaygio.date()
+        while datetime.combine(ngay, datetime.min.time()) < end:
+            if ngay in wanted_days:
+                buckets[(manv, ngay)].append(BusyInterval(ngaygio, end, malh))
+            ngay += timedelta(days=1)
+
+    return {key: StaffDayIndex(key[0], key[1], ivs) for key, ivs in buckets.items()}
+
+
+def get_day_indexes(manv_list, ngay_list):
+    """
+    Trả về dict (manv, ngay) -> StaffDayIndex.
+    Các khóa chưa có trong bộ nhớ đệm (hoặc đã hết hạn) được nạp chung một truy vấn.
+    """
+    manv_list = sorted({int(m) for m in manv_list if m})
+    if isinstance(ngay_list, date):
+        ngay_list = [ngay_list]
+    ngay_list = sorted(set(ngay_list))
+    if not manv_list or not ngay_list:
+        return {}
+
+    ttl = _cache_ttl()
+    now = time.monotonic()
+    result, missing_manv, missing_ngay = {}, set(), set()
+    with _lock:
+        started_at = _generation['seq']
+        for manv in manv_list:
+            for ngay in ngay_list:
+                idx = _cache.get((manv, ngay))
+                if idx is not None and now - idx.loaded_at < ttl:
+                    result[(manv, ngay)] = idx
+                else:
+                    missing_manv.add(manv)
+                    missing_ngay.add(ngay)
+
+    if missing_manv:
+        loaded = _load_indexes(sorted(missing_manv), sorted(missing_ngay))
+        with _lock:
+            everything_dropped = _generation['all'] > started_at
+            for key, idx in loaded.items():
+                if everything_dropped or _dropped_at.get(key, 0) > started_at:
+                    continue  # bị xóa trong lúc nạp: kết quả có thể đã cũ, không giữ
+                _cache[key] = idx
+                for malh in idx.malhs:
+                    _malh_keys.setdefault(malh, set()).add(key)
+        for key, idx in loaded.items():
+            if key[0] in manv_list and key[1] in ngay_list:
+                result.setdefault(key, idx)
+
+    return result
+
+
+def load_fresh_indexes(manv_list, ngay_list):
+    """Nạp chỉ mục trực tiếp từ DB (bỏ qua bộ nhớ đệm), dùng sau khi đã giữ khóa đặt lịch."""
+    if not manv_list or not ngay_list:
+        return {}
+    return _load_indexes(sorted({int(m) for m in manv_list}), sorted(set(ngay_list)))
+
+
+def get_day_index(manv, ngay):
+    manv = int(manv)
+    return get_day_indexes([manv], [ngay])[(manv, ngay)]
+
+
+def find_conflicts(manv, ngaygio, thoiluong_phut):
+    """Các lịch hẹn của nhân viên giao với khoảng [ngaygio, ngaygio + thoiluong)."""
+    end = ngaygio + timedelta(minutes=thoiluong_phut)
+    manv = int(manv)
+    conflicts = []
+    ngay = ngaygio.date()
+    while datetime.combine(ngay, datetime.min.time()) < end:
+        conflicts.extend(get_day_index(manv, ngay).conflicts(ngaygio, end))
+        ngay += timedelta(days=1)
+    # Lịch kéo dài qua nửa đêm có thể nằm ở cả hai ngày
+    seen = set()
+    return [c for c in conflicts if not (c.malh in seen or seen.add(c.malh))]
+
+
+def find_conflicts_in_db(manv, start, end):
+    """
+    Kiểm tra trùng lịch trực tiếp trên DB (bỏ qua bộ nhớ đệm).
+    Dùng trong giao dịch đặt lịch sau khi đã giữ khóa, khi cần dữ liệu mới nhất.
+    """
+    rows = db.session.query(
+        LichHen.malh, LichHen.ngaygio, LichHen.ngayketthuc
+    ).filter(
+        LichHen.manv == int(manv),
+        LichHen.trangthai.in_(ACTIVE_STATUSES),
+        LichHen.khoangthoigian.overlaps(func.tsrange(start, end, '[)'))
+    ).order_by(LichHen.ngaygio).all()
+    return [BusyInterval(ngaygio, ngayketthuc, malh) for malh, ngaygio, ngayketthuc in rows]
+
+
+def is_staff_free(manv, ngaygio, thoiluong_phut):
+    return not find_conflicts(manv, ngaygio, thoiluong_phut)
+
+
+def describe_conflicts(conflicts):
+    """
+    Lấy tên dịch vụ và khách hàng cho các lịch hẹn bị trùng (chỉ 1 truy vấn,
+    chỉ cho những malh trùng chứ không phải toàn bộ lịch sử).
+    """
+    malh_list = [c.malh for c in conflicts]
+    if not malh_list:
+        return {}
+
+    rows = db.session.query(
+        LichHen.malh, KhachHang.hoten, DichVu.tendv
+    ).outerjoin(
+        KhachHang, KhachHang.makh == LichHen.makh
+    ).outerjoin(
+        ChiTietLichHen, ChiTietLichHen.malh == LichHen.malh
+    ).outerjoin(
+        DichVu, DichVu.madv == ChiTietLichHen.madv
+    ).filter(LichHen.malh.in_(malh_list)).all()
+
+    details = {malh: {'khachhang': None, 'services': []} for malh in malh_list}
+    for malh, hoten, tendv in rows:
+        details[malh]['khachhang'] = hoten
+        if tendv:
+            details[malh]['services'].append(tendv)
+    return details
+
+
+def is_double_booking_error(exc):
+    """True nếu lỗi đến từ ràng buộc EXCLUDE ex_lichhen_nhanvien_trung_lich."""
+    return isinstance(exc, IntegrityError) and getattr(exc.orig, 'pgcode', None) == EXCLUSION_VIOLATION
+
+
+# ========== LƯỚI KHUNG GIỜ ==========
+SLOT_FIRST_HOUR = 8
+SLOT_LAST_HOUR = 18   # khung cuối bắt đầu trước giờ này
+SLOT_STEP_MINUTES = 30
+
+
+def day_slot_starts(ngay):
+    first = datetime.combine(ngay, datetime.min.time()) + timedelta(hours=SLOT_FIRST_HOUR)
+    count = (SLOT_LAST_HOUR - SLOT_FIRST_HOUR) * 60 // SLOT_STEP_MINUTES
+    return [first + timedelta(minutes=i * SLOT_STEP_MINUTES) for i in range(count)]
+
+
+def compute_slot_grid(ngay_list, thoiluong_phut, manv_list):
+    """
+    Tính lưới khung giờ cho nhiều ngày / nhiều nhân viên.
+    Lịch bận được nạp 1 lần (1 truy vấn) rồi quét với toàn bộ khung giờ;
+    khung giờ chỉ tính là trống nếu nằm trọn trong ca làm (shift_service).
+
+    Trả về (grid, version):
+        grid = {ngay: [(slot_datetime, [manv rảnh...]), ...]}
+        version = chuỗi băm của dữ liệu đầu vào, dùng làm khóa cache phía client
+    """
+    duration = timedelta(minutes=thoiluong_phut)
+    indexes = get_day_indexes(manv_list, ngay_list)
+    windows = shift_service.get_windows(ngay_list)
+    manv_list = sorted({int(m) for m in manv_list if m})
+
+    digest = hashlib.sha1(str(thoiluong_phut).encode())
+    grid = {}
+    for ngay in sorted(set(ngay_list)):
+        slots = day_slot_starts(ngay)
+        free_by_slot = [[] for _ in slots]
+        for manv in manv_list:
+            idx = indexes[(manv, ngay)]
+            staff_windows = windows[ngay].get(manv)
+            if not staff_windows:
+                continue
+            digest.update(f"{manv}@{ngay}:{staff_windows}:{idx.malhs}:{idx.starts}:{idx.ends};".encode())
+            for i, is_free in enumerate(idx.free_mask(slots, duration)):
+                if is_free and shift_service.covers(staff_windows, slots[i], slots[i] + duration):
+                    free_by_slot[i].append(manv)
+        grid[ngay] = list(zip(slots, free_by_slot))
+
+    return grid, digest.hexdigest()[:16]
+
+
+# ========== ĐỒNG BỘ KHI DỮ LIỆU THAY ĐỔI ==========
+def invalidate(manv=None, ngay=None):
+    """Xóa chỉ mục khỏi bộ nhớ đệm. Không truyền gì = xóa toàn bộ."""
+    with _lock:
+        # Lượt nạp đang chạy có thể chứa khóa chưa có trong _cache: coi như xóa toàn bộ
+        _bump()
+        if manv is None and ngay is None:
+            _cache.clear()
+            _malh_keys.clear()
+            return
+        for key in list(_cache.keys()):
+            if (manv is None or key[0] == manv) and (ngay is None or key[1] == ngay):
+                _drop_key(key)
+
+
+def _bump(key=None):
+    """Tăng thế hệ (gọi khi giữ _lock). key=None: mọi lượt nạp đang chạy đều bị bỏ."""
+    _generation['seq'] += 1
+    if key is None or len(_dropped_at) >= MAX_DROPPED_ENTRIES:
+        _generation['all'] = _generation['seq']
+        _dropped_at.clear()
+    if key is not None:
+        _dropped_at[key] = _generation['seq']
+
+
+def _drop_key(key):
+    _bump(key)
+    idx = _cache.pop(key, None)
+    if idx is None:
+        return
+    for malh in idx.malhs:
+        keys = _malh_keys.get(malh)
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del _malh_keys[malh]
+
+
+def _lichhen_keys(apt):
+    """Các khóa (manv, ngay) mà lịch hẹn chiếm, cả giá trị cũ lẫn mới."""
+    keys = set()
+    manv_values = set(get_history(apt, 'manv').sum()) | {apt.manv}
+    ngaygio_values = set(get_history(apt, 'ngaygio').sum()) | {apt.ngaygio}
+    for manv in manv_values:
+        for ngaygio in ngaygio_values:
+            if manv and ngaygio:
+                ngay = ngaygio.date()
+                keys.add((int(manv), ngay))
+                keys.add((int(manv), ngay + timedelta(days=1)))
+    return keys
+
+
+def mark_dirty(keys, session=None):
+    """
+    Báo các khóa (manv, ngay) cần làm mới khi giao dịch commit.
+    Dùng cho INSERT/UPDATE hàng loạt không đi qua flush của ORM.
+    """
+    session = session or db.session
+    keys = set(keys)
+    session.info.setdefault('availability_dirty', set()).update(keys)
+    _queue_broadcast(session, keys)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_keys(session, flush_context):
+    pending = session.info.setdefault('availability_dirty', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, LichHen):
+            pending.update(_lichhen_keys(obj))
+            if obj.malh:
+                pending.add(('malh', obj.malh))
+        elif isinstance(obj, ChiTietLichHen):
+            if obj.malh:
+                pending.add(('malh', obj.malh))
+
+
+def _drop_keys(keys):
+    has_day_keys = any(key[0] != 'malh' for key in keys)
+    with _lock:
+        for key in keys:
+            if key[0] != 'malh':
+                _drop_key(key)
+            elif key[1] in _malh_keys:
+                for cached_key in list(_malh_keys[key[1]]):
+                    _drop_key(cached_key)
+            elif not has_day_keys:
+                # Chỉ đổi chi tiết của lịch hẹn chưa nằm trong cache: có thể đang được nạp
+                _bump()
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _broadcast_flushed_keys(session, flush_context):
+    pending = session.info.get('availability_dirty')
+    if pending:
+        _queue_broadcast(session, pending)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_invalidation(session):
+    session.info.pop('availability_broadcast', None)
+    pending = session.info.pop('availability_dirty', None)
+    if pending:
+        _drop_keys(pending)
+
+
+# ========== ĐỒNG BỘ GIỮA CÁC WORKER ==========
+def _queue_broadcast(session, keys):
+    """
+    Báo các worker khác xóa `keys`: pg_notify trong chính giao dịch đang ghi (event_bus.notify),
+    Postgres chỉ chuyển đi khi commit - không cần thêm kết nối. Mỗi khóa chỉ gửi một lần / giao dịch.
+    """
+    if not has_app_context():
+        return
+    sent = session.info.setdefault('availability_broadcast', set())
+    new_keys = set(keys) - sent
+    if not new_keys:
+        return
+    sent.update(new_keys)
+    event = {'channel': CHANNEL, 'type': 'invalidate', 'pid': os.getpid()}
+    compact = dict(event, all=True)
+    if len(new_keys) > MAX_BROADCAST_KEYS:
+        event = compact
+    else:
+        event['keys'] = [
+            [a, b.isoformat() if isinstance(b, date) else b] for a, b in new_keys
+        ]
+    event_bus.notify(event, session=session, compact=compact)
+
+
+def _on_invalidate(event):
+    if event.get('pid') == os.getpid():
+        return  # worker phát đã tự xóa khi commit
+    if event.get('all'):
+        invalidate()
+        return
+    keys = []
+    for a, b in event.get('keys') or ():
+        if a == 'malh':
+            keys.append((a, b))
+        else:
+            keys.append((a, date.fromisoformat(b)))
+    _drop_keys(keys)
+
+
+def _on_bus_event(event):
+    if event.get('type') == 'reconnected':
+        invalidate()
+
+
+def init_app(app):
+    """
+    Nhận sự kiện xóa bộ nhớ đệm từ worker khác. Luồng LISTEN khởi động ở request đầu
+    tiên của mỗi worker (sau fork), không chạy cho lệnh CLI / script.
+    """
+    event_bus.add_handler(CHANNEL, _on_invalidate)
+    event_bus.add_handler('bus', _on_bus_event)
+
+    @app.before_request
+    def _ensure_listener():
+        event_bus.ensure_listener(app)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    # NOTIFY của giao dịch bị rollback cũng bị Postgres hủy
+    session.info.pop('availability_dirty', None)
+    session.info.pop('availability_broadcast', None)
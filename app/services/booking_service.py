@@ -0,0 +1,286 @@
+# app/services/booking_service.py
+"""
+Lớp giao dịch đặt lịch.
+
+Kiểm tra trùng lịch và INSERT được bọc trong khóa pg_advisory_xact_lock(manv, ngày):
+hai yêu cầu đặt cùng một nhân viên trong cùng một ngày sẽ chạy tuần tự, còn các
+nhân viên khác nhau không chặn nhau. Khóa tự nhả khi COMMIT / ROLLBACK.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+
+from ..extensions import db
+from ..models import LichHen, ChiTietLichHen
+from . import availability_service, appointment_service, appointment_summary_service, event_bus, shift_service
+
+
+MAX_BATCH_ITEMS = 52
+RECURRENCE_STEPS = {'daily': timedelta(days=1), 'weekly': timedelta(weeks=1)}
+
+
+class BookingConflict(Exception):
+    """Không thể đặt lịch: nhân viên đã bận (hoặc không còn nhân viên rảnh)."""
+
+    def __init__(self, manv=None, conflicts=None, item=None, off_shift=False):
+        super().__init__("Nhân viên không có ca làm trong khung giờ này" if off_shift
+                         else "Nhân viên đã bận trong khung giờ này")
+        self.manv = manv
+        self.conflicts = conflicts or []
+        self.item = item  # vị trí trong lô (đặt nhiều lịch), None nếu đặt đơn
+        self.off_shift = off_shift  # True nếu khung giờ nằm ngoài ca làm của nhân viên
+
+
+def _lock_days(start, end):
+    """Các ngày mà khoảng [start, end) đi qua (thường chỉ 1)."""
+    days = []
+    ngay = start.date()
+    while datetime.combine(ngay, datetime.min.time()) < end:
+        days.append(ngay)
+        ngay += timedelta(days=1)
+    return days
+
+
+def _interval_keys(manv, start, end):
+    return [(int(manv), ngay) for ngay in _lock_days(start, end)]
+
+
+def lock_keys(keys):
+    """
+    Giữ khóa advisory cho các cặp (manv, ngày) đến hết giao dịch, chờ nếu đang bị giữ.
+    Luôn khóa theo thứ tự (manv, ngày): mọi đường đặt lịch dùng chung thứ tự này
+    nên hai giao dịch không thể giữ khóa của nhau rồi chờ nhau (deadlock).
+    """
+    for manv, ngay in sorted(set(keys)):
+        db.session.execute(
+            text("SELECT pg_advisory_xact_lock(:manv, :ngay)"),
+            {'manv': manv, 'ngay': ngay.toordinal()}
+        )
+
+
+def lock_staff_interval(manv, start, end):
+    """Giữ khóa advisory cho (manv, ngày) của khoảng [start, end) đến hết giao dịch."""
+    lock_keys(_interval_keys(manv, start, end))
+
+
+def notify_appointments(event_type, makh, items):
+    """
+    Phát sự kiện lịch hẹn ('created' / 'confirmed') qua event_bus trong giao dịch hiện tại.
+    items: [(malh, manv, ngaygio), ...] - một sự kiện cho cả lô.
+    """
+    event_bus.notify({
+        'channel': 'appointment', 'type': event_type, 'makh': makh,
+        'items': [{'malh': malh, 'manv': manv, 'ngaygio': ngaygio.isoformat()}
+                  for malh, manv, ngaygio in items]
+    })
+
+
+def _insert_appointment(makh, manv, ngaygio, end, madv_list, trangthai):
+    new_apt = LichHen(
+        makh=makh,
+        ngaygio=ngaygio,
+        ngayketthuc=end,
+        manv=manv,
+        trangthai=trangthai
+    )
+    db.session.add(new_apt)
+    db.session.flush()
+    db.session.add_all([ChiTietLichHen(malh=new_apt.malh, madv=madv) for madv in madv_list])
+    db.session.flush()
+    notify_appointments('created', makh, [(new_apt.malh, manv, ngaygio)])
+    return new_apt
+
+
+def book_appointment(makh, ngaygio, madv_list, thoiluong_phut, manv=None,
+                     trangthai='confirmed', use_lock=True):
+    """
+    Đặt một lịch hẹn trong giao dịch hiện tại (KHÔNG commit - caller commit ngay sau
+    để nhả khóa sớm).
+
+    - manv cụ thể: phải có ca làm bao trùm khung giờ; khóa (manv, ngày) ->
+      kiểm tra lại trên DB -> INSERT.
+    - manv=None: khóa cùng lúc mọi NV rảnh do find_free_staff trả về (thứ tự
+      (manv, ngày) như mọi đường khác, không deadlock), rồi chọn NV đầu tiên
+      theo thứ tự ưu tiên mà DB xác nhận còn trống.
+
+    Trả về LichHen mới, raise BookingConflict nếu không đặt được.
+    """
+    end = ngaygio + timedelta(minutes=thoiluong_phut)
+
+    if manv:
+        manv = int(manv)
+        if not shift_service.is_on_shift(manv, ngaygio, end):
+            raise BookingConflict(manv, off_shift=True)
+        if use_lock:
+            lock_staff_interval(manv, ngaygio, end)
+        conflicts = availability_service.find_conflicts_in_db(manv, ngaygio, end)
+        if conflicts:
+            raise BookingConflict(manv, conflicts)
+        return _insert_appointment(makh, manv, ngaygio, end, madv_list, trangthai)
+
+    candidates = appointment_service.find_free_staff(ngaygio, thoiluong_phut)
+    if use_lock:
+        lock_keys(key for candidate in candidates for key in _interval_keys(candidate, ngaygio, end))
+    for candidate in candidates:
+        if not availability_service.find_conflicts_in_db(candidate, ngaygio, end):
+            return _insert_appointment(makh, candidate, ngaygio, end, madv_list, trangthai)
+
+    raise BookingConflict()
+
+
+def move_appointment(apt, manv=None, ngaygio=None):
+    """
+    Đổi nhân viên và/hoặc giờ của lịch hẹn đã có trong giao dịch hiện tại (KHÔNG commit).
+    Cùng các bước như book_appointment: ca làm -> khóa (manv, ngày) -> kiểm tra lại
+    trên DB (bỏ qua chính lịch hẹn này). Thời lượng giữ nguyên (chốt lúc đặt).
+    Lịch hẹn không còn hiệu lực (đã hủy / hoàn thành) hoặc chưa có nhân viên thì chỉ gán.
+    Raise BookingConflict nếu nhân viên không có ca hoặc đã bận.
+    """
+    manv = int(manv) if manv else apt.manv
+    ngaygio = ngaygio or apt.ngaygio
+    if manv == apt.manv and ngaygio == apt.ngaygio:
+        return apt
+    end = ngaygio + (apt.ngayketthuc - apt.ngaygio)
+
+    if manv and apt.trangthai in availability_service.ACTIVE_STATUSES:
+        if not shift_service.is_on_shift(manv, ngaygio, end):
+            raise BookingConflict(manv, off_shift=True)
+        lock_staff_interval(manv, ngaygio, end)
+        conflicts = [c for c in availability_service.find_conflicts_in_db(manv, ngaygio, end)
+                     if c.malh != apt.malh]
+        if conflicts:
+            raise BookingConflict(manv, conflicts)
+
+    apt.manv = manv
+    apt.ngaygio = ngaygio
+    return apt
+
+
+# ========== ĐẶT NHIỀU LỊCH / LỊCH LẶP LẠI ==========
+def expand_recurrence(ngaygio, rule):
+    """
+    Sinh các giờ hẹn từ quy tắc lặp: {"freq": "daily"|"weekly", "interval": 1,
+    "count": N | "until": "YYYY-MM-DD"}. Raise ValueError nếu quy tắc không hợp lệ.
+    """
+    step = RECURRENCE_STEPS.get((rule or {}).get('freq'))
+    if step is None:
+        raise ValueError("Quy tắc lặp không hợp lệ (freq phải là daily hoặc weekly)")
+    interval = int(rule.get('interval') or 1)
+    count = rule.get('count')
+    until = datetime.strptime(rule['until'], "%Y-%m-%d").date() if rule.get('until') else None
+    if interval < 1 or (count is None and until is None):
+        raise ValueError("Quy tắc lặp cần interval >= 1 và count hoặc until")
+
+    count = int(count) if count is not None else MAX_BATCH_ITEMS + 1
+    result = []
+    current = ngaygio
+    while len(result) < count and (until is None or current.date() <= until):
+        result.append(current)
+        if len(result) > MAX_BATCH_ITEMS:
+            raise ValueError(f"Tối đa {MAX_BATCH_ITEMS} lịch hẹn mỗi lần đặt")
+        current += step * interval
+    return result
+
+
+def _plan_auto_staff(items, planned, windows):
+    """Chọn KTV cho các mục chưa có nhân viên, dựa trên chỉ mục lịch bận (bộ nhớ đệm)."""
+    auto_days = sorted({item['ngaygio'].date() for item in items if not item.get('manv')})
+    staff = {m for ngay in auto_days for m in windows.get(ngay, {})}
+    indexes = availability_service.get_day_indexes(staff, auto_days) if staff else {}
+    extra_minutes = {}
+
+    for pos, item in enumerate(items):
+        if item.get('manv'):
+            continue
+        start, end, ngay = item['ngaygio'], item['end'], item['ngaygio'].date()
+        best = None
+        for manv, ranges in windows.get(ngay, {}).items():
+            idx = indexes[(manv, ngay)]
+            if not shift_service.covers(ranges, start, end) or not idx.is_free(start, end):
+                continue
+            if any(p_manv == manv and p_start < end and start < p_end for p_start, p_end, p_manv in planned):
+                continue
+            load = idx.booked_minutes() + extra_minutes.get((manv, ngay), 0)
+            if best is None or (load, manv) < best:
+                best = (load, manv)
+        if best is None:
+            raise BookingConflict(item=pos)
+        item['manv'] = best[1]
+        planned.append((start, end, best[1]))
+        extra_minutes[(best[1], ngay)] = extra_minutes.get((best[1], ngay), 0) + item['thoiluong_phut']
+
+
+def book_batch(makh, items, trangthai='confirmed'):
+    """
+    Đặt nhiều lịch hẹn trong giao dịch hiện tại, tất cả hoặc không gì cả
+    (KHÔNG commit - caller commit để nhả khóa).
+
+    items: list dict {ngaygio, madv_list, thoiluong_phut, manv (tùy chọn)}.
+    1. Gán KTV cho các mục chưa chọn nhân viên (ca làm + chỉ mục lịch bận).
+    2. Khóa mọi cặp (manv, ngày) liên quan theo thứ tự cố định.
+    3. Nạp lại lịch bận từ DB một lần, kiểm tra từng mục và trùng lặp trong lô.
+    4. INSERT hàng loạt LichHen + ChiTietLichHen.
+
+    Trả về list malh theo thứ tự items, raise BookingConflict(item=vị trí) nếu trùng.
+    """
+    if not items:
+        return []
+    if len(items) > MAX_BATCH_ITEMS:
+        raise ValueError(f"Tối đa {MAX_BATCH_ITEMS} lịch hẹn mỗi lần đặt")
+
+    for pos, item in enumerate(items):
+        item['end'] = item['ngaygio'] + timedelta(minutes=item['thoiluong_phut'])
+        if item.get('manv'):
+            item['manv'] = int(item['manv'])
+            if not shift_service.is_on_shift(item['manv'], item['ngaygio'], item['end']):
+                raise BookingConflict(item['manv'], item=pos, off_shift=True)
+
+    planned = [(item['ngaygio'], item['end'], item['manv']) for item in items if item.get('manv')]
+    if any(not item.get('manv') for item in items):
+        windows = shift_service.get_windows(
+            sorted({item['ngaygio'].date() for item in items if not item.get('manv')})
+        )
+        _plan_auto_staff(items, planned, windows)
+
+    locked = sorted({
+        key for item in items for key in _interval_keys(item['manv'], item['ngaygio'], item['end'])
+    })
+    lock_keys(locked)
+
+    fresh = availability_service.load_fresh_indexes(
+        sorted({manv for manv, _ in locked}), sorted({ngay for _, ngay in locked})
+    )
+    accepted = []
+    for pos, item in enumerate(items):
+        start, end, manv = item['ngaygio'], item['end'], item['manv']
+        conflicts = []
+        for ngay in _lock_days(start, end):
+            conflicts.extend(fresh[(manv, ngay)].conflicts(start, end))
+        if conflicts:
+            raise BookingConflict(manv, list({c.malh: c for c in conflicts}.values()), item=pos)
+        if any(a_manv == manv and a_start < end and start < a_end for a_start, a_end, a_manv in accepted):
+            raise BookingConflict(manv, item=pos)
+        accepted.append((start, end, manv))
+
+    malh_list = db.session.scalars(
+        insert(LichHen).returning(LichHen.malh, sort_by_parameter_order=True),
+        [{
+            'makh': makh,
+            'manv': item['manv'],
+            'ngaygio': item['ngaygio'],
+            'ngayketthuc': item['end'],
+            'trangthai': trangthai
+        } for item in items]
+    ).all()
+    db.session.execute(insert(ChiTietLichHen), [
+        {'malh': malh, 'madv': madv}
+        for malh, item in zip(malh_list, items) for madv in item['madv_list']
+    ])
+
+    # INSERT hàng loạt không đi qua flush -> tự tính cột tóm tắt và báo cho bộ nhớ đệm lịch bận
+    appointment_summary_service.refresh(malh_list)
+    availability_service.mark_dirty(locked)
+    notify_appointments('created', makh, [
+        (malh, item['manv'], item['ngaygio']) for malh, item in zip(malh_list, items)
+    ])
+    return malh_list
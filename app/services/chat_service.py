@@ -1,19 +1,198 @@
 # app/services/chat_service.py
 from ..extensions import db
 from ..models import Hoithoai, TinNhan, NhanVien, KhachHang 
-from sqlalchemy import desc, or_, func
+from sqlalchemy import or_, and_, func, true, literal_column, distinct, text
+from collections import namedtuple
 from datetime import datetime, timezone
+from flask import current_app
+from . import event_bus
+from . import attachment_service
+from . import tinnhan_partition_service as partitions
+import html
+import time
 import pytz
 
 CSKH_ROLES = ['letan', 'manager', 'admin']
 VIETNAM_TZ = pytz.timezone('Asia/Ho_Chi_Minh')
+MESSAGE_PAGE_SIZE = 50
+MESSAGE_PAGE_MAX = 200
+INBOX_PAGE_SIZE = 50
+INBOX_PAGE_MAX = 200
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX = 100
+SEARCH_MIN_LENGTH = 2
+# Tin nhắn hàng loạt: số người nhận mỗi câu INSERT / mỗi sự kiện NOTIFY
+# (mỗi tin ~30 byte trong sự kiện, vừa giới hạn 8000 byte của NOTIFY)
+BROADCAST_BATCH_SIZE = 200
 
-def get_conversations_for_user(user, user_type):
+# Người đang xem (tách khỏi đối tượng ORM để dùng được ở luồng stream)
+Viewer = namedtuple('Viewer', 'user_type makh manv role')
+# Bản sao bất biến của một TinNhan để đẩy qua bus sự kiện
+# (attachments: các dict attachment_service.to_dict, URL đã ký sẵn - luồng stream không có app context)
+MessageRow = namedtuple('MessageRow', 'matn maht noidung thoigiangui nguoigui_makh nguoigui_manv attachments',
+                        defaults=((),))
+
+
+def viewer_for(user, user_type):
+    """Viewer của user, hoặc None nếu không được dùng chat."""
+    if user_type == 'customer':
+        return Viewer('customer', user.makh, None, None)
+    if user_type == 'staff' and (user.role in CSKH_ROLES or user.role == 'staff'):
+        return Viewer('staff', None, user.manv, user.role)
+    return None
+
+
+def can_view(viewer, makh, manv):
+    """Viewer có được xem hội thoại của khách makh, đang gán cho nhân viên manv?"""
+    if viewer.user_type == 'customer':
+        return makh == viewer.makh
+    if viewer.role in CSKH_ROLES:
+        return True
+    return manv is not None and manv == viewer.manv
+
+
+def _visible_conversations(viewer):
+    """Điều kiện SQL trên Hoithoai tương ứng với can_view."""
+    if viewer.user_type == 'customer':
+        return Hoithoai.makh == viewer.makh
+    if viewer.role in CSKH_ROLES:
+        return true()
+    return Hoithoai.manv == viewer.manv
+
+
+def _to_vietnam_iso(value):
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc).astimezone(VIETNAM_TZ).isoformat()
+
+
+def serialize_message(msg, user_type, attachments=None):
     """
-    Lấy danh sách hội thoại.
+    Dict trả về client cho một tin nhắn (khóa khác nhau giữa nhân viên / khách).
+    attachments: tệp đính kèm đã serialize (MessageRow tự mang theo).
     """
-    convs_query = None
-    conversations_list = []
+    if attachments is None and isinstance(msg, MessageRow):
+        attachments = msg.attachments
+    if user_type == 'staff':
+        return {
+            "matn": msg.matn,
+            "noidung": msg.noidung,
+            "thoigian": _to_vietnam_iso(msg.thoigiangui),
+            "is_from_staff": msg.nguoigui_manv is not None,
+            "attachments": list(attachments or ())
+        }
+    return {
+        "matn": msg.matn,
+        "noidung": msg.noidung,
+        "thoigiangui": _to_vietnam_iso(msg.thoigiangui),
+        "is_customer": msg.nguoigui_makh is not None,
+        "attachments": list(attachments or ())
+    }
+
+def _unread_from(sender_side):
+    """
+    Điều kiện "tin chưa đọc do phía sender_side gửi" - khớp đúng partial index
+    ix_tinnhan_unread_khach / ix_tinnhan_unread_nhanvien.
+    """
+    if sender_side == 'customer':
+        return (TinNhan.da_doc == False, TinNhan.nguoigui_makh != None)
+    return (TinNhan.da_doc == False, TinNhan.nguoigui_manv != None)
+
+
+def _newer_than(matn):
+    """
+    Điều kiện matn > `matn`, kèm mốc thoigiangui để Postgres bỏ qua các phân vùng
+    tháng cũ (tinnhan phân vùng theo thoigiangui, client chỉ biết matn).
+    """
+    conditions = [TinNhan.matn > matn]
+    bound = partitions.since_bound(matn)
+    if bound is not None:
+        conditions.append(TinNhan.thoigiangui >= bound)
+    return conditions
+
+
+def _older_than(matn):
+    """Điều kiện matn < `matn`, kèm mốc thoigiangui bỏ qua các phân vùng mới hơn."""
+    conditions = [TinNhan.matn < matn]
+    bound = partitions.before_bound(matn)
+    if bound is not None:
+        conditions.append(TinNhan.thoigiangui < bound)
+    return conditions
+
+
+def _latest(query, count, recent_since=None):
+    """
+    `count` tin có matn lớn nhất của query (matn giảm dần). recent_since: thời điểm
+    tin cuối của hội thoại - thử trước trong phân vùng tháng đó, chỉ đọc các tháng
+    cũ hơn khi chưa đủ.
+    """
+    lower = partitions.recent_bound(recent_since)
+    if lower is None:
+        return query.order_by(TinNhan.matn.desc()).limit(count).all()
+    rows = query.filter(TinNhan.thoigiangui >= lower).order_by(TinNhan.matn.desc()).limit(count).all()
+    if len(rows) < count:
+        rows += query.filter(TinNhan.thoigiangui < lower) \
+            .order_by(TinNhan.matn.desc()).limit(count - len(rows)).all()
+    return rows
+
+
+def unread_totals(viewer):
+    """
+    Subquery một dòng (messages, conversations): số tin chưa đọc của phía bên kia và
+    số hội thoại có tin chưa đọc mà viewer được xem - ghép vào truy vấn khác (badge).
+    """
+    sender_side = 'customer' if viewer.user_type == 'staff' else 'staff'
+    return db.session.query(
+        func.count(TinNhan.matn).label('messages'),
+        func.count(distinct(TinNhan.maht)).label('conversations')
+    ).join(
+        Hoithoai, Hoithoai.maht == TinNhan.maht
+    ).filter(
+        _visible_conversations(viewer), *_unread_from(sender_side)
+    ).subquery()
+
+
+def encode_inbox_cursor(conv):
+    stamp = conv.tin_nhan_cuoi_thoi_gian.isoformat() if conv.tin_nhan_cuoi_thoi_gian else ''
+    return f"{stamp}_{conv.maht}"
+
+
+def decode_inbox_cursor(cursor):
+    """'<thời gian ISO>_<maht>' (thời gian rỗng = hội thoại chưa có tin) -> (datetime|None, maht)."""
+    try:
+        stamp, maht = cursor.rsplit('_', 1)
+        return (datetime.fromisoformat(stamp) if stamp else None), int(maht)
+    except (AttributeError, ValueError):
+        raise ValueError("cursor không hợp lệ")
+
+
+def _after_cursor(cursor):
+    """
+    Keyset theo (tin_nhan_cuoi_thoi_gian DESC NULLS LAST, maht DESC) - index ix_hoithoai_inbox.
+    Hội thoại chưa có tin nhắn (thời gian NULL) nằm cuối danh sách.
+    """
+    last_time, last_maht = decode_inbox_cursor(cursor)
+    if last_time is None:
+        return and_(Hoithoai.tin_nhan_cuoi_thoi_gian == None, Hoithoai.maht < last_maht)
+    return or_(
+        Hoithoai.tin_nhan_cuoi_thoi_gian < last_time,
+        and_(Hoithoai.tin_nhan_cuoi_thoi_gian == last_time, Hoithoai.maht < last_maht),
+        Hoithoai.tin_nhan_cuoi_thoi_gian == None
+    )
+
+
+def get_conversations_for_user(user, user_type, limit=None, cursor=None,
+                               unread_only=False, assigned_to=None):
+    """
+    Lấy danh sách hội thoại (hộp thư), mới nhất trước, phân trang keyset.
+
+    - cursor      : next_cursor của trang trước
+    - unread_only : chỉ hội thoại còn tin chưa đọc của phía bên kia
+    - assigned_to : (CSKH) 'me' | 'none' (hộp thư chung) | manv
+    Số tin chưa đọc của cả trang tính bằng MỘT truy vấn GROUP BY trên partial index.
+    Trả về (conversations_list, next_cursor) - next_cursor None nếu hết.
+    """
+    limit = min(int(limit or INBOX_PAGE_SIZE), INBOX_PAGE_MAX)
     
     if user_type == 'customer':
         convs_query = db.session.query(
@@ -25,33 +204,10 @@ def get_conversations_for_user(user, user_type):
         ).filter(
             Hoithoai.makh == user.makh
         )
-        
-        user_conversations = convs_query.order_by(desc(Hoithoai.tin_nhan_cuoi_thoi_gian)).all()
-        
-        for conv, staff_name, staff_avatar_file in user_conversations:
-            unread_count = db.session.query(func.count(TinNhan.matn)).filter(
-                TinNhan.maht == conv.maht,
-                TinNhan.nguoigui_manv != None,
-                TinNhan.da_doc == False      
-            ).scalar()
-
-            last_msg_time = None
-            if conv.tin_nhan_cuoi_thoi_gian:
-                utc_time = conv.tin_nhan_cuoi_thoi_gian.replace(tzinfo=timezone.utc)
-                vietnam_time = utc_time.astimezone(VIETNAM_TZ)
-                last_msg_time = vietnam_time.isoformat()
-
-            conversations_list.append({
-                "maht": conv.maht,
-                "staff_name": staff_name or "Hỗ trợ",
-                "staff_avatar": staff_avatar_file,
-                "last_message": conv.tin_nhan_cuoi_noi_dung,
-                "last_message_time": last_msg_time,
-                "unread_count": unread_count
-            })
+        sender_side = 'staff'
             
     elif user_type == 'staff':
-        base_query = db.session.query(
+        convs_query = db.session.query(
             Hoithoai,
             KhachHang.hoten.label("customer_name"),
             KhachHang.anhdaidien.label("customer_avatar")
@@ -60,42 +216,63 @@ def get_conversations_for_user(user, user_type):
         )
         
         if user.role in CSKH_ROLES:
-            convs_query = base_query
+            if assigned_to == 'me':
+                convs_query = convs_query.filter(Hoithoai.manv == user.manv)
+            elif assigned_to == 'none':
+                convs_query = convs_query.filter(Hoithoai.manv == None)
+            elif assigned_to is not None:
+                convs_query = convs_query.filter(Hoithoai.manv == int(assigned_to))
         elif user.role == 'staff':
-            convs_query = base_query.filter(Hoithoai.manv == user.manv)
+            convs_query = convs_query.filter(Hoithoai.manv == user.manv)
         else:
-            return []
-            
-        user_conversations = convs_query.order_by(desc(Hoithoai.tin_nhan_cuoi_thoi_gian)).all()
-
-        for conv, customer_name, customer_avatar_file in user_conversations:
-            unread_count = db.session.query(func.count(TinNhan.matn)).filter(
-                TinNhan.maht == conv.maht,
-                TinNhan.nguoigui_makh != None,
-                TinNhan.da_doc == False        
-            ).scalar()
-
-            last_msg_time = None
-            if conv.tin_nhan_cuoi_thoi_gian:
-                utc_time = conv.tin_nhan_cuoi_thoi_gian.replace(tzinfo=timezone.utc)
-                vietnam_time = utc_time.astimezone(VIETNAM_TZ)
-                last_msg_time = vietnam_time.isoformat()
-
-            conversations_list.append({
-                "maht": conv.maht,
-                "customer_name": customer_name or "Khách vãng lai",
-                "customer_avatar": customer_avatar_file,
-                "last_message": conv.tin_nhan_cuoi_noi_dung,
-                "last_message_time": last_msg_time,
-                "unread_count": unread_count
+            return [], None
+        sender_side = 'customer'
+    else:
+        return [], None
+
+    if unread_only:
+        unread_maht = db.session.query(TinNhan.maht).filter(*_unread_from(sender_side))
+        convs_query = convs_query.filter(Hoithoai.maht.in_(unread_maht))
+    if cursor:
+        convs_query = convs_query.filter(_after_cursor(cursor))
+
+    rows = convs_query.order_by(
+        Hoithoai.tin_nhan_cuoi_thoi_gian.desc().nullslast(), Hoithoai.maht.desc()
+    ).limit(limit + 1).all()
+    next_cursor = encode_inbox_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+    rows = rows[:limit]
+
+    unread_counts = {}
+    if rows:
+        unread_counts = dict(db.session.query(TinNhan.maht, func.count(TinNhan.matn)).filter(
+            TinNhan.maht.in_([conv.maht for conv, _, _ in rows]),
+            *_unread_from(sender_side)
+        ).group_by(TinNhan.maht).all())
+
+    conversations_list = []
+    for conv, name, avatar_file in rows:
+        item = {
+            "maht": conv.maht,
+            "last_message": conv.tin_nhan_cuoi_noi_dung,
+            "last_message_time": _to_vietnam_iso(conv.tin_nhan_cuoi_thoi_gian),
+            "unread_count": unread_counts.get(conv.maht, 0)
+        }
+        if user_type == 'customer':
+            item.update({"staff_name": name or "Hỗ trợ", "staff_avatar": avatar_file})
+        else:
+            item.update({
+                "customer_name": name or "Khách vãng lai",
+                "customer_avatar": avatar_file,
+                "manv": conv.manv
             })
+        conversations_list.append(item)
             
-    return conversations_list
+    return conversations_list, next_cursor
 
-def get_messages_for_conversation(conversation_id, user, user_type):
+def get_conversation_for_user(conversation_id, user, user_type):
     """
-    Lấy tin nhắn.
-    ✅ FIX: Convert timezone và đánh dấu đã đọc
+    Lấy hội thoại sau khi kiểm tra quyền (chỉ đọc, không ghi gì vào DB).
+    Raise PermissionError nếu không có quyền.
     """
     conversation = Hoithoai.query.get(conversation_id)
     if not conversation:
@@ -112,51 +289,138 @@ def get_messages_for_conversation(conversation_id, user, user_type):
                 raise PermissionError("Bạn không có quyền xem hội thoại này")
         else:
             raise PermissionError("Bạn không có quyền truy cập chức năng chat")
-                
-    if user_type == 'staff':
-        db.session.query(TinNhan).filter(
-            TinNhan.maht == conversation_id,
-            TinNhan.nguoigui_makh != None,
-            TinNhan.da_doc == False       
-        ).update({"da_doc": True}, synchronize_session=False)
-        
-    elif user_type == 'customer':
-        db.session.query(TinNhan).filter(
-            TinNhan.maht == conversation_id,
-            TinNhan.nguoigui_manv != None,
-            TinNhan.da_doc == False        
-        ).update({"da_doc": True}, synchronize_session=False)
-    
-    db.session.commit()
+    else:
+        raise PermissionError("Bạn không có quyền truy cập chức năng chat")
+    return conversation
 
-    messages_query = TinNhan.query.filter_by(maht=conversation_id).order_by(TinNhan.thoigiangui.asc()).all()
-    
-    messages = []
-    for msg in messages_query:
-        utc_time = msg.thoigiangui.replace(tzinfo=timezone.utc)
-        vietnam_time = utc_time.astimezone(VIETNAM_TZ)
-        
-        if user_type == 'staff':
-            messages.append({
-                "matn": msg.matn, 
-                "noidung": msg.noidung, 
-                "thoigian": vietnam_time.isoformat(),  
-                "is_from_staff": msg.nguoigui_manv is not None
-            })
+
+def get_messages_for_conversation(conversation_id, user, user_type,
+                                  since_matn=None, before_matn=None, limit=None):
+    """
+    Lấy tin nhắn (phân trang keyset theo matn, index (maht, matn)). Chỉ đọc:
+    đánh dấu đã đọc là thao tác riêng (mark_read).
+
+    - since_matn : chỉ tin nhắn mới hơn (làm mới sau lần tải trước)
+    - before_matn: trang cũ hơn (cuộn lên xem lịch sử)
+    - không có   : trang cuối cùng (tải lần đầu)
+    Mốc matn được đổi thành mốc thoigiangui để chỉ quét các phân vùng tháng liên quan.
+    Luôn trả về theo thứ tự cũ -> mới, tối đa `limit` tin.
+    Trả về (messages, conversation, has_more): has_more = còn tin nhắn theo
+    hướng đang đọc (mới hơn với since_matn, cũ hơn với hai chế độ còn lại).
+    """
+    conversation = get_conversation_for_user(conversation_id, user, user_type)
+
+    limit = min(int(limit or MESSAGE_PAGE_SIZE), MESSAGE_PAGE_MAX)
+    messages_query = TinNhan.query.filter(TinNhan.maht == conversation_id)
+    if since_matn is not None:
+        rows = messages_query.filter(*_newer_than(since_matn)) \
+            .order_by(TinNhan.matn.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+    else:
+        if before_matn is not None:
+            rows = messages_query.filter(*_older_than(before_matn)) \
+                .order_by(TinNhan.matn.desc()).limit(limit + 1).all()
         else:
-            messages.append({
-                "matn": msg.matn, 
-                "noidung": msg.noidung, 
-                "thoigiangui": vietnam_time.isoformat(),  
-                "is_customer": msg.nguoigui_makh is not None
-            })
+            rows = _latest(messages_query, limit + 1, conversation.tin_nhan_cuoi_thoi_gian)
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
 
-    return messages, conversation 
+    attachments = attachment_service.attachments_by_message([msg.matn for msg in rows])
+    messages = [serialize_message(msg, user_type, attachments.get(msg.matn)) for msg in rows]
 
-def send_message_as_user(conversation, noidung, user, user_type):
+    return messages, conversation, has_more
+
+# ========== TÌM KIẾM TIN NHẮN ==========
+# Cấu hình 'vn_unaccent' = simple + unaccent (migration b7a3e5c9d012): không phân biệt dấu / hoa thường.
+SEARCH_CONFIG = literal_column("'vn_unaccent'::regconfig")
+_MARK_START, _MARK_END = '\u27e6', '\u27e7'
+_HEADLINE_OPTIONS = f"StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords=25, MinWords=8, MaxFragments=2"
+
+
+def _highlight(snippet):
+    """Escape HTML nội dung tin nhắn, chỉ giữ thẻ <mark> quanh từ khớp."""
+    return html.escape(snippet or '').replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def search_messages(viewer, q, maht=None, before_matn=None, limit=None):
     """
-    Gửi tin nhắn.
+    Tìm tin nhắn theo nội dung (GIN trên noidung_tsv), mới nhất trước, trong phạm vi
+    hội thoại viewer được xem (cùng quy tắc với get_messages_for_conversation).
+
+    q theo cú pháp websearch: "đổi lịch", "HD27", "hủy -khách" ...
+    Phân trang keyset: before_matn = next_before của trang trước.
+    Trả về (results, next_before).
+    """
+    limit = min(int(limit or SEARCH_PAGE_SIZE), SEARCH_PAGE_MAX)
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+
+    page = db.session.query(TinNhan.matn, TinNhan.thoigiangui).join(
+        Hoithoai, Hoithoai.maht == TinNhan.maht
+    ).filter(
+        _visible_conversations(viewer),
+        TinNhan.noidung_tsv.op('@@')(tsquery)
+    )
+    if maht is not None:
+        page = page.filter(TinNhan.maht == maht)
+    if before_matn is not None:
+        page = page.filter(*_older_than(before_matn))
+    page = page.order_by(TinNhan.matn.desc()).limit(limit + 1).subquery()
+
+    # ts_headline tốn kém: chỉ tính cho các dòng của trang, không phải mọi dòng khớp
+    rows = db.session.query(
+        TinNhan, KhachHang.hoten,
+        func.ts_headline(SEARCH_CONFIG, TinNhan.noidung, tsquery, _HEADLINE_OPTIONS).label('snippet')
+    ).join(
+        # Nối theo cả khóa chính (matn, thoigiangui): mỗi dòng chỉ dò đúng một phân vùng
+        page, and_(page.c.matn == TinNhan.matn, page.c.thoigiangui == TinNhan.thoigiangui)
+    ).join(
+        Hoithoai, Hoithoai.maht == TinNhan.maht
+    ).outerjoin(
+        KhachHang, KhachHang.makh == Hoithoai.makh
+    ).order_by(TinNhan.matn.desc()).all()
+
+    next_before = rows[limit - 1][0].matn if len(rows) > limit else None
+    rows = rows[:limit]
+    attachments = attachment_service.attachments_by_message([row[0].matn for row in rows])
+    results = []
+    for msg, customer_name, snippet in rows:
+        item = serialize_message(msg, viewer.user_type, attachments.get(msg.matn))
+        item.update({
+            "maht": msg.maht,
+            "snippet": _highlight(snippet)
+        })
+        if viewer.user_type == 'staff':
+            item["customer_name"] = customer_name or "Khách vãng lai"
+        results.append(item)
+    return results, next_before
+
+
+def mark_read(conversation_id, user, user_type, read_up_to_matn):
     """
+    Biên nhận đã đọc: đánh dấu da_doc mọi tin của phía bên kia có matn <= read_up_to_matn.
+    Chỉ ghi khi thật sự còn tin chưa đọc (điều kiện khớp partial index tin chưa đọc).
+    Trả về số tin vừa được đánh dấu.
+    """
+    conversation = get_conversation_for_user(conversation_id, user, user_type)
+    sender_side = 'customer' if user_type == 'staff' else 'staff'
+
+    marked = db.session.query(TinNhan).filter(
+        TinNhan.maht == conversation_id,
+        *_older_than(read_up_to_matn + 1),
+        *_unread_from(sender_side)
+    ).update({"da_doc": True}, synchronize_session=False)
+
+    if not marked:
+        db.session.rollback()
+        return 0
+
+    notify_read(conversation_id, conversation.makh, conversation.manv, user_type, read_up_to_matn)
+    db.session.commit()
+    return marked
+
+def _add_message(conversation, noidung, user, user_type):
+    """Thêm tin nhắn + cập nhật tin cuối của hội thoại, flush để có matn (chưa commit)."""
     vietnam_now = datetime.now(VIETNAM_TZ)
     
     new_message = TinNhan(
@@ -179,5 +443,274 @@ def send_message_as_user(conversation, noidung, user, user_type):
     conversation.tin_nhan_cuoi_noi_dung = noidung[:150] 
     conversation.tin_nhan_cuoi_thoi_gian = vietnam_now  
     conversation.tin_nhan_cuoi_la_khach_gui = is_customer
-    
-    return new_message
\ No newline at end of file
+
+    # Cần matn cho sự kiện realtime / tệp đính kèm
+    db.session.flush()
+    return new_message
+
+
+def send_message_as_user(conversation, noidung, user, user_type):
+    """
+    Gửi tin nhắn.
+    """
+    new_message = _add_message(conversation, noidung, user, user_type)
+    # NOTIFY chỉ được gửi khi người gọi commit
+    notify_message(new_message, conversation)
+    return new_message
+
+
+def send_attachment_as_user(conversation, upload, caption, user, user_type):
+    """
+    Gửi tin nhắn kèm một tệp đã ghi xuống đĩa (upload = kết quả attachment_service.save_stream
+    + tên tệp gốc). Nội dung tin là caption, hoặc "[Ảnh] tên" / "[Tệp] tên" để hộp thư
+    và tìm kiếm vẫn có chữ. Trả về (message, attachment); người gọi commit.
+    """
+    relative, mime, size, filename = upload
+    if not caption:
+        caption = f"{'[Ảnh]' if mime.startswith('image/') else '[Tệp]'} {filename}"
+    new_message = _add_message(conversation, caption, user, user_type)
+    attachment = attachment_service.create_attachment(new_message, relative, mime, size, filename)
+    notify_message(new_message, conversation, [attachment_service.to_dict(attachment)])
+    return new_message, attachment
+
+# ========== GỬI HÀNG LOẠT (CSKH) ==========
+# Khách chưa có hội thoại: tạo mới (khách có nhiều hội thoại: dùng hội thoại maht nhỏ nhất)
+_BROADCAST_CREATE_SQL = text("""
+    INSERT INTO hoithoai (makh, ngaybatdau)
+    SELECT k.makh, :now
+    FROM unnest(CAST(:makh_list AS integer[])) AS k(makh)
+    WHERE NOT EXISTS (SELECT 1 FROM hoithoai h WHERE h.makh = k.makh)
+""")
+
+_BROADCAST_INSERT_SQL = text("""
+    WITH targets AS (
+        SELECT DISTINCT ON (makh) maht, makh, manv
+        FROM hoithoai
+        WHERE makh = ANY(:makh_list)
+        ORDER BY makh, maht
+    ), inserted AS (
+        INSERT INTO tinnhan (maht, noidung, thoigiangui, nguoigui_manv, da_doc)
+        SELECT maht, :noidung, :now, :manv, false FROM targets ORDER BY maht
+        RETURNING matn, maht
+    )
+    SELECT i.matn, t.maht, t.makh, t.manv
+    FROM inserted i JOIN targets t ON t.maht = i.maht
+    ORDER BY i.matn
+""")
+
+_BROADCAST_LAST_MESSAGE_SQL = text("""
+    UPDATE hoithoai
+    SET tin_nhan_cuoi_noi_dung = :preview,
+        tin_nhan_cuoi_thoi_gian = :now,
+        tin_nhan_cuoi_la_khach_gui = false
+    WHERE maht = ANY(:maht_list)
+""")
+
+
+def broadcast_message(makh_list, noidung, staff):
+    """
+    Nhân viên CSKH gửi cùng một tin cho nhiều khách. Mỗi lô BROADCAST_BATCH_SIZE khách:
+    tạo hội thoại còn thiếu (INSERT ... SELECT), chèn mọi TinNhan (INSERT ... SELECT),
+    cập nhật cột tin nhắn cuối của các hội thoại (1 UPDATE), phát 1 sự kiện.
+    Không commit - người gọi commit (sự kiện chỉ được gửi khi commit).
+    Trả về (số tin đã gửi, số hội thoại tạo mới).
+    """
+    makh_list = sorted({int(makh) for makh in makh_list})
+    vietnam_now = datetime.now(VIETNAM_TZ).replace(tzinfo=None)
+    params = {'now': vietnam_now, 'noidung': noidung, 'manv': staff.manv, 'preview': noidung[:150]}
+
+    sent = created = 0
+    for start in range(0, len(makh_list), BROADCAST_BATCH_SIZE):
+        batch = makh_list[start:start + BROADCAST_BATCH_SIZE]
+        created += db.session.execute(_BROADCAST_CREATE_SQL, dict(params, makh_list=batch)).rowcount
+        rows = db.session.execute(_BROADCAST_INSERT_SQL, dict(params, makh_list=batch)).fetchall()
+        if not rows:
+            continue
+        db.session.execute(_BROADCAST_LAST_MESSAGE_SQL, dict(params, maht_list=[row.maht for row in rows]))
+        notify_broadcast(rows, noidung, vietnam_now, staff.manv)
+        sent += len(rows)
+    return sent, created
+
+
+# ========== SỰ KIỆN REALTIME (SSE) ==========
+# Sự kiện chat trên event_bus: dict {'channel': 'chat', 'type', 'maht', 'makh', 'manv', ...}
+#   message    : 'message' = dict các trường của MessageRow (thời gian dạng ISO)
+#   read       : 'reader' = 'staff' | 'customer' (bên vừa đọc), 'read_up_to_matn'
+#   assignment : 'old_manv' = nhân viên trước đó
+#   broadcast  : một lô tin gửi hàng loạt, không có maht / makh / manv ở ngoài:
+#                'messages' = [[matn, maht, makh, manv], ...] + noidung / thoigiangui / nguoigui_manv chung
+# Phát bằng event_bus.notify trong cùng giao dịch ghi: chỉ tới client khi commit,
+# tới mọi worker qua LISTEN/NOTIFY.
+
+STREAM_RETRY_MS = 3000
+
+
+def notify_message(message, conversation, attachments=None):
+    """Phát tin nhắn mới (message đã flush, có matn), kèm metadata tệp đính kèm nếu có."""
+    sent_at = message.thoigiangui
+    if sent_at is not None and sent_at.tzinfo is not None:
+        sent_at = sent_at.replace(tzinfo=None)   # cột timestamp không múi giờ: giữ như khi đọc lại
+    payload = {
+        'matn': message.matn, 'maht': message.maht, 'noidung': message.noidung,
+        'thoigiangui': sent_at.isoformat() if sent_at else None,
+        'nguoigui_makh': message.nguoigui_makh, 'nguoigui_manv': message.nguoigui_manv,
+        'attachments': attachments or []
+    }
+    event = {
+        'channel': 'chat', 'type': 'message',
+        'maht': conversation.maht, 'makh': conversation.makh, 'manv': conversation.manv,
+        'message': payload
+    }
+    # Nội dung quá dài cho NOTIFY: gửi không kèm nội dung, client tự tải lại bằng since_matn
+    compact = dict(event, message=dict(payload, noidung=None))
+    event_bus.notify(event, compact=compact)
+
+
+def notify_broadcast(rows, noidung, sent_at, manv):
+    """Một sự kiện cho cả lô tin gửi hàng loạt (rows: matn, maht, makh, manv)."""
+    event = {
+        'channel': 'chat', 'type': 'broadcast',
+        'noidung': noidung, 'thoigiangui': sent_at.isoformat(), 'nguoigui_manv': manv,
+        'messages': [[row.matn, row.maht, row.makh, row.manv] for row in rows]
+    }
+    event_bus.notify(event, compact=dict(event, noidung=None))
+
+
+def notify_read(maht, makh, manv, reader, read_up_to_matn):
+    event_bus.notify({
+        'channel': 'chat', 'type': 'read', 'maht': maht, 'makh': makh, 'manv': manv,
+        'reader': reader, 'read_up_to_matn': read_up_to_matn
+    })
+
+
+def notify_assignment(conversation, old_manv):
+    event_bus.notify({
+        'channel': 'chat', 'type': 'assignment', 'maht': conversation.maht,
+        'makh': conversation.makh, 'manv': conversation.manv, 'old_manv': old_manv
+    })
+
+
+def _message_row(payload):
+    if isinstance(payload, MessageRow):
+        return payload
+    sent_at = payload.get('thoigiangui')
+    return MessageRow(
+        payload['matn'], payload['maht'], payload.get('noidung'),
+        datetime.fromisoformat(sent_at) if sent_at else None,
+        payload.get('nguoigui_makh'), payload.get('nguoigui_manv'),
+        tuple(payload.get('attachments') or ())
+    )
+
+
+def _accepts(viewer, event):
+    if event.get('channel') == 'bus':
+        return True      # listener vừa nối lại: có thể đã lỡ sự kiện
+    if event.get('channel') != 'chat':
+        return False
+    if event['type'] == 'broadcast':
+        return any(can_view(viewer, makh, manv) for _, _, makh, manv in event['messages'])
+    if can_view(viewer, event['makh'], event['manv']):
+        return True
+    return event['type'] == 'assignment' and event['old_manv'] is not None \
+        and can_view(viewer, event['makh'], event['old_manv'])
+
+
+def _format_event(viewer, event):
+    if event['type'] == 'broadcast':
+        # Tách lô thành các sự kiện 'message' thường, chỉ các hội thoại viewer được xem
+        sent_at = datetime.fromisoformat(event['thoigiangui'])
+        return ''.join(
+            _format_event(viewer, {'type': 'message', 'message': MessageRow(
+                matn, maht, event['noidung'], sent_at, None, event['nguoigui_manv']
+            )})
+            for matn, maht, makh, manv in event['messages'] if can_view(viewer, makh, manv)
+        )
+    if event['type'] == 'message':
+        row = _message_row(event['message'])
+        return event_bus.sse('message', {
+            "maht": row.maht, "message": serialize_message(row, viewer.user_type)
+        }, event_id=row.matn)
+    if event['type'] == 'read':
+        return event_bus.sse('read', {
+            "maht": event['maht'], "reader": event['reader'],
+            "read_up_to_matn": event['read_up_to_matn']
+        })
+    return event_bus.sse('assignment', {"maht": event['maht'], "manv": event['manv']})
+
+
+def open_stream(viewer, last_event_id=None):
+    """
+    Mở luồng SSE cho viewer. Gọi trong request (cần DB để phát lại), trả về generator
+    không còn dùng DB / app context - có thể giữ kết nối lâu mà không giữ connection pool.
+
+    last_event_id: matn cuối client đã nhận; các tin nhắn sau đó được phát lại trước.
+    Nếu tồn đọng quá CHAT_STREAM_REPLAY_LIMIT tin thì gửi "resync" (client tải lại).
+    """
+    config = current_app.config
+    event_bus.ensure_listener(current_app._get_current_object())
+    # Đăng ký trước khi truy vấn phát lại để không lọt tin nhắn ở giữa hai bước
+    subscription = event_bus.subscribe(
+        lambda event: _accepts(viewer, event),
+        config.get('CHAT_STREAM_QUEUE_SIZE', event_bus.DEFAULT_QUEUE_SIZE)
+    )
+
+    backlog, resync_id = [], None
+    if last_event_id is not None:
+        limit = config.get('CHAT_STREAM_REPLAY_LIMIT', 200)
+        try:
+            rows = db.session.query(
+                TinNhan.matn, TinNhan.maht, TinNhan.noidung, TinNhan.thoigiangui,
+                TinNhan.nguoigui_makh, TinNhan.nguoigui_manv
+            ).join(
+                Hoithoai, Hoithoai.maht == TinNhan.maht
+            ).filter(
+                _visible_conversations(viewer), *_newer_than(last_event_id)
+            ).order_by(TinNhan.matn).limit(limit + 1).all()
+            if len(rows) > limit:
+                resync_id = db.session.query(func.max(TinNhan.matn)).join(
+                    Hoithoai, Hoithoai.maht == TinNhan.maht
+                ).filter(_visible_conversations(viewer), *_newer_than(last_event_id)).scalar()
+            else:
+                attachments = attachment_service.attachments_by_message([row.matn for row in rows])
+                backlog = [MessageRow(*row, tuple(attachments.get(row.matn, ()))) for row in rows]
+        except Exception:
+            event_bus.unsubscribe(subscription)
+            raise
+
+    return _event_stream(
+        viewer, subscription, backlog, resync_id,
+        config.get('CHAT_STREAM_HEARTBEAT', 15), config.get('CHAT_STREAM_MAX_AGE', 300)
+    )
+
+
+def _event_stream(viewer, subscription, backlog, resync_id, heartbeat, max_age):
+    try:
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        if resync_id is not None:
+            yield event_bus.sse('resync', {"reason": "backlog"}, event_id=resync_id)
+        replayed = set()
+        for row in backlog:
+            replayed.add(row.matn)
+            yield _format_event(viewer, {'type': 'message', 'message': row})
+
+        # Giới hạn tuổi kết nối: client tự nối lại bằng Last-Event-ID, worker
+        # không bị giữ mãi bởi kết nối chết mà proxy chưa báo đóng.
+        deadline = time.monotonic() + max_age
+        while time.monotonic() < deadline:
+            event = subscription.get(timeout=heartbeat)
+            if subscription.overflowed:
+                yield event_bus.sse('resync', {"reason": "overflow"})
+                return
+            if event is None:
+                yield event_bus.sse_comment("ping")
+                continue
+            if event.get('channel') == 'bus':
+                yield event_bus.sse('resync', {"reason": "reconnected"})
+                continue
+            if event['type'] == 'message' and event['message']['matn'] in replayed:
+                continue
+            if event['type'] == 'broadcast' and replayed:
+                event = dict(event, messages=[m for m in event['messages'] if m[0] not in replayed])
+            yield _format_event(viewer, event)
+    finally:
+        event_bus.unsubscribe(subscription)
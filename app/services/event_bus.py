@@ -0,0 +1,226 @@
+# app/services/event_bus.py
+"""
+Bus sự kiện realtime giữa các worker, chỉ dùng Postgres LISTEN/NOTIFY (không cần broker).
+
+Phát:
+- notify(event): gửi NOTIFY trong giao dịch hiện tại của db.session. Postgres chỉ
+  chuyển đi khi giao dịch commit (rollback = hủy), tới MỌI worker đang LISTEN -
+  kể cả worker phát. Gọi ngay trong luồng ghi, trước commit.
+- notify_committed(event): gửi SAU khi dữ liệu đã commit, trên kết nối riêng;
+  lỗi chỉ ghi log. Dùng khi việc ghi quan trọng hơn sự kiện (webhook thanh toán):
+  NOTIFY lỗi không được làm rollback giao dịch chính.
+
+Nhận (trong từng worker):
+- ensure_listener(app): một luồng nền / worker giữ một kết nối riêng (ngoài pool),
+  LISTEN kênh EVENT_BUS_CHANNEL và đẩy sự kiện vào bus cục bộ bằng publish().
+- add_handler(channel, fn): fn(event) chạy ngay trên luồng LISTEN cho mọi sự kiện
+  của channel (bộ nhớ đệm trong worker tự làm mới); phải nhanh, không raise.
+- subscribe(accepts): đăng ký, trả về Subscription có hàng đợi riêng; stream
+  chờ trên hàng đợi này nên client rảnh không tốn CPU / truy vấn nào.
+- Hàng đợi đầy (client đọc quá chậm) => subscription bị đánh dấu tràn và không
+  nhận thêm; stream thấy cờ này thì gửi "resync" rồi đóng để client tải lại.
+- Mất kết nối LISTEN => sau khi nối lại, phát {'channel': 'bus', 'type': 'reconnected'}
+  để các stream yêu cầu client đồng bộ lại (sự kiện trong lúc mất kết nối không được gửi lại).
+
+Sự kiện là dict JSON: {'channel': 'chat' | 'payment' | 'appointment' | ..., 'type': ..., ...}.
+"""
+import json
+import os
+import queue
+import select
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from ..extensions import db
+
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_CHANNEL = 'spa_events'
+MAX_PAYLOAD_BYTES = 7900        # giới hạn NOTIFY của Postgres là 8000 byte
+LISTEN_POLL_SECONDS = 30
+
+_subscribers = set()
+_handlers = {}       # channel -> [fn(event)]
+_lock = threading.Lock()
+_listener = {'thread': None, 'pid': None}
+
+
+class Subscription:
+    """Một client đang nghe. `overflowed` = đã mất sự kiện, cần đồng bộ lại."""
+    __slots__ = ('accepts', 'queue', 'overflowed')
+
+    def __init__(self, accepts, maxsize=DEFAULT_QUEUE_SIZE):
+        self.accepts = accepts
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def get(self, timeout):
+        """Sự kiện kế tiếp, hoặc None nếu hết `timeout` giây không có gì."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+def subscribe(accepts, maxsize=DEFAULT_QUEUE_SIZE):
+    subscription = Subscription(accepts, maxsize)
+    with _lock:
+        _subscribers.add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription):
+    with _lock:
+        _subscribers.discard(subscription)
+
+
+def subscriber_count():
+    with _lock:
+        return len(_subscribers)
+
+
+def add_handler(channel, fn):
+    with _lock:
+        handlers = _handlers.setdefault(channel, [])
+        if fn not in handlers:
+            handlers.append(fn)
+
+
+def publish(event):
+    """Đẩy sự kiện tới các handler / subscriber quan tâm. Không bao giờ chặn người gọi."""
+    with _lock:
+        subscribers = list(_subscribers)
+        handlers = list(_handlers.get(event.get('channel'), ()))
+    for handler in handlers:
+        try:
+            handler(event)
+        except Exception:
+            pass    # handler tự ghi log; lỗi của một handler không chặn các subscriber
+    for subscription in subscribers:
+        if subscription.overflowed:
+            continue
+        try:
+            if not subscription.accepts(event):
+                continue
+            subscription.queue.put_nowait(event)
+        except queue.Full:
+            subscription.overflowed = True
+
+
+# ========== GIỮA CÁC WORKER: LISTEN / NOTIFY ==========
+def _channel(app=None):
+    return (app or current_app).config.get('EVENT_BUS_CHANNEL', DEFAULT_CHANNEL)
+
+
+def encode(event):
+    return json.dumps(event, ensure_ascii=False, default=str, separators=(',', ':'))
+
+
+def notify(event, session=None, compact=None):
+    """
+    Phát sự kiện tới mọi worker khi giao dịch hiện tại commit.
+    compact: bản rút gọn dùng khi event vượt giới hạn payload của NOTIFY
+    (vd. bỏ nội dung dài - phía nhận tự tải lại); không có thì raise ValueError.
+    """
+    session = session or db.session
+    payload = encode(event)
+    if len(payload.encode('utf-8')) > MAX_PAYLOAD_BYTES:
+        if compact is None:
+            raise ValueError(f"Sự kiện {event.get('channel')}/{event.get('type')} vượt {MAX_PAYLOAD_BYTES} byte")
+        payload = encode(compact)
+    session.execute(text("SELECT pg_notify(:channel, :payload)"),
+                    {'channel': _channel(), 'payload': payload})
+
+
+def notify_committed(event):
+    """Phát sự kiện ngay trên kết nối autocommit riêng. Không raise: trả về False nếu lỗi."""
+    try:
+        payload = encode(event)
+        if len(payload.encode('utf-8')) > MAX_PAYLOAD_BYTES:
+            raise ValueError(f"vượt {MAX_PAYLOAD_BYTES} byte")
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                         {'channel': _channel(), 'payload': payload})
+        return True
+    except Exception as e:
+        current_app.logger.warning(
+            f"Không phát được sự kiện {event.get('channel')}/{event.get('type')}: {e}"
+        )
+        return False
+
+
+def ensure_listener(app):
+    """Khởi động luồng LISTEN của worker hiện tại (một lần / tiến trình, an toàn sau fork)."""
+    with _lock:
+        thread = _listener['thread']
+        if thread is not None and thread.is_alive() and _listener['pid'] == os.getpid():
+            return
+        with app.app_context():
+            url = db.engine.url
+        thread = threading.Thread(
+            target=_listen_loop, args=(app, url, _channel(app)), name='event-bus-listener', daemon=True
+        )
+        _listener.update(thread=thread, pid=os.getpid())
+        thread.start()
+
+
+def _listen_loop(app, url, channel):
+    # Kết nối riêng, không lấy từ pool của ứng dụng (giữ suốt vòng đời worker)
+    engine = create_engine(url, poolclass=NullPool)
+    backoff, connected_before = 1, False
+    while True:
+        connection = None
+        try:
+            connection = engine.raw_connection()
+            raw = connection.driver_connection
+            raw.autocommit = True
+            with raw.cursor() as cursor:
+                cursor.execute(f'LISTEN "{channel}"')
+            if connected_before:
+                publish({'channel': 'bus', 'type': 'reconnected'})
+            connected_before, backoff = True, 1
+
+            while True:
+                if select.select([raw], [], [], LISTEN_POLL_SECONDS) == ([], [], []):
+                    # Im lặng lâu: kiểm tra kết nối còn sống (TCP có thể đã chết không báo)
+                    with raw.cursor() as cursor:
+                        cursor.execute('SELECT 1')
+                    continue
+                raw.poll()
+                while raw.notifies:
+                    notification = raw.notifies.pop(0)
+                    try:
+                        publish(json.loads(notification.payload))
+                    except ValueError:
+                        with app.app_context():
+                            current_app.logger.warning(f"Bỏ qua sự kiện không hợp lệ: {notification.payload[:200]}")
+        except Exception as e:
+            with app.app_context():
+                current_app.logger.warning(f"Mất kết nối LISTEN bus sự kiện, thử lại sau {backoff}s: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+        finally:
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+
+# ========== ĐỊNH DẠNG SSE ==========
+def sse(event, data, event_id=None):
+    """Một khung Server-Sent Events (text/event-stream)."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False, default=str))
+    return "\n".join(lines) + "\n\n"
+
+
+def sse_comment(text=""):
+    """Dòng chú thích SSE (client bỏ qua) - dùng làm heartbeat giữ kết nối."""
+    return f": {text}\n\n"
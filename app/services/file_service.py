@@ -0,0 +1,90 @@
+# app/services/file_service.py
+"""
+Phục vụ tệp trong UPLOAD_FOLDER (ảnh đại diện và biến thể ?w=).
+
+- FILE_SERVE_MODE = 'x-accel': chỉ trả header X-Accel-Redirect, nginx tự gửi tệp
+  (sendfile, không qua worker Python). Cần một location internal, ví dụ:
+      location /_uploads/ { internal; alias /srv/spa/uploads/; etag off; }
+  'x-sendfile': header X-Sendfile (Apache mod_xsendfile, lighttpd).
+  'flask' (mặc định): send_file như trước.
+- ETag mạnh: tên tệp lưu theo nội dung (storage_service) là chính hash nội dung;
+  tệp cũ dùng mtime + kích thước. If-None-Match khớp -> 304, không mở tệp.
+- Tên theo nội dung không bao giờ đổi nội dung: cache dài hạn immutable. Tệp cũ
+  (tên theo người dùng, có thể bị ghi đè) luôn hỏi lại server (rẻ: 304).
+- Tra cứu âm: tệp không tồn tại được nhớ MISSING_TTL giây, danh sách chat
+  hiển thị hàng chục ảnh thiếu không stat đĩa cho từng request.
+"""
+import mimetypes
+import os
+import threading
+import time
+from urllib.parse import quote
+
+from flask import Response, current_app, request, send_file
+from werkzeug.security import safe_join
+
+MAX_MISSING_ENTRIES = 10000
+
+_missing = {}       # đường dẫn tương đối -> hết hạn lúc (time.monotonic)
+_missing_lock = threading.Lock()
+
+
+def resolve(relative):
+    """Đường dẫn tuyệt đối an toàn trong UPLOAD_FOLDER, None nếu không tồn tại (có cache âm)."""
+    now = time.monotonic()
+    with _missing_lock:
+        expires = _missing.get(relative)
+        if expires is not None:
+            if expires > now:
+                return None
+            del _missing[relative]
+
+    path = safe_join(current_app.config['UPLOAD_FOLDER'], relative)
+    if path is not None and os.path.isfile(path):
+        return path
+
+    ttl = current_app.config.get('FILE_MISSING_TTL', 60)
+    with _missing_lock:
+        if len(_missing) >= MAX_MISSING_ENTRIES:
+            _missing.clear()
+        _missing[relative] = now + ttl
+    return None
+
+
+def forget_missing(relative):
+    """Bỏ tra cứu âm của tệp vừa được ghi."""
+    with _missing_lock:
+        _missing.pop(relative, None)
+
+
+def send_upload(relative, path, immutable=False, mimetype=None):
+    """
+    Response cho tệp UPLOAD_FOLDER/relative (path = resolve(relative)).
+    immutable=True: tên tệp gắn với nội dung (cache dài hạn, ETag từ tên tệp).
+    """
+    config = current_app.config
+    if immutable:
+        etag = os.path.basename(relative)
+    else:
+        stat = os.stat(path)
+        etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    mimetype = mimetype or mimetypes.guess_type(relative)[0] or 'application/octet-stream'
+
+    mode = config.get('FILE_SERVE_MODE', 'flask')
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif mode == 'x-accel':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = config.get('X_ACCEL_PREFIX', '/_uploads/') + quote(relative)
+    elif mode == 'x-sendfile':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Sendfile'] = path
+    else:
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=False)
+
+    response.set_etag(etag)
+    if immutable:
+        response.headers['Cache-Control'] = f"public, max-age={config.get('FILE_CACHE_MAX_AGE', 31536000)}, immutable"
+    else:
+        response.headers['Cache-Control'] = 'public, no-cache'
+    return response
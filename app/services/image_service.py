@@ -0,0 +1,227 @@
+# app/services/image_service.py
+"""
+Ảnh dịch vụ: phục vụ qua /api/services/<madv>/image thay vì nhúng base64 vào JSON.
+
+- dichvu.anhdichvu_hash = md5(anhdichvu), cột sinh tự động: danh sách dịch vụ có
+  URL kèm ?v=<hash> mà không phải đọc blob (anhdichvu là deferred).
+- Hash đổi khi ảnh đổi -> URL đổi, nên URL đúng hash được cache vĩnh viễn (immutable);
+  hash cũng là ETag cho client gọi không kèm ?v=.
+
+Biến thể theo kích thước (?w=): mỗi ảnh tải lên (ảnh dịch vụ, ảnh đại diện) được
+tạo sẵn bản WebP + JPEG ở các chiều rộng IMAGE_VARIANT_WIDTHS, xoay theo EXIF rồi
+bỏ toàn bộ metadata. Việc mã hóa chạy trong ThreadPoolExecutor (Pillow nhả GIL
+khi resize / encode), request tải lên không phải chờ. Biến thể chưa có (ảnh cũ,
+đang tạo) thì trả ảnh gốc và xếp lịch tạo.
+- Ảnh đại diện: <UPLOAD_FOLDER>/<tên>_w<rộng>.webp|jpg, cạnh tệp gốc.
+- Ảnh dịch vụ (gốc nằm trong DB): <UPLOAD_FOLDER>/services/<md5>_w<rộng>.webp|jpg -
+  theo hash nội dung nên ảnh mới tự có tên mới, không cần dọn cache.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from ..extensions import db
+from ..models import DichVu
+
+IMAGE_MAX_AGE = 365 * 24 * 3600
+VARIANT_WORKERS = 2
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+# (đuôi tệp, định dạng Pillow, MIME)
+WEBP = ('webp', 'WEBP', 'image/webp')
+JPEG = ('jpg', 'JPEG', 'image/jpeg')
+
+_executor = ThreadPoolExecutor(max_workers=VARIANT_WORKERS, thread_name_prefix='image-variants')
+_pending = set()        # ảnh đang chờ / đang tạo biến thể (không xếp lịch trùng)
+_failed = set()         # ảnh không đọc được: request ?w= không xếp lịch lại mỗi lần
+_pending_lock = threading.Lock()
+
+_IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF8', 'image/gif'),
+)
+
+
+def image_mimetype(data):
+    """MIME của ảnh theo các byte đầu (ảnh cũ lưu không kèm loại tệp)."""
+    for signature, mime in _IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+
+def service_image_url(service):
+    """URL ảnh của dịch vụ (đổi theo nội dung ảnh), None nếu chưa có ảnh."""
+    if not service.anhdichvu_hash:
+        return None
+    return f"/api/services/{service.madv}/image?v={service.anhdichvu_hash}"
+
+
+def service_image_hash(madv):
+    """Hash ảnh hiện tại của dịch vụ (không đọc blob), None nếu không có."""
+    return db.session.query(DichVu.anhdichvu_hash).filter(DichVu.madv == madv).scalar()
+
+
+def service_image_data(madv):
+    return db.session.query(DichVu.anhdichvu).filter(DichVu.madv == madv).scalar()
+
+
+# ========== BIẾN THỂ THEO KÍCH THƯỚC ==========
+def _widths():
+    return tuple(sorted(current_app.config.get('IMAGE_VARIANT_WIDTHS', (160, 320, 640, 1280))))
+
+
+def variant_width(requested):
+    """Chiều rộng biến thể cho ?w=: nhỏ nhất >= requested, hoặc lớn nhất nếu vượt mọi mức."""
+    widths = _widths()
+    for width in widths:
+        if width >= requested:
+            return width
+    return widths[-1]
+
+
+def variant_format(accept_header):
+    """WebP nếu trình duyệt khai báo hỗ trợ, ngược lại JPEG."""
+    return WEBP if 'image/webp' in (accept_header or '') else JPEG
+
+
+def variant_name(base, width, fmt):
+    return f"{base}_w{width}.{fmt[0]}"
+
+
+def variant_files(filename):
+    """Tên mọi biến thể của ảnh filename (tương đối với thư mục chứa filename)."""
+    base = os.path.splitext(filename)[0]
+    return [variant_name(base, width, fmt) for width in _widths() for fmt in (WEBP, JPEG)]
+
+
+def _services_folder():
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'services')
+
+
+def _flatten(image):
+    """RGB cho JPEG (nền trắng dưới vùng trong suốt)."""
+    if image.mode == 'RGB':
+        return image
+    from PIL import Image
+    rgba = image.convert('RGBA')
+    background = Image.new('RGB', rgba.size, (255, 255, 255))
+    background.paste(rgba, mask=rgba.getchannel('A'))
+    return background
+
+
+def _save_atomic(image, path, fmt, **options):
+    partial = path + '.part'
+    image.save(partial, fmt, **options)
+    os.replace(partial, path)
+
+
+def render_variants(source, folder, base, widths):
+    """
+    Ghi các biến thể của ảnh `source` (đường dẫn hoặc file-like) vào folder.
+    Không truyền exif / icc_profile khi lưu: metadata (GPS, máy ảnh...) bị bỏ.
+    """
+    from PIL import Image, ImageOps
+
+    os.makedirs(folder, exist_ok=True)
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        for width in widths:
+            # Không phóng to: mức lớn hơn ảnh gốc là bản cỡ gốc đã bỏ metadata
+            resized = image.copy()
+            resized.thumbnail((min(width, image.width), image.height * width), Image.LANCZOS)
+            _save_atomic(resized, os.path.join(folder, variant_name(base, width, WEBP)),
+                         'WEBP', quality=WEBP_QUALITY, method=4)
+            _save_atomic(_flatten(resized), os.path.join(folder, variant_name(base, width, JPEG)),
+                         'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+
+
+def _schedule(key, job, *args, retry=True):
+    """Chạy job(*args) ở luồng nền; job trả về False nếu ảnh hỏng (không thử lại trừ khi retry)."""
+    with _pending_lock:
+        if key in _pending or (not retry and key in _failed):
+            return
+        _pending.add(key)
+        _failed.discard(key)
+
+    def run():
+        ok = False
+        try:
+            ok = job(*args) is not False
+        finally:
+            with _pending_lock:
+                _pending.discard(key)
+                if not ok:
+                    _failed.add(key)
+
+    _executor.submit(run)
+
+
+def schedule_file_variants(app, filename, retry=True):
+    """Tạo biến thể cho ảnh đại diện UPLOAD_FOLDER/filename (sau khi tệp đã ghi xong)."""
+    _schedule(('file', filename), _make_file_variants, app, filename, retry=retry)
+
+
+def _make_file_variants(app, filename):
+    with app.app_context():
+        folder = app.config['UPLOAD_FOLDER']
+        try:
+            render_variants(os.path.join(folder, filename), folder,
+                            os.path.splitext(filename)[0], _widths())
+        except Exception as e:
+            app.logger.warning(f"Không tạo được biến thể ảnh {filename}: {e}")
+            return False
+
+
+def schedule_service_variants(app, madv, retry=True):
+    """Tạo biến thể cho ảnh dịch vụ madv (sau khi đã commit)."""
+    _schedule(('service', madv), _make_service_variants, app, madv, retry=retry)
+
+
+def _make_service_variants(app, madv):
+    from io import BytesIO
+
+    with app.app_context():
+        try:
+            row = db.session.query(DichVu.anhdichvu_hash, DichVu.anhdichvu).filter(
+                DichVu.madv == madv
+            ).first()
+            if row is None or row.anhdichvu is None:
+                return
+            render_variants(BytesIO(row.anhdichvu), _services_folder(), row.anhdichvu_hash, _widths())
+        except Exception as e:
+            app.logger.warning(f"Không tạo được biến thể ảnh dịch vụ {madv}: {e}")
+            return False
+        finally:
+            db.session.remove()
+
+
+def file_variant(filename, requested_width, accept_header):
+    """
+    (tên tệp biến thể trong UPLOAD_FOLDER, MIME) cho ảnh đại diện, hoặc None nếu chưa có
+    (khi đó xếp lịch tạo, người gọi trả ảnh gốc).
+    """
+    fmt = variant_format(accept_header)
+    name = variant_name(os.path.splitext(filename)[0], variant_width(requested_width), fmt)
+    if os.path.isfile(os.path.join(current_app.config['UPLOAD_FOLDER'], name)):
+        return name, fmt[2]
+    schedule_file_variants(current_app._get_current_object(), filename, retry=False)
+    return None
+
+
+def service_variant(madv, digest, requested_width, accept_header):
+    """(đường dẫn tuyệt đối, MIME, chiều rộng) biến thể ảnh dịch vụ, hoặc None (xếp lịch tạo)."""
+    fmt = variant_format(accept_header)
+    width = variant_width(requested_width)
+    path = os.path.join(_services_folder(), variant_name(digest, width, fmt))
+    if os.path.isfile(path):
+        return path, fmt[2], width
+    schedule_service_variants(current_app._get_current_object(), madv, retry=False)
+    return None
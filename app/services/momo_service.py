@@ -6,6 +6,7 @@ import hashlib
 from flask import current_app, jsonify
 from ..models import HoaDon, ThanhToan
 from ..extensions import db
+from . import event_bus
 from datetime import datetime
 
 def create_momo_payment_link(invoice):
@@ -175,8 +176,15 @@ def process_momo_webhook(data):
         )
         invoice.trangthai = 'Đã thanh toán'
         db.session.add(new_payment)
+        event = {
+            'channel': 'payment', 'type': 'paid', 'mahd': invoice.mahd, 'malh': invoice.malh,
+            'makh': invoice.makh, 'manv': invoice.manv, 'sotien': data.get('amount'), 'phuongthuc': new_payment.phuongthuc
+        }
         db.session.commit()
         current_app.logger.info(f"✅ Momo Webhook: Updated invoice {invoice.mahd} to paid.")
     except Exception as e:
         db.session.rollback()
-        current_app.logger.error(f"❌ Momo Webhook: Error updating DB for invoice {invoice.mahd}: {e}")
\ No newline at end of file
+        current_app.logger.error(f"❌ Momo Webhook: Error updating DB for invoice {invoice.mahd}: {e}")
+        return
+    # Sau commit: lỗi phát sự kiện không được làm mất cập nhật thanh toán
+    event_bus.notify_committed(event)
\ No newline at end of file
@@ -0,0 +1,118 @@
+# app/services/notification_service.py
+"""
+Số đếm cho các badge của người dùng hiện tại, tính bằng MỘT câu SQL:
+
+    chat_unread / chat_conversations   tin nhắn chưa đọc (mọi người dùng chat)
+    appointments_pending               lịch hẹn chờ xác nhận (khách: của mình,
+                                       KTV: được gán cho mình, lễ tân / quản lý: tất cả)
+    shift_registrations_pending        đăng ký ca chờ duyệt (admin / quản lý: tất cả,
+                                       nhân viên khác: của mình)
+
+Layout admin và trang khách poll liên tục nên kết quả được giữ trong bộ nhớ
+worker NOTIFICATION_SUMMARY_TTL giây cho từng người. Single-flight: nhiều request
+cùng lúc của một người chỉ chạy một truy vấn, các request còn lại chờ kết quả.
+ETag tính từ nội dung nên client nhận 304 chừng nào số đếm chưa đổi.
+"""
+import hashlib
+import json
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func
+
+from ..extensions import db
+from ..models import LichHen, DangKyCaLam
+from . import chat_service
+
+SHIFT_APPROVER_ROLES = ('admin', 'manager')
+APPOINTMENT_ALL_ROLES = ('admin', 'manager', 'letan')
+MAX_CACHE_ENTRIES = 5000
+FLIGHT_WAIT_SECONDS = 5
+
+_cache = {}         # khóa người dùng -> (hết hạn lúc, counts, etag)
+_inflight = {}      # khóa người dùng -> threading.Event của lượt tính đang chạy
+_lock = threading.Lock()
+
+
+def _cache_key(user, user_type):
+    if user_type == 'customer':
+        return ('customer', user.makh)
+    return ('staff', user.manv, user.role)
+
+
+def compute_counts(user, user_type):
+    """Tính mọi số đếm badge của user (1 truy vấn, không qua cache)."""
+    columns = []
+
+    viewer = chat_service.viewer_for(user, user_type)
+    if viewer is not None:
+        chat = chat_service.unread_totals(viewer)
+        columns += [chat.c.messages.label('chat_unread'),
+                    chat.c.conversations.label('chat_conversations')]
+
+    appointments = db.session.query(func.count(LichHen.malh)).filter(LichHen.trangthai == 'pending')
+    if user_type == 'customer':
+        appointments = appointments.filter(LichHen.makh == user.makh)
+    elif user.role not in APPOINTMENT_ALL_ROLES:
+        appointments = appointments.filter(LichHen.manv == user.manv)
+    columns.append(appointments.scalar_subquery().label('appointments_pending'))
+
+    if user_type == 'staff':
+        registrations = db.session.query(func.count(DangKyCaLam.id)).filter(
+            DangKyCaLam.trangthai == 'pending'
+        )
+        if user.role not in SHIFT_APPROVER_ROLES:
+            registrations = registrations.filter(DangKyCaLam.manv == user.manv)
+        columns.append(registrations.scalar_subquery().label('shift_registrations_pending'))
+
+    row = db.session.query(*columns).one()
+    return {key: int(value or 0) for key, value in row._mapping.items()}
+
+
+def _etag(key, counts):
+    payload = json.dumps([key, counts], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def _store(key, counts, etag, ttl):
+    with _lock:
+        if len(_cache) >= MAX_CACHE_ENTRIES:
+            now = time.monotonic()
+            for stale in [k for k, entry in _cache.items() if entry[0] <= now]:
+                del _cache[stale]
+            if len(_cache) >= MAX_CACHE_ENTRIES:
+                _cache.clear()
+        _cache[key] = (time.monotonic() + ttl, counts, etag)
+
+
+def get_summary(user, user_type):
+    """(counts, etag) của user - từ cache nếu còn hạn, nếu không thì tính lại (single-flight)."""
+    key = _cache_key(user, user_type)
+    ttl = current_app.config.get('NOTIFICATION_SUMMARY_TTL', 3)
+
+    while True:
+        with _lock:
+            entry = _cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1], entry[2]
+            flight = _inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _inflight[key] = threading.Event()
+        if leader:
+            break
+        # Request khác của cùng người đang tính: chờ rồi đọc cache (lỗi / quá lâu thì tự tính)
+        if not flight.wait(FLIGHT_WAIT_SECONDS):
+            counts = compute_counts(user, user_type)
+            return counts, _etag(key, counts)
+
+    try:
+        counts = compute_counts(user, user_type)
+        etag = _etag(key, counts)
+        _store(key, counts, etag, ttl)
+        return counts, etag
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        flight.set()
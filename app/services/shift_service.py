@@ -0,0 +1,148 @@
+# app/services/shift_service.py
+"""
+Chỉ mục giờ làm việc của KTV theo ngày (từ CaLam + nhanvien_calam).
+
+Mỗi ngày giữ {manv: [(start, end), ...]} đã gộp các ca liền nhau, nạp chung
+một truy vấn cho nhiều ngày và giữ trong bộ nhớ. Mọi đường kiểm tra lịch rảnh
+giao lịch hẹn với chỉ mục này trên bộ nhớ thay vì JOIN ca làm cho từng khung giờ.
+
+shift_manage_bp / staff_manage_bp gọi invalidate(ngay) sau mỗi thay đổi ca / phân ca /
+nhân viên (sau commit): xóa ở worker hiện tại rồi phát sự kiện 'shift' qua event_bus
+để các worker khác cũng xóa (booking_service từ chối / nhận lịch theo is_on_shift).
+Mất kết nối LISTEN thì xóa toàn bộ; TTL (AVAILABILITY_CACHE_TTL) chỉ còn là lưới an toàn.
+"""
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from flask import current_app, has_app_context
+
+from ..extensions import db
+from ..models import NhanVien, CaLam, nhanvien_calam
+from . import event_bus
+
+CHANNEL = 'shift'
+
+_cache = {}   # ngay -> (loaded_at, {manv: [(start, end), ...]})
+_lock = threading.Lock()
+
+
+def _cache_ttl():
+    try:
+        return current_app.config.get('AVAILABILITY_CACHE_TTL', 60)
+    except RuntimeError:
+        return 60
+
+
+def _load_windows(ngay_list):
+    rows = db.session.query(
+        CaLam.ngay, nhanvien_calam.c.manv, CaLam.giobatdau, CaLam.gioketthuc
+    ).join(
+        CaLam, CaLam.maca == nhanvien_calam.c.maca
+    ).join(
+        NhanVien, NhanVien.manv == nhanvien_calam.c.manv
+    ).filter(
+        CaLam.ngay.in_(ngay_list),
+        NhanVien.trangthai == True,
+        NhanVien.role == 'staff'
+    ).all()
+
+    raw = {ngay: {} for ngay in ngay_list}
+    for ngay, manv, giobatdau, gioketthuc in rows:
+        start = datetime.combine(ngay, giobatdau)
+        end = datetime.combine(ngay, gioketthuc)
+        if end <= start:  # ca qua đêm: tính tới hết ngày
+            end = datetime.combine(ngay + timedelta(days=1), datetime.min.time())
+        raw[ngay].setdefault(manv, []).append((start, end))
+
+    windows = {}
+    for ngay, by_manv in raw.items():
+        windows[ngay] = {}
+        for manv, ranges in by_manv.items():
+            merged = []
+            for start, end in sorted(ranges):
+                if merged and start <= merged[-1][1]:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+                else:
+                    merged.append((start, end))
+            windows[ngay][manv] = merged
+    return windows
+
+
+def get_windows(ngay_list):
+    """
+    {ngay: {manv: [(start, end), ...]}} cho các ngày yêu cầu.
+    Ngày chưa có (hoặc đã hết hạn) trong bộ nhớ đệm được nạp chung một truy vấn.
+    """
+    ngay_list = sorted(set(ngay_list))
+    ttl = _cache_ttl()
+    now = time.monotonic()
+    result, missing = {}, []
+    with _lock:
+        for ngay in ngay_list:
+            entry = _cache.get(ngay)
+            if entry is not None and now - entry[0] < ttl:
+                result[ngay] = entry[1]
+            else:
+                missing.append(ngay)
+
+    if missing:
+        loaded = _load_windows(missing)
+        with _lock:
+            for ngay, windows in loaded.items():
+                _cache[ngay] = (now, windows)
+        result.update(loaded)
+    return result
+
+
+def get_staff_windows(manv, ngay):
+    return get_windows([ngay])[ngay].get(int(manv), [])
+
+
+def covers(windows, start, end):
+    return any(w_start <= start and end <= w_end for w_start, w_end in windows)
+
+
+def is_on_shift(manv, start, end):
+    """True nếu [start, end) nằm trọn trong một ca làm của nhân viên."""
+    return covers(get_staff_windows(manv, start.date()), start, end)
+
+
+def _drop(ngay=None):
+    with _lock:
+        if ngay is None:
+            _cache.clear()
+        else:
+            _cache.pop(ngay, None)
+
+
+def invalidate(ngay=None):
+    """
+    Xóa giờ làm việc khỏi bộ nhớ đệm của mọi worker. Không truyền ngày = xóa toàn bộ.
+    Gọi sau commit (ca làm hiếm khi đổi: phát trên kết nối riêng, lỗi chỉ ghi log).
+    """
+    _drop(ngay)
+    if has_app_context():
+        event_bus.notify_committed({
+            'channel': CHANNEL, 'type': 'invalidate', 'pid': os.getpid(),
+            'ngay': ngay.isoformat() if ngay else None
+        })
+
+
+def _on_invalidate(event):
+    if event.get('pid') == os.getpid():
+        return  # worker phát đã tự xóa
+    ngay = event.get('ngay')
+    _drop(date.fromisoformat(ngay) if ngay else None)
+
+
+def _on_bus_event(event):
+    if event.get('type') == 'reconnected':
+        _drop()
+
+
+def init_app(app):
+    """Nhận sự kiện xóa giờ làm việc từ worker khác (luồng LISTEN: availability_service.init_app)."""
+    event_bus.add_handler(CHANNEL, _on_invalidate)
+    event_bus.add_handler('bus', _on_bus_event)
@@ -0,0 +1,238 @@
+# app/services/storage_service.py
+"""
+Lưu tệp tải lên theo nội dung (content-addressed), dùng cho ảnh đại diện.
+
+- Tệp được đọc từng khúc CHUNK_SIZE ghi ra tệp tạm, vừa ghi vừa tính SHA-256,
+  xong mới đổi tên thành khóa <2 ký tự đầu>/<sha256><đuôi>. Không giữ cả tệp
+  trong bộ nhớ.
+- Cùng nội dung = cùng khóa: tệp chỉ lưu một lần, bảng tepluutru đếm số tham
+  chiếu (soluot). Người dùng đổi ảnh thì release() khóa cũ; hết tham chiếu thì
+  purge() xóa tệp (và các biến thể ?w= của image_service) sau khi commit.
+- Khóa tư vấn pg_advisory_xact_lock(hashtext(khóa)) tuần tự hóa store() / purge()
+  của cùng một khóa giữa các worker: không xóa nhầm tệp vừa được tải lên lại.
+
+Backend chọn theo STORAGE_BACKEND: 'local' (UPLOAD_FOLDER, cùng chỗ với các tệp cũ
+và biến thể ảnh) hoặc 's3' (API tương thích S3: AWS, MinIO..., cần cài boto3).
+Backend local cũng là bản thay thế khi thử nghiệm.
+Tệp cũ đặt tên theo người dùng vẫn phục vụ bình thường, chỉ không được đếm tham chiếu.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from flask import current_app
+from sqlalchemy import text
+
+from ..extensions import db
+from . import image_service, file_service
+
+CHUNK_SIZE = 64 * 1024
+IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+_EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/gif': '.gif', 'image/webp': '.webp'}
+# Khóa theo nội dung (kể cả biến thể <khóa>_w<rộng>.<đuôi> của image_service)
+_CONTENT_KEY = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{64}[._]')
+
+_LOCK_SQL = text("SELECT pg_advisory_xact_lock(hashtext(:key))")
+_ADD_REF_SQL = text("""
+    INSERT INTO tepluutru (khoa, kichthuoc, soluot, ngaytao)
+    VALUES (:key, :size, 1, now())
+    ON CONFLICT (khoa) DO UPDATE SET soluot = tepluutru.soluot + 1
+""")
+_RELEASE_SQL = text("UPDATE tepluutru SET soluot = soluot - 1 WHERE khoa = :key RETURNING soluot")
+_DELETE_SQL = text("DELETE FROM tepluutru WHERE khoa = :key AND soluot <= 0")
+_EXISTS_SQL = text("SELECT 1 FROM tepluutru WHERE khoa = :key")
+
+
+class UploadRejected(Exception):
+    """Tệp không được nhận: rỗng (400), quá lớn (413) hoặc sai loại (415)."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# ========== BACKEND ==========
+class LocalBackend:
+    """Lưu trên đĩa dưới thư mục root."""
+    remote = False
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def temp_dir(self):
+        # Cùng ổ đĩa với root: put() chỉ là một lần đổi tên
+        return os.path.join(self.root, '.tmp')
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def put(self, local_file, key):
+        target = self.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(local_file, target)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key):
+        return None
+
+
+class S3Backend:
+    """API tương thích S3 (bucket + endpoint tùy chọn cho MinIO / dịch vụ khác)."""
+    remote = True
+
+    def __init__(self, bucket, endpoint_url=None, prefix=''):
+        try:
+            import boto3
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 cần cài boto3") from e
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None)
+
+    def path(self, key):
+        return None
+
+    def temp_dir(self):
+        return tempfile.gettempdir()
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def put(self, local_file, key):
+        self.client.upload_file(local_file, self.bucket, self.prefix + key)
+        os.remove(local_file)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def url(self, key, expires=3600):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self.prefix + key}, ExpiresIn=expires
+        )
+
+
+def _create_backend(config):
+    kind = config.get('STORAGE_BACKEND', 'local')
+    if kind == 'local':
+        return LocalBackend(config['UPLOAD_FOLDER'])
+    if kind == 's3':
+        return S3Backend(config['STORAGE_S3_BUCKET'], config.get('STORAGE_S3_ENDPOINT'),
+                         config.get('STORAGE_S3_PREFIX', ''))
+    raise RuntimeError(f"STORAGE_BACKEND không hợp lệ: {kind}")
+
+
+def get_backend():
+    """Backend của app hiện tại (tạo một lần, giữ trong app.extensions)."""
+    backend = current_app.extensions.get('storage_backend')
+    if backend is None:
+        backend = current_app.extensions['storage_backend'] = _create_backend(current_app.config)
+    return backend
+
+
+# ========== LƯU / THAM CHIẾU ==========
+def store(stream, types=IMAGE_TYPES, max_bytes=None):
+    """
+    Lưu nội dung stream, trả về khóa và tăng số tham chiếu (trong giao dịch hiện tại,
+    người gọi commit). Raise UploadRejected nếu tệp rỗng / quá lớn / sai loại.
+    """
+    backend = get_backend()
+    os.makedirs(backend.temp_dir(), exist_ok=True)
+    digest = hashlib.sha256()
+    size, head = 0, b''
+    fd, partial = tempfile.mkstemp(dir=backend.temp_dir(), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if not head:
+                    head = chunk[:16]
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise UploadRejected(f"Tệp vượt quá {max_bytes // (1024 * 1024)} MB", 413)
+                digest.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise UploadRejected("Tệp rỗng", 400)
+        mime = image_service.image_mimetype(head)
+        if types and mime not in types:
+            raise UploadRejected("Chỉ nhận ảnh JPEG, PNG, GIF hoặc WebP", 415)
+
+        hexdigest = digest.hexdigest()
+        key = f"{hexdigest[:2]}/{hexdigest}{_EXTENSIONS.get(mime, '')}"
+        db.session.execute(_LOCK_SQL, {"key": key})
+        if not backend.exists(key):
+            backend.put(partial, key)
+            file_service.forget_missing(key)
+        db.session.execute(_ADD_REF_SQL, {"key": key, "size": size})
+        return key
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def release(key):
+    """
+    Bớt một tham chiếu tới key (trong giao dịch hiện tại). Trả về True nếu hết tham chiếu:
+    người gọi purge(key) sau khi commit. Khóa cũ không có trong tepluutru: bỏ qua.
+    """
+    if not key:
+        return False
+    remaining = db.session.execute(_RELEASE_SQL, {"key": key}).scalar()
+    if remaining is None or remaining > 0:
+        return False
+    db.session.execute(_DELETE_SQL, {"key": key})
+    return True
+
+
+def purge(key):
+    """
+    Xóa tệp của key (và biến thể ảnh) nếu không còn tham chiếu. Gọi sau commit, hoặc sau
+    rollback để dọn tệp vừa store() mà giao dịch thất bại. Chạy giao dịch riêng.
+    """
+    if not key:
+        return
+    backend = get_backend()
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(_LOCK_SQL, {"key": key})
+            if conn.execute(_EXISTS_SQL, {"key": key}).first() is not None:
+                return
+            backend.delete(key)
+            if not backend.remote:
+                for name in image_service.variant_files(key):
+                    backend.delete(name)
+    except Exception as e:
+        current_app.logger.warning(f"Không xóa được tệp {key}: {e}")
+
+
+def is_content_key(key):
+    """Khóa theo nội dung: nội dung tệp không bao giờ đổi (cache vĩnh viễn được)."""
+    return bool(_CONTENT_KEY.match(key or ''))
+
+
+def local_path(key):
+    """Đường dẫn trên đĩa của key (backend local), None nếu backend ở xa."""
+    return get_backend().path(key)
+
+
+def remote_url(key):
+    """URL tải trực tiếp từ backend ở xa (S3 presigned), None với backend local."""
+    return get_backend().url(key)
@@ -0,0 +1,343 @@
+# app/services/tinnhan_partition_service.py
+"""
+Bảng tinnhan phân vùng theo tháng trên thoigiangui (migration d4e8a1f6b350):
+
+    tinnhan_p2026_10   FOR VALUES FROM ('2026-10-01') TO ('2026-11-01')
+    ...
+    tinnhan_default    DEFAULT (chỉ để không mất tin nếu chưa kịp tạo phân vùng)
+
+Bảo trì (`flask tinnhan maintain`, chạy từ cron; khóa advisory bảo đảm mỗi lúc một lượt):
+- ensure_partitions(): tạo trước phân vùng cho TINNHAN_PARTITIONS_AHEAD tháng tới.
+- archive_partitions(): phân vùng cũ hơn TINNHAN_RETENTION_MONTHS tháng được
+  DETACH, chép gọn sang tinnhan_luutru (không có tsvector / partial index) rồi
+  DROP - index và vacuum của tinnhan chỉ còn phủ các tháng đang giữ.
+  Postgres cấm DETACH ... CONCURRENTLY khi bảng có phân vùng DEFAULT, nên dùng
+  DETACH thường: khóa ACCESS EXCLUSIVE trên tinnhan (chat chờ) trong một giao
+  dịch ngắn chỉ sửa catalog, có DETACH_LOCK_TIMEOUT - không lấy được khóa thì
+  bỏ qua, lượt cron sau thử lại. Mặc định TINNHAN_RETENTION_MONTHS = 0
+  (giữ hết): chat_service không đọc tinnhan_luutru, tin đã lưu trữ không còn
+  hiện trong lịch sử / tìm kiếm.
+Không chạy trong app factory: mọi create_app() (worker gunicorn, `flask db upgrade`,
+script) sẽ chạy DDL, có thể trước cả migration tạo bảng tinnhan.
+
+Cắt tỉa phân vùng khi đọc: client phân trang bằng matn, không có thoigiangui.
+partition_ranges() giữ (trong bộ nhớ, TTL) khoảng matn của từng phân vùng;
+since_bound / before_bound đổi một mốc matn thành mốc thời gian để chat_service
+thêm điều kiện trên thoigiangui - Postgres chỉ quét các phân vùng liên quan.
+Phân vùng đã đóng (hết tháng) không nhận thêm tin nên khoảng matn của nó cố định;
+phân vùng còn mở chỉ được loại theo matn nhỏ nhất (có nới MATN_SLACK).
+"""
+import re
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from ..extensions import db
+
+PARENT = 'tinnhan'
+ARCHIVE = 'tinnhan_luutru'
+DEFAULT_PARTITION = 'tinnhan_default'
+PARTITION_NAME = re.compile(r'^tinnhan_p(\d{4})_(\d{2})$')
+# Cột thật (noidung_tsv là cột sinh tự động, không chép)
+COLUMNS = 'matn, maht, noidung, thoigiangui, nguoigui_makh, nguoigui_manv, da_doc'
+MAINTENANCE_LOCK = "hashtext('tinnhan_partition_maintenance')"
+# Tin ghi lệch giờ quanh ranh giới tháng (máy chủ lệch đồng hồ, giờ VN / UTC):
+# phân vùng chỉ coi là đóng sau khi hết tháng một khoảng này
+CLOSED_GRACE = timedelta(days=1)
+# Giao dịch lấy matn (nextval) trước nhưng commit sau có thể chen vào phân vùng còn mở
+# với matn nhỏ hơn giá trị đã thấy - nới mốc matn của phân vùng mở một khoảng này
+MATN_SLACK = 1000
+# Chờ khóa tối đa khi DETACH: hàng đợi khóa sau DETACH chặn cả tin nhắn mới
+DETACH_LOCK_TIMEOUT = '3s'
+
+# Một phân vùng: [start, end) + matn nhỏ / lớn nhất (None nếu rỗng) + đã đóng chưa
+Partition = namedtuple('Partition', 'name start end min_matn max_matn closed')
+
+_cache = {'ranges': None, 'loaded_at': 0.0}
+_cache_lock = threading.Lock()
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{PARENT}_p{month.year:04d}_{month.month:02d}"
+
+
+def _month_of(name):
+    match = PARTITION_NAME.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def _attached_partitions(conn):
+    """Tên các phân vùng tháng đang gắn vào tinnhan."""
+    rows = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'tinnhan'::regclass
+    """)).scalars().all()
+    return [name for name in rows if _month_of(name)]
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    """Cho alembic autogenerate: bỏ qua các phân vùng con (không có model riêng)."""
+    if type_ == 'table' and reflected and compare_to is None:
+        return not (_month_of(name) or name == DEFAULT_PARTITION)
+    return True
+
+
+# ========== KHOẢNG MATN CỦA TỪNG PHÂN VÙNG (CẮT TỈA KHI ĐỌC) ==========
+def _is_closed(month, now):
+    """Phân vùng của `month` không còn nhận tin: đã hết tháng thêm CLOSED_GRACE."""
+    return datetime.combine(add_months(month, 1), datetime.min.time()) + CLOSED_GRACE <= now
+
+
+def _load_ranges():
+    # Kết nối riêng: lỗi ở đây không làm hỏng giao dịch của request
+    with db.engine.connect() as conn:
+        names = sorted(_attached_partitions(conn), key=_month_of)
+        if not names:
+            return []
+        # min/max matn mỗi phân vùng: đọc đầu / cuối index khóa chính, không quét bảng
+        union = " UNION ALL ".join(
+            f"SELECT '{name}' AS name, min(matn) AS lo, max(matn) AS hi FROM {name}" for name in names
+        )
+        stats = {row.name: (row.lo, row.hi) for row in conn.execute(text(union))}
+    now = datetime.now()
+    ranges = []
+    for name in names:
+        start = _month_of(name)
+        end = add_months(start, 1)
+        lo, hi = stats.get(name, (None, None))
+        ranges.append(Partition(name, start, end, lo, hi, _is_closed(start, now)))
+    return ranges
+
+
+def partition_ranges():
+    """Danh sách Partition theo thứ tự thời gian (cache TINNHAN_PARTITION_CACHE_TTL giây)."""
+    ttl = current_app.config.get('TINNHAN_PARTITION_CACHE_TTL', 300)
+    with _cache_lock:
+        ranges, loaded_at = _cache['ranges'], _cache['loaded_at']
+    if ranges is not None and time.monotonic() - loaded_at < ttl:
+        return ranges
+    try:
+        ranges = _load_ranges()
+    except Exception as e:
+        # Chưa chạy migration phân vùng / lỗi đọc catalog: không cắt tỉa, vẫn đúng
+        current_app.logger.warning(f"Không đọc được phân vùng tinnhan: {e}")
+        ranges = []
+    with _cache_lock:
+        _cache.update(ranges=ranges, loaded_at=time.monotonic())
+    return ranges
+
+
+def invalidate_ranges():
+    with _cache_lock:
+        _cache.update(ranges=None, loaded_at=0.0)
+
+
+def _as_datetime(day):
+    return datetime.combine(day, datetime.min.time())
+
+
+def since_bound(matn):
+    """
+    Mốc thoigiangui >= cho "tin có matn > `matn`", hoặc None (không cắt tỉa được).
+    Chỉ loại các phân vùng đã đóng mà matn lớn nhất <= `matn`.
+    """
+    candidates = [p for p in partition_ranges()
+                  if not p.closed or (p.max_matn is not None and p.max_matn > matn)]
+    if not candidates:
+        return None
+    return _as_datetime(min(p.start for p in candidates))
+
+
+def before_bound(matn):
+    """
+    Mốc thoigiangui < cho "tin có matn < `matn`", hoặc None (không cắt tỉa được).
+    Loại các phân vùng mà mọi tin (kể cả tin sẽ ghi thêm) đều có matn >= `matn`.
+    """
+    ranges = partition_ranges()
+    if not ranges:
+        return None
+    # Phân vùng mở đang rỗng chỉ có thể nhận tin có matn > matn lớn nhất đã thấy (trừ khoảng nới)
+    newest = max((p.max_matn for p in ranges if p.max_matn is not None), default=0)
+
+    def may_hold_older(p):
+        if p.closed:
+            return p.min_matn is not None and p.min_matn < matn
+        lowest = p.min_matn if p.min_matn is not None else newest
+        return lowest - MATN_SLACK < matn
+
+    candidates = [p for p in ranges if may_hold_older(p)]
+    if not candidates:
+        # Mọi phân vùng đều mới hơn mốc: chỉ có thể còn ở phân vùng mặc định
+        return _as_datetime(ranges[0].start)
+    last = max(p.end for p in candidates)
+    return None if last >= ranges[-1].end else _as_datetime(last)
+
+
+def recent_bound(since):
+    """Mốc thoigiangui >= là đầu tháng chứa `since` (tải trang cuối của hội thoại)."""
+    if since is None or not partition_ranges():
+        return None
+    return _as_datetime(month_start(since))
+
+
+# ========== TẠO PHÂN VÙNG ==========
+def _create_partition(conn, month):
+    """
+    Tạo phân vùng cho `month` (trong giao dịch của conn). Nếu phân vùng mặc định
+    đã lỡ nhận tin của tháng này thì chuyển các tin đó sang phân vùng mới.
+    """
+    name, start, end = partition_name(month), month, add_months(month, 1)
+    bounds = {'start': start, 'end': end}
+    stray = conn.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+        f"WHERE thoigiangui >= :start AND thoigiangui < :end)"
+    ), bounds).scalar()
+    if not stray:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT} "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        ))
+        return 0
+
+    conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {DEFAULT_PARTITION}"))
+    conn.execute(text(
+        f"CREATE TABLE {name} PARTITION OF {PARENT} FOR VALUES FROM ('{start}') TO ('{end}')"
+    ))
+    moved = conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE thoigiangui >= :start AND thoigiangui < :end
+            RETURNING {COLUMNS}
+        )
+        INSERT INTO {PARENT} ({COLUMNS}) SELECT {COLUMNS} FROM moved
+    """), bounds).rowcount
+    conn.execute(text(f"ALTER TABLE {PARENT} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+    return moved
+
+
+def ensure_partitions(months_ahead):
+    """Bảo đảm có phân vùng từ tháng hiện tại tới `months_ahead` tháng sau. Trả về tên các phân vùng mới."""
+    created = []
+    current = month_start(date.today())
+    with db.engine.connect() as conn:
+        existing = set(_attached_partitions(conn))
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if partition_name(month) in existing:
+            continue
+        with db.engine.begin() as conn:
+            moved = _create_partition(conn, month)
+        created.append(partition_name(month))
+        if moved:
+            current_app.logger.warning(
+                f"Đã chuyển {moved} tin nhắn từ {DEFAULT_PARTITION} sang {partition_name(month)}"
+            )
+    if created:
+        invalidate_ranges()
+    return created
+
+
+# ========== LƯU TRỮ PHÂN VÙNG CŨ ==========
+def _detached_leftovers(conn):
+    """Phân vùng tháng đã detach nhưng chưa chép xong (lượt trước bị ngắt giữa chừng)."""
+    rows = conn.execute(text("""
+        SELECT c.relname FROM pg_class c
+        WHERE c.relkind = 'r' AND c.relname LIKE 'tinnhan\\_p%'
+          AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)
+    """)).scalars().all()
+    return [name for name in rows if _month_of(name)]
+
+
+def _compact(name):
+    """Chép phân vùng đã detach sang tinnhan_luutru rồi xóa, trong một giao dịch."""
+    with db.engine.begin() as conn:
+        copied = conn.execute(text(
+            f"INSERT INTO {ARCHIVE} ({COLUMNS}) SELECT {COLUMNS} FROM {name} "
+            f"ON CONFLICT (matn) DO NOTHING"
+        )).rowcount
+        conn.execute(text(f"DROP TABLE {name}"))
+    return copied
+
+
+def archive_partitions(retention_months):
+    """
+    Chuyển các phân vùng kết thúc trước (tháng hiện tại - retention_months) sang tinnhan_luutru.
+    Trả về {tên phân vùng: số tin đã chép}.
+    """
+    if retention_months <= 0:
+        return {}
+    cutoff = add_months(month_start(date.today()), -retention_months)
+    archived = {}
+    with db.engine.connect() as conn:
+        attached = sorted(_attached_partitions(conn))
+    for name in attached:
+        if add_months(_month_of(name), 1) > cutoff:
+            continue
+        # Mỗi phân vùng một giao dịch ngắn: giữ khóa ACCESS EXCLUSIVE trên tinnhan ít nhất có thể
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(text(f"SET LOCAL lock_timeout = '{DETACH_LOCK_TIMEOUT}'"))
+                conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+        except OperationalError as e:
+            current_app.logger.warning(f"Chưa detach được {name} (thử lại lượt sau): {e}")
+    with db.engine.connect() as conn:
+        leftovers = _detached_leftovers(conn)
+    invalidate_ranges()
+    for name in sorted(leftovers):
+        archived[name] = _compact(name)
+    return archived
+
+
+# ========== BẢO TRÌ ==========
+def run_maintenance(app):
+    """Một lượt bảo trì; bỏ qua (trả về None) nếu tiến trình khác đang chạy (khóa advisory phiên)."""
+    with app.app_context():
+        config = app.config
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as lock_conn:
+            if not lock_conn.execute(text(f"SELECT pg_try_advisory_lock({MAINTENANCE_LOCK})")).scalar():
+                return None
+            try:
+                created = ensure_partitions(config.get('TINNHAN_PARTITIONS_AHEAD', 2))
+                archived = archive_partitions(config.get('TINNHAN_RETENTION_MONTHS', 0))
+            finally:
+                lock_conn.execute(text(f"SELECT pg_advisory_unlock({MAINTENANCE_LOCK})"))
+        if created or archived:
+            current_app.logger.info(
+                f"Bảo trì tinnhan: tạo {created or 'không'}, lưu trữ {archived or 'không'}"
+            )
+        return created, archived
+
+
+def register_cli(app):
+    """`flask tinnhan maintain`: chạy định kỳ từ cron (ví dụ mỗi 6 giờ)."""
+
+    @app.cli.group('tinnhan')
+    def tinnhan_cli():
+        """Phân vùng tháng của bảng tinnhan."""
+
+    @tinnhan_cli.command('maintain')
+    def maintain_command():
+        """Tạo trước phân vùng tháng tới, lưu trữ phân vùng quá TINNHAN_RETENTION_MONTHS."""
+        result = run_maintenance(app)
+        if result is None:
+            click.echo("Tiến trình khác đang bảo trì tinnhan, bỏ qua")
+            return
+        created, archived = result
+        click.echo(f"Tạo phân vùng: {', '.join(created) or 'không'}")
+        click.echo(f"Lưu trữ: {archived or 'không'}")
@@ -2,6 +2,7 @@ import re
 from flask import current_app
 from ..extensions import db
 from ..models import HoaDon, ThanhToan
+from . import event_bus
 from datetime import datetime
 
 def generate_vietqr_info(invoice):
@@ -86,6 +87,11 @@ def process_sepay_webhook(data, authorization_header=None):
     
     db.session.add(new_payment)
     db.session.commit()
+    # Sau commit: lỗi phát sự kiện không được làm mất cập nhật thanh toán
+    event_bus.notify_committed({
+        'channel': 'payment', 'type': 'paid', 'mahd': invoice.mahd, 'malh': invoice.malh,
+        'makh': invoice.makh, 'manv': invoice.manv, 'sotien': final_amount, 'phuongthuc': new_payment.phuongthuc
+    })
     
     current_app.logger.info(f"SePay Webhook: Đã tự động cập nhật THANH TOÁN THÀNH CÔNG cho Hóa đơn #{invoice.mahd}")
     return {"status": "success", "message": f"Tự động thanh toán thành công hóa đơn #{invoice.mahd}"}
@@ -188,7 +188,7 @@ function buildSidebar() {
         const isActive = currentPath === item.href ? 'active' : '';
         return `
             <li>
-                <a href="${item.href}" class="${isActive}">
+                <a href="${item.href}" class="${isActive}" data-key="${item.key}">
                     <i class="fas ${item.icon}"></i>
                     <span>${item.title}</span>
                 </a>
@@ -201,6 +201,60 @@ function buildSidebar() {
     console.log(`✅ Sidebar built for role: ${role} (${menuItems.length} items)`);
 }
 
+// ====== NOTIFICATION BADGES ======
+
+const BADGE_POLL_INTERVAL = 15000;
+// Mục sidebar -> khóa số đếm trong /api/notifications/summary
+const BADGE_KEYS = {
+    chat: 'chat_unread',
+    appointments: 'appointments_pending',
+    approve_shifts: 'shift_registrations_pending',
+    register_shift: 'shift_registrations_pending'
+};
+
+/**
+ * Cập nhật badge trên sidebar bằng một request (/api/notifications/summary).
+ * Trình duyệt tự gửi If-None-Match nên phần lớn lượt poll chỉ nhận 304.
+ */
+async function refreshNotificationBadges() {
+    const token = getAdminAuthToken();
+    if (!token || document.hidden) return;
+
+    try {
+        const response = await fetch('/api/notifications/summary', {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (!response.ok) return;
+        const data = await response.json();
+        if (!data.success) return;
+
+        document.querySelectorAll('#sidebar-menu a[data-key]').forEach(link => {
+            const count = data.counts[BADGE_KEYS[link.dataset.key]] || 0;
+            let badge = link.querySelector('.sidebar-badge');
+            if (count > 0) {
+                if (!badge) {
+                    badge = document.createElement('span');
+                    badge.className = 'sidebar-badge';
+                    link.appendChild(badge);
+                }
+                badge.textContent = count > 99 ? '99+' : count;
+            } else if (badge) {
+                badge.remove();
+            }
+        });
+    } catch (error) {
+        console.warn('⚠️ Không tải được số đếm thông báo:', error);
+    }
+}
+
+function setupNotificationBadges() {
+    refreshNotificationBadges();
+    setInterval(refreshNotificationBadges, BADGE_POLL_INTERVAL);
+    document.addEventListener('visibilitychange', () => {
+        if (!document.hidden) refreshNotificationBadges();
+    });
+}
+
 // ====== USER INFO DISPLAY ======
 
 /**
@@ -289,6 +343,7 @@ function initializeLayout() {
     // Build UI
     buildSidebar();
     updateHeaderInfo();
+    setupNotificationBadges();
     
     // Setup auto-refresh token (optional)
     setupTokenRefresh();
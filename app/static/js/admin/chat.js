@@ -1,7 +1,14 @@
 let conversations = [];
+let conversationsCursor = null;      // next_cursor để tải trang hội thoại tiếp theo
+let loadingMoreConversations = false;
 let currentConversation = null;
 let messages = [];
-let refreshInterval = null;
+let messagesMaht = null;        // hội thoại mà `messages` đang thuộc về
+let hasOlderMessages = false;   // còn lịch sử cũ hơn trang đang hiển thị
+let loadingOlder = false;
+let readUpToMatn = 0;           // biên nhận đã đọc đã gửi cho hội thoại đang mở
+let chatStream = null;
+let refreshTimer = null;
 let isSending = false; 
 
 // ===================================
@@ -17,16 +24,33 @@ document.addEventListener('DOMContentLoaded', function() {
     loadConversations();
     setupEventListeners();
     
-    // Thiết lập làm mới định kỳ
-    refreshInterval = setInterval(() => {
-
-        loadConversations(false); 
-        if (currentConversation) {
-            loadMessages(currentConversation.maht, false); 
-        }
-    }, 5000); // 5 giây 1 lần
+    // Nhận tin nhắn / đã đọc / phân công theo thời gian thực (thay cho làm mới 5 giây)
+    chatStream = openChatStream(getAdminAuthToken, {
+        message: (data) => scheduleRefresh(currentConversation && currentConversation.maht === data.maht),
+        read: () => scheduleRefresh(false),
+        assignment: () => scheduleRefresh(false),
+        resync: () => scheduleRefresh(true)
+    });
 });
 
+// Gộp nhiều sự kiện liên tiếp thành một lần tải lại
+function scheduleRefresh(includeMessages) {
+    if (refreshTimer) {
+        includeMessages = includeMessages || refreshTimer.includeMessages;
+        clearTimeout(refreshTimer.id);
+    }
+    refreshTimer = {
+        includeMessages,
+        id: setTimeout(() => {
+            refreshTimer = null;
+            loadConversations(false);
+            if (includeMessages && currentConversation) {
+                loadMessages(currentConversation.maht, false);
+            }
+        }, 300)
+    };
+}
+
 // ====== SETUP EVENT LISTENERS ======
 function setupEventListeners() {
     const sendBtn = document.getElementById('send-message-btn');
@@ -40,6 +64,22 @@ function setupEventListeners() {
     if (closeBtn) {
         closeBtn.addEventListener('click', closeConversation); 
     }
+
+    const conversationsList = document.getElementById('conversations-list');
+    if (conversationsList) {
+        conversationsList.addEventListener('scroll', function() {
+            if (conversationsList.scrollTop + conversationsList.clientHeight >= conversationsList.scrollHeight - 60) {
+                loadMoreConversations();
+            }
+        });
+    }
+
+    const messagesContainer = document.getElementById('messages-container');
+    if (messagesContainer) {
+        messagesContainer.addEventListener('scroll', function() {
+            if (messagesContainer.scrollTop < 40) loadOlderMessages();
+        });
+    }
     
     if (messageInput) {
         // 1. Ngăn chặn Enter tạo dòng mới và gửi tin nhắn
@@ -67,8 +107,8 @@ function setupEventListeners() {
 
 // Cleanup khi rời trang
 window.addEventListener('beforeunload', function() {
-    if (refreshInterval) {
-        clearInterval(refreshInterval);
+    if (chatStream) {
+        chatStream.close();
     }
 });
 
@@ -81,6 +121,8 @@ window.addEventListener('beforeunload', function() {
 function closeConversation() {
     currentConversation = null;
     messages = [];
+    messagesMaht = null;
+    hasOlderMessages = false;
 
     const container = document.getElementById('messages-container');
     const nameHeader = document.getElementById('chat-customer-name');
@@ -196,7 +238,15 @@ async function loadConversations(showLoading = true) {
         const data = await response.json();
         
         if (data.success) {
-            conversations = data.conversations || [];
+            const firstPage = data.conversations || [];
+            if (showLoading || !conversations.length || !data.next_cursor) {
+                conversations = firstPage;
+                conversationsCursor = data.next_cursor;
+            } else {
+                // Làm mới: thay trang đầu, giữ các trang cũ hơn đã cuộn tới
+                const ids = new Set(firstPage.map(c => c.maht));
+                conversations = firstPage.concat(conversations.filter(c => !ids.has(c.maht)));
+            }
             renderConversationsList();
         } else {
             if (showLoading) showError(data.message || 'Không thể tải danh sách hội thoại');
@@ -207,6 +257,28 @@ async function loadConversations(showLoading = true) {
     }
 }
 
+// ====== TẢI THÊM HỘI THOẠI (cuộn tới cuối danh sách) ======
+async function loadMoreConversations() {
+    if (loadingMoreConversations || !conversationsCursor) return;
+    loadingMoreConversations = true;
+    try {
+        const response = await fetch(`/api/chat/conversations?cursor=${encodeURIComponent(conversationsCursor)}`, {
+            headers: getAuthHeaders(false)
+        });
+        const data = await response.json();
+        if (data.success) {
+            const ids = new Set(conversations.map(c => c.maht));
+            conversations = conversations.concat((data.conversations || []).filter(c => !ids.has(c.maht)));
+            conversationsCursor = data.next_cursor;
+            renderConversationsList();
+        }
+    } catch (error) {
+        console.error('Lỗi tải thêm hội thoại:', error);
+    } finally {
+        loadingMoreConversations = false;
+    }
+}
+
 // ====== RENDER DANH SÁCH HỘI THOẠI ======
 function renderConversationsList() {
     const container = document.getElementById('conversations-list');
@@ -223,7 +295,7 @@ function renderConversationsList() {
         
         let avatarHtml = '';
         if (conv.customer_avatar) {
-            const imageSrc = `/api/profile/avatar/${escapeHtml(conv.customer_avatar)}`;
+            const imageSrc = `/api/profile/avatar/${escapeHtml(conv.customer_avatar)}?w=160`;
             avatarHtml = `<img src="${imageSrc}" alt="Avatar" onerror="this.onerror=null; this.src='/static/img/user-default.png';">`;
         } else {
             avatarHtml = `<i class="fas fa-user-circle"></i>`;
@@ -258,7 +330,11 @@ function renderConversationsList() {
 }
 
 // ====== TẢI TIN NHẮN ======
+// Lần đầu: trang cuối cùng. Làm mới: chỉ lấy tin nhắn sau matn cuối đã có.
 async function loadMessages(maht, showLoadingIndicator = true) {
+    const lastMatn = !showLoadingIndicator && messagesMaht === maht && messages.length
+        ? messages[messages.length - 1].matn
+        : null;
     try {
         if (showLoadingIndicator) {
             const container = document.getElementById('messages-container');
@@ -267,18 +343,31 @@ async function loadMessages(maht, showLoadingIndicator = true) {
             }
         }
         
-        const response = await fetch(`/api/chat/conversations/${maht}/messages`, {
+        const query = lastMatn ? `?since_matn=${lastMatn}` : '';
+        const response = await fetch(`/api/chat/conversations/${maht}/messages${query}`, {
             headers: getAuthHeaders(false)
         });
         
         const data = await response.json();
         
         if (data.success) {
-            // Chỉ render nếu tin nhắn thực sự thay đổi (tránh giật)
-            if (JSON.stringify(messages) !== JSON.stringify(data.messages)) {
+            if (!currentConversation || currentConversation.maht !== maht) return;
+            if (lastMatn) {
+                const newest = messages.length ? messages[messages.length - 1].matn : 0;
+                const fresh = (data.messages || []).filter(msg => msg.matn > newest);
+                if (fresh.length) {
+                    messages = messages.concat(fresh);
+                    renderMessages();
+                }
+                if (data.has_more) loadMessages(maht, false);
+            } else {
                 messages = data.messages || [];
+                messagesMaht = maht;
+                hasOlderMessages = !!data.has_more;
+                readUpToMatn = 0;
                 renderMessages();
             }
+            markConversationRead(maht);
         } else {
             if (showLoadingIndicator) showError(data.message || 'Không thể tải tin nhắn');
         }
@@ -288,8 +377,51 @@ async function loadMessages(maht, showLoadingIndicator = true) {
     }
 }
 
+// ====== BIÊN NHẬN ĐÃ ĐỌC ======
+// Chỉ gửi khi có tin mới của khách chưa được báo đọc (GET tin nhắn không ghi DB).
+async function markConversationRead(maht) {
+    const lastFromCustomer = messages.filter(msg => !msg.is_from_staff).pop();
+    if (!lastFromCustomer || lastFromCustomer.matn <= readUpToMatn) return;
+    readUpToMatn = lastFromCustomer.matn;
+    try {
+        await fetch(`/api/chat/conversations/${maht}/read`, {
+            method: 'POST',
+            headers: getAuthHeaders(),
+            body: JSON.stringify({ read_up_to_matn: readUpToMatn })
+        });
+    } catch (error) {
+        console.error('Lỗi gửi biên nhận đã đọc:', error);
+    }
+}
+
+// ====== TẢI LỊCH SỬ CŨ HƠN (cuộn lên đầu) ======
+async function loadOlderMessages() {
+    if (loadingOlder || !hasOlderMessages || !currentConversation || !messages.length) return;
+    const maht = currentConversation.maht;
+    loadingOlder = true;
+    try {
+        const response = await fetch(`/api/chat/conversations/${maht}/messages?before_matn=${messages[0].matn}`, {
+            headers: getAuthHeaders(false)
+        });
+        const data = await response.json();
+        if (data.success && currentConversation && currentConversation.maht === maht) {
+            const container = document.getElementById('messages-container');
+            const previousHeight = container ? container.scrollHeight : 0;
+            messages = (data.messages || []).concat(messages);
+            hasOlderMessages = !!data.has_more;
+            renderMessages(false);
+            // Giữ nguyên vị trí đang xem sau khi chèn tin cũ lên trên
+            if (container) container.scrollTop = container.scrollHeight - previousHeight;
+        }
+    } catch (error) {
+        console.error('Lỗi tải tin nhắn cũ:', error);
+    } finally {
+        loadingOlder = false;
+    }
+}
+
 // ====== RENDER TIN NHẮN ======
-function renderMessages() {
+function renderMessages(scrollBottom = true) {
     const container = document.getElementById('messages-container');
     if (!container) return;
     
@@ -303,6 +435,7 @@ function renderMessages() {
         return `
             <div class="message ${isMyMessage ? 'message-sent' : 'message-received'}">
                 <div class="message-content">
+                    ${renderAttachmentsHTML(msg.attachments)}
                     ${renderAdminMessageHTML(msg.noidung)}
                     <div class="message-time">${formatDateTime(msg.thoigian)}</div>
                 </div>
@@ -311,7 +444,26 @@ function renderMessages() {
     }).join('');
     
     // Scroll xuống cuối
-    scrollToBottom();
+    if (scrollBottom) scrollToBottom();
+}
+
+// Tệp đính kèm: ảnh hiển thị ảnh nhỏ (bấm mở ảnh gốc), PDF là liên kết tải về
+function renderAttachmentsHTML(attachments) {
+    if (!attachments || attachments.length === 0) return '';
+    return attachments.map(file => {
+        if (file.thumbnail_url) {
+            return `
+                <a class="message-image-wrapper" href="${file.url}" target="_blank" rel="noopener">
+                    <img src="${file.thumbnail_url}" class="chat-message-image" alt="${escapeHtml(file.tenfile)}" loading="lazy">
+                </a>
+            `;
+        }
+        return `
+            <a class="message-file" href="${file.url}" target="_blank" rel="noopener">
+                <i class="far fa-file-pdf"></i> ${escapeHtml(file.tenfile)}
+            </a>
+        `;
+    }).join('');
 }
 
 function formatAdminPrice(amount) {
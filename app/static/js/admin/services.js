@@ -189,8 +189,8 @@ function renderServicesTable() {
     }
     
     tbody.innerHTML = paginatedData.map(service => {
-        const imageHtml = service.anhdichvu 
-            ? `<img src="data:image/jpeg;base64,${service.anhdichvu}" alt="${service.tendv}" class="table-avatar" style="width: 60px; height: 60px; object-fit: cover; border-radius: 4px;">` 
+        const imageHtml = service.anhdichvu_url 
+            ? `<img src="${service.anhdichvu_url}" alt="${service.tendv}" class="table-avatar" style="width: 60px; height: 60px; object-fit: cover; border-radius: 4px;">` 
             : `<div class="table-avatar-placeholder" style="width: 60px; height: 60px; ..."><i class="fas fa-image text-muted"></i></div>`;
         
         return `
@@ -276,9 +276,9 @@ async function viewServiceDetail(id) {
     const contentContainer = document.getElementById('service-detail-content');
     
     let imageHtml = '<p><strong>Hình ảnh:</strong> Không có ảnh</p>';
-    if (service.anhdichvu) {
+    if (service.anhdichvu_url) {
         imageHtml = `<div style="text-align: center; margin-bottom: 15px;">
-            <img src="data:image/jpeg;base64,${service.anhdichvu}" alt="${service.tendv}" style="max-width: 300px; max-height: 300px; border-radius: 8px; object-fit: cover;">
+            <img src="${service.anhdichvu_url}" alt="${service.tendv}" style="max-width: 300px; max-height: 300px; border-radius: 8px; object-fit: cover;">
         </div>`;
     }
 
@@ -326,8 +326,8 @@ async function editService(id) {
     
     const imagePreview = document.getElementById('image-preview');
     const previewImg = document.getElementById('preview-img');
-    if (service.anhdichvu) {
-        previewImg.src = `data:image/jpeg;base64,${service.anhdichvu}`;
+    if (service.anhdichvu_url) {
+        previewImg.src = service.anhdichvu_url;
         imagePreview.style.display = 'block';
     } else {
         imagePreview.style.display = 'none';
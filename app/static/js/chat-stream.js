@@ -0,0 +1,85 @@
+// ===================================
+// ===== CHAT REALTIME (SSE) =========
+// ===================================
+// Đọc /api/chat/stream bằng fetch (EventSource không gửi được header Authorization).
+// Tự kết nối lại theo "retry" của server, gửi Last-Event-ID để nhận bù tin nhắn.
+//
+// openChatStream(getToken, handlers) -> { close() }
+//   handlers: { message(data), read(data), assignment(data), resync(data), open(), error(err) }
+
+function openChatStream(getToken, handlers) {
+    let lastEventId = null;
+    let retryMs = 3000;
+    let closed = false;
+    let controller = null;
+
+    function dispatch(event, data, id) {
+        if (id) lastEventId = id;
+        const handler = handlers[event];
+        if (!handler) return;
+        try {
+            handler(data ? JSON.parse(data) : {});
+        } catch (error) {
+            console.error('Lỗi xử lý sự kiện chat:', error);
+        }
+    }
+
+    function parseBlock(block) {
+        let event = 'message', id = null;
+        const data = [];
+        block.split('\n').forEach(line => {
+            if (!line || line.startsWith(':')) return;
+            const idx = line.indexOf(':');
+            const field = idx < 0 ? line : line.slice(0, idx);
+            const value = idx < 0 ? '' : line.slice(idx + 1).replace(/^ /, '');
+            if (field === 'event') event = value;
+            else if (field === 'data') data.push(value);
+            else if (field === 'id') id = value;
+            else if (field === 'retry' && /^\d+$/.test(value)) retryMs = parseInt(value, 10);
+        });
+        if (data.length || id) dispatch(event, data.join('\n'), id);
+    }
+
+    async function connect() {
+        const token = getToken();
+        if (!token || closed) return;
+
+        controller = new AbortController();
+        const headers = { 'Authorization': `Bearer ${token}`, 'Accept': 'text/event-stream' };
+        if (lastEventId) headers['Last-Event-ID'] = lastEventId;
+
+        try {
+            const response = await fetch('/api/chat/stream', { headers, signal: controller.signal });
+            if (!response.ok || !response.body) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            if (handlers.open) handlers.open();
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true }).replace(/\r\n?/g, '\n');
+                let sep;
+                while ((sep = buffer.indexOf('\n\n')) >= 0) {
+                    parseBlock(buffer.slice(0, sep));
+                    buffer = buffer.slice(sep + 2);
+                }
+            }
+        } catch (error) {
+            if (closed) return;
+            if (handlers.error) handlers.error(error);
+        }
+        if (!closed) setTimeout(connect, retryMs);
+    }
+
+    connect();
+    return {
+        close() {
+            closed = true;
+            if (controller) controller.abort();
+        }
+    };
+}
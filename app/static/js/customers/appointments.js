@@ -136,7 +136,7 @@ function displayServicesInForm(services) {
         <div class="service-card-small ${selectedServices.includes(service.madv) ? 'selected' : ''}" 
              data-service-id="${service.madv}"
              onclick="toggleServiceSelection(${service.madv})">
-            <img src="${service.anhdichvu ? 'data:image/jpeg;base64,' + service.anhdichvu : '/static/images/default-service.jpg'}" 
+            <img src="${imageVariantUrl(service.anhdichvu_url, 320) || '/static/images/default-service.jpg'}" 
                  alt="${service.tendv}"
                  onerror="this.src='/static/images/default-service.jpg'">
             <div class="service-info">
@@ -334,7 +334,7 @@ async function loadAvailableStaff() {
                  onclick="${staff.available ? `selectStaff(${staff.manv}, '${staff.hoten}')` : ''}">
                 <div class="staff-avatar">
                     ${staff.anhdaidien ? 
-                        `<img src="/api/profile/avatar/${staff.anhdaidien}" alt="${staff.hoten}" onerror="this.onerror=null; this.src='/static/images/default-avatar.svg';">` :
+                        `<img src="/api/profile/avatar/${staff.anhdaidien}?w=160" alt="${staff.hoten}" onerror="this.onerror=null; this.src='/static/images/default-avatar.svg';">` :
                         '<img src="/static/images/default-avatar.svg" alt="Avatar">'}
                 </div>
                 <div class="staff-info">
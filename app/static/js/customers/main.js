@@ -143,7 +143,9 @@ function getAuthHeaders(includeContentType = true) {
 let currentLang = 'vi';
 let currentConversationId = null;
 let unreadCount = 0; // Số tin nhắn chưa đọc
-let chatRefreshInterval = null; // Interval để refresh tin nhắn
+let chatStream = null; // Kết nối SSE nhận tin nhắn realtime
+let lastMessageMatn = null; // matn cuối đã hiển thị (làm mới chỉ lấy tin sau mốc này)
+let messagesConversationId = null;
 
 // ==================== INIT ====================
 document.addEventListener('DOMContentLoaded', function() {
@@ -498,7 +500,7 @@ function displayServices(services) {
         return `
             <div class="service-card" data-service-id="${service.madv}" onclick="viewServiceDetail(${service.madv})">
                 <div class="service-image-container">
-                    <img src="${service.anhdichvu ? 'data:image/jpeg;base64,' + service.anhdichvu : '/static/images/default-service.jpg'}" 
+                    <img src="${imageVariantUrl(service.anhdichvu_url, 320) || '/static/images/default-service.jpg'}" 
                          alt="${service.tendv}" 
                          class="service-image"
                          onerror="this.src='/static/images/default-service.jpg'">
@@ -551,7 +553,7 @@ function openQuickView(serviceId) {
     const body = document.getElementById('quickViewBody');
     if (!modal || !body) return;
 
-    const imgSrc = service.anhdichvu ? 'data:image/jpeg;base64,' + service.anhdichvu : '/static/images/default-service.jpg';
+    const imgSrc = imageVariantUrl(service.anhdichvu_url, 320) || '/static/images/default-service.jpg';
     
     body.innerHTML = `
         <div class="quick-view-grid">
@@ -622,6 +624,12 @@ function toggleTheme() {
     }
 }
 
+// Ảnh theo kích thước hiển thị: server trả biến thể WebP / JPEG gần nhất với ?w=
+function imageVariantUrl(url, width) {
+    if (!url) return url;
+    return `${url}${url.includes('?') ? '&' : '?'}w=${width}`;
+}
+
 function formatPrice(price) {
     return new Intl.NumberFormat('vi-VN', { 
         style: 'currency', 
@@ -722,9 +730,49 @@ async function sendQuickReply(text) {
     }
 }
 
+function renderChatMessageItem(msg) {
+    const isCustomer = msg.is_customer || msg.nguoigui_makh !== undefined;
+    const messageClass = isCustomer ? 'user-message' : 'bot-message';
+    const timeStr = formatMessageTime(msg.thoigiangui || msg.thoigian);
+    
+    return `
+        <div class="chat-message ${messageClass}">
+            <div class="message-content">
+                ${renderAttachmentsHTML(msg.attachments)}
+                <div class="message-text">
+                    ${renderMessageHTML(msg.noidung)}
+                </div>
+                <span class="message-time">${timeStr}</span>
+            </div>
+        </div>
+    `;
+}
+
+// Tệp đính kèm: ảnh hiển thị ảnh nhỏ (bấm mở ảnh gốc), PDF là liên kết tải về
+function renderAttachmentsHTML(attachments) {
+    if (!attachments || attachments.length === 0) return '';
+    return attachments.map(file => {
+        if (file.thumbnail_url) {
+            return `
+                <a class="message-image-wrapper" href="${file.url}" target="_blank" rel="noopener">
+                    <img src="${file.thumbnail_url}" class="chat-message-image" alt="${escapeHtml(file.tenfile)}" loading="lazy">
+                </a>
+            `;
+        }
+        return `
+            <a class="message-file" href="${file.url}" target="_blank" rel="noopener">
+                <i class="far fa-file-pdf"></i> ${escapeHtml(file.tenfile)}
+            </a>
+        `;
+    }).join('');
+}
+
+// Lần đầu: trang tin nhắn cuối cùng. Các lần sau: chỉ lấy tin sau lastMessageMatn.
 async function loadMessages(conversationId) {
+    const incremental = messagesConversationId === conversationId && lastMessageMatn !== null;
     try {
-        const response = await fetch(`/api/chat/conversations/${conversationId}/messages`, {
+        const query = incremental ? `?since_matn=${lastMessageMatn}` : '';
+        const response = await fetch(`/api/chat/conversations/${conversationId}/messages${query}`, {
             headers: getAuthHeaders(false)
         });
         
@@ -734,31 +782,53 @@ async function loadMessages(conversationId) {
             const chatMessages = document.getElementById('chatMessages');
             if (!chatMessages) return;
             
-            chatMessages.innerHTML = data.messages.map(msg => {
-                const isCustomer = msg.is_customer || msg.nguoigui_makh !== undefined;
-                const messageClass = isCustomer ? 'user-message' : 'bot-message';
-                const timeStr = formatMessageTime(msg.thoigiangui || msg.thoigian);
-                
-                return `
-                    <div class="chat-message ${messageClass}">
-                        <div class="message-content">
-                            <div class="message-text">
-                                ${renderMessageHTML(msg.noidung)}
-                            </div>
-                            <span class="message-time">${timeStr}</span>
-                        </div>
-                    </div>
-                `;
-            }).join('');
+            if (incremental) {
+                const fresh = data.messages.filter(msg => msg.matn > lastMessageMatn);
+                if (!fresh.length) return;
+                // Tin của khách đã hiện tạm lúc gửi -> thay bằng bản từ server
+                if (fresh.some(msg => msg.is_customer)) {
+                    chatMessages.querySelectorAll('.pending-message').forEach(el => el.remove());
+                }
+                chatMessages.insertAdjacentHTML('beforeend', fresh.map(renderChatMessageItem).join(''));
+            } else {
+                chatMessages.innerHTML = data.messages.map(renderChatMessageItem).join('');
+            }
+            if (data.messages.length) {
+                lastMessageMatn = data.messages[data.messages.length - 1].matn;
+            }
+            messagesConversationId = conversationId;
             
             // Scroll to bottom
             chatMessages.scrollTop = chatMessages.scrollHeight;
+
+            markChatRead(conversationId, data.messages);
+            if (incremental && data.has_more) loadMessages(conversationId);
         }
     } catch (error) {
         console.error('Error loading messages:', error);
     }
 }
 
+// Biên nhận đã đọc: chỉ gửi khi khung chat đang mở và có tin mới từ nhân viên
+let readUpToMatn = 0;
+async function markChatRead(conversationId, loaded) {
+    const chatBox = document.getElementById('chatBox');
+    if (!chatBox || !chatBox.classList.contains('show')) return;
+    const lastFromStaff = loaded.filter(msg => !msg.is_customer).pop();
+    if (!lastFromStaff || lastFromStaff.matn <= readUpToMatn) return;
+    readUpToMatn = lastFromStaff.matn;
+    try {
+        await fetch(`/api/chat/conversations/${conversationId}/read`, {
+            method: 'POST',
+            headers: getAuthHeaders(true),
+            body: JSON.stringify({ read_up_to_matn: readUpToMatn })
+        });
+        updateUnreadCount();
+    } catch (error) {
+        console.error('Error marking messages read:', error);
+    }
+}
+
 function renderMessageHTML(content) {
     if (!content) return '';
     
@@ -827,11 +897,11 @@ function hideTypingIndicator() {
     if (el) el.remove();
 }
 
-function showChatMessage(type, message) {
+function showChatMessage(type, message, pending = false) {
     const chatMessages = document.getElementById('chatMessages');
     if (!chatMessages) return;
     
-    const messageClass = type === 'user' ? 'user-message' : 'bot-message';
+    const messageClass = (type === 'user' ? 'user-message' : 'bot-message') + (pending ? ' pending-message' : '');
     const timeStr = new Date().toLocaleTimeString('vi-VN', { hour: '2-digit', minute: '2-digit' });
     const messageHtml = `
         <div class="chat-message ${messageClass}">
@@ -862,7 +932,7 @@ async function sendMessage() {
     }
     
     // Hiển thị tin nhắn ngay lập tức
-    showChatMessage('user', message);
+    showChatMessage('user', message, true);
     chatInput.value = '';
     
     try {
@@ -883,6 +953,44 @@ async function sendMessage() {
     }
 }
 
+// Gửi ảnh / PDF: thân request là chính tệp (server ghi thẳng xuống đĩa, không multipart)
+const CHAT_ATTACHMENT_MAX_BYTES = 10 * 1024 * 1024;
+async function sendAttachment(input) {
+    const file = input.files && input.files[0];
+    input.value = '';
+    if (!file) return;
+    if (file.size > CHAT_ATTACHMENT_MAX_BYTES) {
+        showChatMessage('bot', 'Tệp vượt quá 10 MB, vui lòng chọn tệp nhỏ hơn.');
+        return;
+    }
+
+    if (!currentConversationId) {
+        await loadOrCreateConversation();
+        if (!currentConversationId) return;
+    }
+
+    const chatInput = document.getElementById('chatInput');
+    const caption = chatInput ? chatInput.value.trim() : '';
+    if (chatInput) chatInput.value = '';
+    showChatMessage('user', `Đang gửi ${file.name}...`, true);
+
+    try {
+        const query = new URLSearchParams({ filename: file.name, caption });
+        const response = await fetch(`/api/chat/conversations/${currentConversationId}/attachments?${query}`, {
+            method: 'POST',
+            headers: { ...getAuthHeaders(false), 'Content-Type': file.type || 'application/octet-stream' },
+            body: file
+        });
+        const data = await response.json();
+        if (!data.success) {
+            showChatMessage('bot', data.message || 'Không thể gửi tệp. Vui lòng thử lại!');
+        }
+    } catch (error) {
+        console.error('Error sending attachment:', error);
+        showChatMessage('bot', 'Không thể gửi tệp. Vui lòng thử lại!');
+    }
+}
+
 // ✅ FIX: Cập nhật số tin nhắn chưa đọc
 async function updateUnreadCount() {
     try {
@@ -893,17 +1001,15 @@ async function updateUnreadCount() {
             return;
         }
 
-        const response = await fetch('/api/chat/conversations', {
+        // Một request cho mọi badge; trình duyệt tự gửi If-None-Match (304 khi không đổi)
+        const response = await fetch('/api/notifications/summary', {
             headers: getAuthHeaders(false)
         });
         
         const data = await response.json();
         
-        if (data.success && data.conversations) {
-            // Tính tổng số tin nhắn chưa đọc từ tất cả conversations
-            unreadCount = data.conversations.reduce((total, conv) => {
-                return total + (conv.unread_count || 0);
-            }, 0);
+        if (data.success && data.counts) {
+            unreadCount = data.counts.chat_unread || 0;
             
             console.log('Unread count updated:', unreadCount); // Debug log
             updateUnreadBadge();
@@ -943,21 +1049,28 @@ function updateUnreadBadge() {
 }
 
 
-// ✅ FIX: Setup auto-refresh cho chat và unread count
+// Cập nhật chat và unread count theo sự kiện từ server (thay cho làm mới 10 giây)
 function setupChatRefresh() {
     // Cập nhật unread count ngay lập tức
     updateUnreadCount();
-    
-    // Cập nhật unread count mỗi 10 giây
-    chatRefreshInterval = setInterval(async () => {
+    if (!getAuthToken()) return;
+
+    const refreshChat = async () => {
         await updateUnreadCount();
-        
+
         // Nếu chat đang mở và có conversation, refresh tin nhắn
         const chatBox = document.getElementById('chatBox');
         if (chatBox && chatBox.classList.contains('show') && currentConversationId) {
             await loadMessages(currentConversationId);
         }
-    }, 10000); // 10 giây
+    };
+
+    chatStream = openChatStream(getAuthToken, {
+        message: refreshChat,
+        read: updateUnreadCount,
+        assignment: updateUnreadCount,
+        resync: refreshChat
+    });
 }
 
 // Setup chat input handler
@@ -975,8 +1088,8 @@ function setupChatInput() {
 
 // Cleanup khi rời trang
 window.addEventListener('beforeunload', function() {
-    if (chatRefreshInterval) {
-        clearInterval(chatRefreshInterval);
+    if (chatStream) {
+        chatStream.close();
     }
 });
 
@@ -1002,7 +1115,7 @@ async function loadServicePicker() {
             pickerServicesMap = {};
             servicePickerList.innerHTML = data.services.map(service => {
                 pickerServicesMap[service.madv] = service;
-                const imgSrc = service.anhdichvu ? 'data:image/jpeg;base64,' + service.anhdichvu : '/static/images/default-service.jpg';
+                const imgSrc = imageVariantUrl(service.anhdichvu_url, 320) || '/static/images/default-service.jpg';
                 const safeName = escapeHtml(service.tendv);
                 return `
                     <div class="service-picker-item" onclick="selectService(${service.madv})">
@@ -1028,7 +1141,7 @@ function selectService(serviceId) {
     const input = document.getElementById('chatInput');
     if (input) {
         if (service) {
-            const imgSrc = service.anhdichvu ? 'data:image/jpeg;base64,' + service.anhdichvu : '/static/images/default-service.jpg';
+            const imgSrc = imageVariantUrl(service.anhdichvu_url, 320) || '/static/images/default-service.jpg';
             const duration = service.thoiluong || 60;
             input.value = `[SERVICE_CARD:${service.madv}|${service.tendv}|${service.gia}|${duration}|${imgSrc}] Tôi muốn đặt lịch dịch vụ: ${service.tendv}`;
         } else {
@@ -1169,7 +1282,7 @@ async function checkLoginStatus() {
             if (userBtn) {
                 userBtn.innerHTML = `
                     ${data.user.anhdaidien ? 
-                        `<img src="/api/profile/avatar/${data.user.anhdaidien}" alt="Avatar" class="user-avatar" onerror="this.onerror=null; this.src='/static/images/default-avatar.svg';">` : 
+                        `<img src="/api/profile/avatar/${data.user.anhdaidien}?w=160" alt="Avatar" class="user-avatar" onerror="this.onerror=null; this.src='/static/images/default-avatar.svg';">` : 
                         '<img src="/static/images/default-avatar.svg" alt="Avatar" class="user-avatar">'}
                     <i class="fas fa-chevron-down"></i>
                 `;
@@ -81,7 +81,7 @@ function displayUserInfo(user) {
     
     const avatarImgEl = document.getElementById('avatarImg');
     if (avatarImgEl) {
-        avatarImgEl.src = user.anhdaidien ? `/api/profile/avatar/${user.anhdaidien}` : '/static/images/default-avatar.svg';
+        avatarImgEl.src = user.anhdaidien ? `/api/profile/avatar/${user.anhdaidien}?w=320` : '/static/images/default-avatar.svg';
         avatarImgEl.onerror = function() {
             this.onerror = null;
             this.src = '/static/images/default-avatar.svg';
@@ -47,7 +47,7 @@ function displayServiceDetail(service) {
     container.innerHTML = `
         <div class="service-detail-grid">
             <div class="service-image-section">
-                <img src="${service.anhdichvu ? 'data:image/jpeg;base64,' + service.anhdichvu : '/static/images/default-service.jpg'}" 
+                <img src="${imageVariantUrl(service.anhdichvu_url, 1280) || '/static/images/default-service.jpg'}" 
                      alt="${service.tendv}" 
                      class="service-main-image"
                      onerror="this.src='/static/images/default-service.jpg'">
@@ -148,7 +148,7 @@ function displayRelatedServices(services) {
     grid.innerHTML = services.map(service => `
         <div class="service-card" onclick="window.location.href='/services/${service.madv}'">
             <div class="service-image-container">
-                <img src="${service.anhdichvu ? 'data:image/jpeg;base64,' + service.anhdichvu : '/static/images/default-service.jpg'}" 
+                <img src="${imageVariantUrl(service.anhdichvu_url, 640) || '/static/images/default-service.jpg'}" 
                      alt="${service.tendv}" 
                      class="service-image"
                      onerror="this.src='/static/images/default-service.jpg'">
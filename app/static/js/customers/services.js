@@ -111,7 +111,7 @@ function displayServices(services) {
         return `
             <div class="service-card" data-service-id="${service.madv}" onclick="viewServiceDetail(${service.madv})">
                 <div class="service-image-container">
-                    <img src="${service.anhdichvu ? 'data:image/jpeg;base64,' + service.anhdichvu : '/static/images/default-service.jpg'}" 
+                    <img src="${imageVariantUrl(service.anhdichvu_url, 640) || '/static/images/default-service.jpg'}" 
                             alt="${service.tendv}" 
                             class="service-image"
                             onerror="this.src='/static/images/default-service.jpg'">
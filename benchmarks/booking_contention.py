@@ -0,0 +1,184 @@
+"""
+Benchmark đặt lịch đồng thời (khóa advisory theo nhân viên + ngày)
+
+Chạy trên CSDL local (KHÔNG chạy trên production):
+    python benchmarks/booking_contention.py --requests 400 --threads 32 --staff 20
+
+Hai kịch bản:
+    hot    - mọi yêu cầu cùng đặt 1 nhân viên, vài khung giờ -> tranh chấp tối đa
+    spread - mỗi yêu cầu chọn ngẫu nhiên nhân viên/khung giờ -> khóa không được
+             tuần tự hóa các nhân viên khác nhau (throughput phải cao hơn hẳn)
+
+--no-lock bỏ khóa advisory để so sánh (khi đó chỉ còn ràng buộc EXCLUDE chặn trùng lịch).
+Dữ liệu thử có tiền tố "bench_" và được xóa sau khi chạy.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime, date, time as dtime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Mỗi luồng cần 1 kết nối riêng: Config đọc DB_POOL_SIZE lúc import nên phải đặt trước
+_threads_arg = next((a.split('=', 1)[1] for a in sys.argv if a.startswith('--threads=')), None)
+if _threads_arg is None and '--threads' in sys.argv:
+    _threads_arg = sys.argv[sys.argv.index('--threads') + 1]
+os.environ.setdefault('DB_POOL_SIZE', _threads_arg or '32')
+os.environ.setdefault('DB_MAX_OVERFLOW', '0')
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db
+from app.models import NhanVien, ChucVu, KhachHang, DichVu, CaLam, LichHen, ChiTietLichHen, nhanvien_calam
+from app.services import availability_service, booking_service
+
+PREFIX = 'bench_'
+BENCH_DAY = date.today() + timedelta(days=30)
+DURATION = 60
+
+DOUBLE_BOOKING_SQL = text("""
+    SELECT COUNT(*)
+    FROM lichhen a
+    JOIN lichhen b ON a.manv = b.manv AND a.malh < b.malh
+        AND a.ngaygio < b.ngayketthuc AND b.ngaygio < a.ngayketthuc
+    WHERE a.manv = ANY(:manv_list)
+      AND a.trangthai IN ('pending', 'confirmed', 'in_progress')
+      AND b.trangthai IN ('pending', 'confirmed', 'in_progress')
+""")
+
+
+def setup_data(staff_count):
+    chucvu = ChucVu(tencv=f'{PREFIX}ktv', dongiagio=0)
+    db.session.add(chucvu)
+    db.session.flush()
+
+    staff = [
+        NhanVien(hoten=f'{PREFIX}nv{i}', taikhoan=f'{PREFIX}nv{i}',
+                 matkhau=generate_password_hash('bench'), macv=chucvu.macv, role='staff')
+        for i in range(staff_count)
+    ]
+    customer = KhachHang(hoten=f'{PREFIX}kh', taikhoan=f'{PREFIX}kh',
+                         matkhau=generate_password_hash('bench'), trangthai='active')
+    service = DichVu(tendv=f'{PREFIX}dv', gia=0, thoiluong=DURATION)
+    shift = CaLam(ngay=BENCH_DAY, giobatdau=dtime(8, 0), gioketthuc=dtime(20, 0))
+    db.session.add_all(staff + [customer, service, shift])
+    db.session.flush()
+
+    db.session.execute(nhanvien_calam.insert(), [{'manv': nv.manv, 'maca': shift.maca} for nv in staff])
+    db.session.commit()
+    return [nv.manv for nv in staff], customer.makh, service.madv, shift.maca, chucvu.macv
+
+
+def delete_appointments(makh):
+    malh_list = db.session.query(LichHen.malh).filter(LichHen.makh == makh)
+    ChiTietLichHen.query.filter(ChiTietLichHen.malh.in_(malh_list)).delete(synchronize_session=False)
+    LichHen.query.filter(LichHen.makh == makh).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def cleanup(manv_list, makh, madv, maca, macv):
+    delete_appointments(makh)
+    db.session.execute(nhanvien_calam.delete().where(nhanvien_calam.c.maca == maca))
+    CaLam.query.filter_by(maca=maca).delete()
+    NhanVien.query.filter(NhanVien.manv.in_(manv_list)).delete(synchronize_session=False)
+    KhachHang.query.filter_by(makh=makh).delete()
+    DichVu.query.filter_by(madv=madv).delete()
+    ChucVu.query.filter_by(macv=macv).delete()
+    db.session.commit()
+
+
+def run_scenario(app, name, jobs, threads, use_lock, manv_list):
+    latencies = []
+    counts = {'success': 0, 'conflict': 0, 'excluded': 0, 'error': 0}
+    stats_lock = threading.Lock()
+    queue = list(jobs)
+    queue_lock = threading.Lock()
+
+    def worker():
+        with app.app_context():
+            while True:
+                with queue_lock:
+                    if not queue:
+                        return
+                    makh, manv, ngaygio, madv = queue.pop()
+                started = time.perf_counter()
+                try:
+                    booking_service.book_appointment(
+                        makh, ngaygio, [madv], DURATION, manv=manv, use_lock=use_lock
+                    )
+                    db.session.commit()
+                    outcome = 'success'
+                except booking_service.BookingConflict:
+                    db.session.rollback()
+                    outcome = 'conflict'
+                except IntegrityError as e:
+                    db.session.rollback()
+                    outcome = 'excluded' if availability_service.is_double_booking_error(e) else 'error'
+                except Exception:
+                    db.session.rollback()
+                    outcome = 'error'
+                finally:
+                    db.session.remove()
+                elapsed = time.perf_counter() - started
+                with stats_lock:
+                    latencies.append(elapsed)
+                    counts[outcome] += 1
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"[{name}{'' if use_lock else ' / no-lock'}] {len(jobs)} yêu cầu, {threads} luồng")
+    print(f"   throughput : {len(jobs) / wall:8.1f} req/s  ({wall:.2f}s)")
+    print(f"   latency    : p50 {p50:7.1f} ms | p99 {p99:7.1f} ms")
+    print(f"   kết quả    : {counts['success']} thành công, {counts['conflict']} bận, "
+          f"{counts['excluded']} bị EXCLUDE chặn, {counts['error']} lỗi")
+    with app.app_context():
+        double_booked = db.session.execute(DOUBLE_BOOKING_SQL, {'manv_list': manv_list}).scalar()
+    print(f"   trùng lịch : {double_booked} cặp")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--staff', type=int, default=20)
+    parser.add_argument('--no-lock', action='store_true')
+    args = parser.parse_args()
+
+    app = create_app()
+    use_lock = not args.no_lock
+
+    with app.app_context():
+        manv_list, makh, madv, maca, macv = setup_data(args.staff)
+    try:
+        slots = [datetime.combine(BENCH_DAY, dtime(8, 0)) + timedelta(minutes=30 * i) for i in range(22)]
+
+        hot_jobs = [(makh, manv_list[0], random.choice(slots[:4]), madv) for _ in range(args.requests)]
+        run_scenario(app, 'hot', hot_jobs, args.threads, use_lock, manv_list)
+
+        with app.app_context():
+            delete_appointments(makh)
+
+        spread_jobs = [(makh, random.choice(manv_list), random.choice(slots), madv) for _ in range(args.requests)]
+        run_scenario(app, 'spread', spread_jobs, args.threads, use_lock, manv_list)
+    finally:
+        with app.app_context():
+            cleanup(manv_list, makh, madv, maca, macv)
+
+
+if __name__ == '__main__':
+    main()
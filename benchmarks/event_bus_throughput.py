@@ -0,0 +1,158 @@
+"""
+Benchmark bus sự kiện LISTEN/NOTIFY (app.services.event_bus)
+
+Chạy trên CSDL local (KHÔNG chạy trên production):
+    python benchmarks/event_bus_throughput.py --events 20000 --threads 8 --batch 1 --listeners 2
+
+- --threads luồng phát, mỗi giao dịch gửi --batch sự kiện rồi COMMIT
+- --listeners tiến trình con, mỗi tiến trình có luồng LISTEN riêng (giả lập worker
+  gunicorn) + --subscribers subscriber cục bộ; tiến trình chính cũng là một listener
+Đo: tốc độ phát (sự kiện/s, giao dịch/s), độ trễ commit -> subscriber nhận (p50/p99),
+và số sự kiện mỗi worker nhận được (phải bằng số đã phát).
+Dùng kênh NOTIFY riêng cho lần chạy nên không ảnh hưởng worker thật.
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Config đọc biến môi trường lúc import: đặt kênh riêng + đủ kết nối cho các luồng phát
+os.environ.setdefault('EVENT_BUS_CHANNEL', f'bench_events_{os.getpid()}')
+_threads_arg = next((a.split('=', 1)[1] for a in sys.argv if a.startswith('--threads=')), None)
+if _threads_arg is None and '--threads' in sys.argv:
+    _threads_arg = sys.argv[sys.argv.index('--threads') + 1]
+os.environ.setdefault('DB_POOL_SIZE', _threads_arg or '8')
+
+from app import create_app, db
+from app.services import event_bus
+
+LISTEN_WARMUP = 1.0
+
+
+def collect(app, total, subscribers, timeout):
+    """Đăng ký `subscribers` subscriber, mỗi cái đếm tới `total` sự kiện (hoặc hết giờ)."""
+    event_bus.ensure_listener(app)
+    received = [0] * subscribers
+    latencies = []
+
+    def consume(index, subscription):
+        while received[index] < total:
+            event = subscription.get(timeout=timeout)
+            if event is None:
+                break
+            if event.get('channel') != 'bench':
+                continue
+            received[index] += 1
+            if index == 0:
+                latencies.append((time.time() - event['sent']) * 1000)
+        event_bus.unsubscribe(subscription)
+
+    threads = []
+    for index in range(subscribers):
+        subscription = event_bus.subscribe(lambda event: True, maxsize=total + 16)
+        thread = threading.Thread(target=consume, args=(index, subscription), daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads, received, latencies
+
+
+def child(total, subscribers, timeout, ready, results):
+    app = create_app()
+    threads, received, latencies = collect(app, total, subscribers, timeout)
+    time.sleep(LISTEN_WARMUP)
+    ready.set()
+    for thread in threads:
+        thread.join()
+    results.put((os.getpid(), min(received), latencies))
+
+
+def publish(app, per_thread, batch, offset, timings):
+    with app.app_context():
+        seq = offset
+        remaining = per_thread
+        while remaining > 0:
+            started = time.perf_counter()
+            for _ in range(min(batch, remaining)):
+                event_bus.notify({'channel': 'bench', 'type': 'tick', 'seq': seq, 'sent': time.time()})
+                seq += 1
+            db.session.commit()
+            timings.append((time.perf_counter() - started) * 1000)
+            remaining -= batch
+        db.session.remove()
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=1, help='số sự kiện mỗi giao dịch')
+    parser.add_argument('--listeners', type=int, default=2, help='số tiến trình worker giả lập')
+    parser.add_argument('--subscribers', type=int, default=4, help='subscriber cục bộ mỗi worker')
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    per_thread = args.events // args.threads
+    total = per_thread * args.threads
+
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    readies, processes = [], []
+    for _ in range(args.listeners):
+        ready = ctx.Event()
+        process = ctx.Process(target=child, args=(total, args.subscribers, args.timeout, ready, results))
+        process.start()
+        readies.append(ready)
+        processes.append(process)
+
+    app = create_app()
+    threads, received, latencies = collect(app, total, args.subscribers, args.timeout)
+    time.sleep(LISTEN_WARMUP)
+    for ready in readies:
+        ready.wait(60)
+
+    timings = []
+    started = time.perf_counter()
+    publishers = [
+        threading.Thread(target=publish, args=(app, per_thread, args.batch, i * per_thread, timings))
+        for i in range(args.threads)
+    ]
+    for thread in publishers:
+        thread.start()
+    for thread in publishers:
+        thread.join()
+    publish_elapsed = time.perf_counter() - started
+    for thread in threads:
+        thread.join()
+    deliver_elapsed = time.perf_counter() - started
+
+    workers = [(os.getpid(), min(received), latencies)]
+    for _ in processes:
+        workers.append(results.get(timeout=args.timeout + 60))
+    for process in processes:
+        process.join()
+
+    print(f"Phát {total} sự kiện / {args.threads} luồng / {args.batch} sự kiện mỗi giao dịch")
+    print(f"   phát    : {total / publish_elapsed:9.0f} sự kiện/s | "
+          f"{len(timings) / publish_elapsed:8.0f} giao dịch/s | "
+          f"commit p50 {statistics.median(timings):6.2f} ms, p99 {percentile(timings, 0.99):6.2f} ms")
+    print(f"   nhận hết: {deliver_elapsed:.2f}s ({total / deliver_elapsed:.0f} sự kiện/s tới mỗi worker)")
+    for pid, count, lat in workers:
+        status = 'OK' if count == total else f'THIẾU {total - count}'
+        print(f"   worker {pid}: {count}/{total} [{status}] x {args.subscribers} subscriber | "
+              f"trễ p50 {percentile(lat, 0.5):6.2f} ms, p99 {percentile(lat, 0.99):6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark tìm khung giờ trống sớm nhất (appointment_service.find_next_free_slots)
+
+Chạy trên CSDL local (KHÔNG chạy trên production):
+    python benchmarks/next_free_slots.py --appointments 100000 --staff 40 --queries 200
+
+Sinh dữ liệu ở một khoảng ngày xa trong tương lai (không đụng lịch thật):
+    - mỗi KTV có ca 08:00 - 20:00 mỗi ngày
+    - --full-days ngày đầu kín lịch (buộc thuật toán phải quét qua)
+    - các ngày sau được đặt ngẫu nhiên với tỷ lệ --fill cho tới đủ --appointments lịch
+Đo độ trễ khi bộ nhớ đệm lạnh (xóa chỉ mục trước mỗi truy vấn) và khi đã ấm.
+Dữ liệu thử có tiền tố "bench_" và được xóa sau khi chạy.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, date, time as dtime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db
+from app.models import NhanVien, ChucVu, KhachHang, CaLam, LichHen, nhanvien_calam
+from app.services import availability_service, appointment_service
+
+PREFIX = 'bench_'
+BENCH_START = date.today() + timedelta(days=3 * 365)
+OPEN_HOUR, CLOSE_HOUR = 8, 20
+BATCH = 5000
+
+
+def setup_data(staff_count, appointment_count, full_days, fill):
+    chucvu = ChucVu(tencv=f'{PREFIX}ktv', dongiagio=0)
+    db.session.add(chucvu)
+    db.session.flush()
+    staff = [
+        NhanVien(hoten=f'{PREFIX}nv{i}', taikhoan=f'{PREFIX}nv{i}',
+                 matkhau=generate_password_hash('bench'), macv=chucvu.macv, role='staff')
+        for i in range(staff_count)
+    ]
+    customer = KhachHang(hoten=f'{PREFIX}kh', taikhoan=f'{PREFIX}kh',
+                         matkhau=generate_password_hash('bench'), trangthai='active')
+    db.session.add_all(staff + [customer])
+    db.session.flush()
+    manv_list = [nv.manv for nv in staff]
+
+    rows, ngay = [], BENCH_START
+    while len(rows) < appointment_count:
+        day_fill = 1.0 if (ngay - BENCH_START).days < full_days else fill
+        for manv in manv_list:
+            for hour in range(OPEN_HOUR, CLOSE_HOUR):
+                if len(rows) < appointment_count and random.random() < day_fill:
+                    start = datetime.combine(ngay, dtime(hour, 0))
+                    rows.append({
+                        'makh': customer.makh, 'manv': manv, 'trangthai': 'confirmed',
+                        'ngaygio': start, 'ngayketthuc': start + timedelta(minutes=60)
+                    })
+        ngay += timedelta(days=1)
+    last_day = ngay
+
+    for i in range(0, len(rows), BATCH):
+        db.session.execute(LichHen.__table__.insert(), rows[i:i + BATCH])
+
+    shifts = []
+    ngay = BENCH_START
+    while ngay <= last_day + timedelta(days=60):
+        shifts.append(CaLam(ngay=ngay, giobatdau=dtime(OPEN_HOUR, 0), gioketthuc=dtime(CLOSE_HOUR, 0)))
+        ngay += timedelta(days=1)
+    db.session.add_all(shifts)
+    db.session.flush()
+    links = [{'manv': manv, 'maca': ca.maca} for ca in shifts for manv in manv_list]
+    for i in range(0, len(links), BATCH):
+        db.session.execute(nhanvien_calam.insert(), links[i:i + BATCH])
+
+    db.session.commit()
+    return manv_list, customer.makh, [ca.maca for ca in shifts], chucvu.macv, (last_day - BENCH_START).days
+
+
+def cleanup(manv_list, makh, maca_list, macv):
+    LichHen.query.filter(LichHen.makh == makh).delete(synchronize_session=False)
+    db.session.execute(nhanvien_calam.delete().where(nhanvien_calam.c.maca.in_(maca_list)))
+    CaLam.query.filter(CaLam.maca.in_(maca_list)).delete(synchronize_session=False)
+    NhanVien.query.filter(NhanVien.manv.in_(manv_list)).delete(synchronize_session=False)
+    KhachHang.query.filter_by(makh=makh).delete()
+    ChucVu.query.filter_by(macv=macv).delete()
+    db.session.commit()
+
+
+def run(label, queries, manv_list, days, cold, budget_ms):
+    latencies, incomplete, empty = [], 0, 0
+    for _ in range(queries):
+        duration = random.choice([30, 60, 90, 120])
+        manv = random.choice(manv_list) if random.random() < 0.5 else None
+        start_from = datetime.combine(BENCH_START, dtime(OPEN_HOUR, 0))
+        if cold:
+            availability_service.invalidate()
+        started = time.perf_counter()
+        found, complete = appointment_service.find_next_free_slots(
+            duration, start_from, days=days, manv=manv, limit=5, budget_ms=budget_ms
+        )
+        latencies.append((time.perf_counter() - started) * 1000)
+        incomplete += not complete
+        empty += not found
+
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"[{label}] {queries} truy vấn")
+    print(f"   latency : p50 {statistics.median(latencies):7.2f} ms | p99 {p99:7.2f} ms | max {latencies[-1]:7.2f} ms")
+    print(f"   kết quả : {incomplete} dừng vì hết thời gian, {empty} không tìm thấy")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--appointments', type=int, default=100000)
+    parser.add_argument('--staff', type=int, default=40)
+    parser.add_argument('--full-days', type=int, default=10)
+    parser.add_argument('--fill', type=float, default=0.9)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--budget-ms', type=int, default=0, help='0 = không giới hạn')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        manv_list, makh, maca_list, macv, span = setup_data(
+            args.staff, args.appointments, args.full_days, args.fill
+        )
+        print(f"Đã sinh {args.appointments} lịch hẹn / {args.staff} KTV / {span} ngày "
+              f"trong {time.perf_counter() - started:.1f}s")
+        try:
+            run('lạnh', args.queries, manv_list, args.days, True, args.budget_ms)
+            run('ấm', args.queries, manv_list, args.days, False, args.budget_ms)
+        finally:
+            cleanup(manv_list, makh, maca_list, macv)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,8 @@ pip install -r requirements.txt
 
 flask db upgrade
 
+flask assets build
+
 python -c "from app import create_app, db; from app.models import User; app = create_app(); app.app_context().push(); admin = User.query.filter_by(username='admin').first(); 
 if not admin: 
     admin = User(username='admin', email='admin@binspa.com', role='admin'); 
@@ -0,0 +1,17 @@
+# gunicorn.conf.py
+# gunicorn tự đọc tệp này khi chạy từ thư mục gốc dự án: gunicorn wsgi:app
+#
+# /api/chat/stream (SSE) giữ kết nối tới CHAT_STREAM_MAX_AGE giây. Với worker sync
+# mỗi tab chat chiếm trọn một worker và vài tab là hết worker cho API, nên dùng
+# gthread: mỗi kết nối SSE chỉ giữ một luồng (không giữ kết nối DB, xem chat_service.open_stream).
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+# Số luồng mỗi worker = số stream + request API đồng thời mà worker phục vụ được
+threads = int(os.getenv("GUNICORN_THREADS", 32))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+# Giữ kết nối keep-alive giữa các request API của cùng trình duyệt
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+accesslog = "-"
@@ -0,0 +1,79 @@
+"""Lưu giờ kết thúc lịch hẹn + ràng buộc EXCLUDE chống trùng lịch nhân viên
+
+Revision ID: 3f1a9c2d7b41
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1a9c2d7b41'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+ACTIVE_STATUSES_SQL = "('pending', 'confirmed', 'in_progress')"
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+
+    op.add_column('lichhen', sa.Column('ngayketthuc', sa.DateTime(), nullable=True))
+
+    # Backfill: ngaygio + tổng thời lượng dịch vụ (mặc định 60 phút)
+    op.execute("""
+        UPDATE lichhen AS lh
+        SET ngayketthuc = lh.ngaygio + make_interval(mins => COALESCE(NULLIF((
+            SELECT SUM(dv.thoiluong)
+            FROM chitietlichhen ct
+            JOIN dichvu dv ON dv.madv = ct.madv
+            WHERE ct.malh = lh.malh
+        ), 0), 60)::int)
+    """)
+    op.alter_column('lichhen', 'ngayketthuc', nullable=False)
+
+    op.execute("""
+        ALTER TABLE lichhen
+        ADD COLUMN khoangthoigian tsrange
+        GENERATED ALWAYS AS (tsrange(ngaygio, ngayketthuc, '[)')) STORED
+    """)
+    op.execute(
+        "CREATE INDEX ix_lichhen_manv_khoangthoigian "
+        "ON lichhen USING gist (manv, khoangthoigian)"
+    )
+
+    # Dữ liệu cũ có thể đã bị trùng lịch -> báo rõ thay vì lỗi EXCLUDE khó hiểu
+    conn = op.get_bind()
+    overlaps = conn.execute(sa.text(f"""
+        SELECT a.malh, b.malh
+        FROM lichhen a
+        JOIN lichhen b ON a.manv = b.manv AND a.malh < b.malh
+            AND a.khoangthoigian && b.khoangthoigian
+        WHERE a.trangthai IN {ACTIVE_STATUSES_SQL}
+          AND b.trangthai IN {ACTIVE_STATUSES_SQL}
+        LIMIT 20
+    """)).fetchall()
+    if overlaps:
+        pairs = ", ".join(f"#{a}/#{b}" for a, b in overlaps)
+        raise RuntimeError(
+            f"Có lịch hẹn đang hoạt động bị trùng nhân viên/giờ: {pairs}. "
+            "Hãy đổi nhân viên hoặc hủy một trong hai rồi chạy lại migration."
+        )
+
+    op.execute(f"""
+        ALTER TABLE lichhen
+        ADD CONSTRAINT ex_lichhen_nhanvien_trung_lich
+        EXCLUDE USING gist (manv WITH =, khoangthoigian WITH &&)
+        WHERE (manv IS NOT NULL AND trangthai IN {ACTIVE_STATUSES_SQL})
+        DEFERRABLE INITIALLY DEFERRED
+    """)
+
+
+def downgrade():
+    op.execute("ALTER TABLE lichhen DROP CONSTRAINT IF EXISTS ex_lichhen_nhanvien_trung_lich")
+    op.execute("DROP INDEX IF EXISTS ix_lichhen_manv_khoangthoigian")
+    op.drop_column('lichhen', 'khoangthoigian')
+    op.drop_column('lichhen', 'ngayketthuc')
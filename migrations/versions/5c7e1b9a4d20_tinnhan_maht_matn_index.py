@@ -0,0 +1,32 @@
+"""Index (maht, matn) trên tinnhan cho phân trang tin nhắn theo con trỏ
+
+Revision ID: 5c7e1b9a4d20
+Revises: 8b2e4d6f1a93
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5c7e1b9a4d20'
+down_revision = '8b2e4d6f1a93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CONCURRENTLY: không khóa ghi bảng tin nhắn trong lúc tạo index
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_tinnhan_maht_matn', 'tinnhan', ['maht', 'matn'],
+            postgresql_concurrently=True, if_not_exists=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_tinnhan_maht_matn', table_name='tinnhan',
+            postgresql_concurrently=True, if_exists=True
+        )
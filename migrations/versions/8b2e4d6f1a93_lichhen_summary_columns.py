@@ -0,0 +1,53 @@
+"""Cột tóm tắt dịch vụ trên lichhen (nhãn, số dịch vụ, tổng phút, tổng giá)
+
+Revision ID: 8b2e4d6f1a93
+Revises: 3f1a9c2d7b41
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4d6f1a93'
+down_revision = '3f1a9c2d7b41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('lichhen', sa.Column('dichvu_dau', sa.String(length=100), nullable=True))
+    op.add_column('lichhen', sa.Column('ten_dichvu', sa.Text(), nullable=True))
+    op.add_column('lichhen', sa.Column('so_dichvu', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('lichhen', sa.Column('tong_thoiluong', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('lichhen', sa.Column('tong_gia', sa.Numeric(12, 2), nullable=False, server_default='0'))
+
+    op.execute("""
+        UPDATE lichhen AS lh
+        SET so_dichvu = agg.so_dichvu,
+            tong_thoiluong = agg.tong_thoiluong,
+            tong_gia = agg.tong_gia,
+            ten_dichvu = agg.ten_dichvu,
+            dichvu_dau = agg.dichvu_dau
+        FROM (
+            SELECT ct.malh,
+                   COUNT(dv.madv)::int AS so_dichvu,
+                   COALESCE(SUM(dv.thoiluong), 0)::int AS tong_thoiluong,
+                   COALESCE(SUM(dv.gia), 0) AS tong_gia,
+                   string_agg(dv.tendv, ', ' ORDER BY dv.madv) AS ten_dichvu,
+                   (array_agg(dv.tendv ORDER BY dv.madv))[1] AS dichvu_dau
+            FROM chitietlichhen ct
+            JOIN dichvu dv ON dv.madv = ct.madv
+            GROUP BY ct.malh
+        ) AS agg
+        WHERE lh.malh = agg.malh
+    """)
+
+
+def downgrade():
+    op.drop_column('lichhen', 'tong_gia')
+    op.drop_column('lichhen', 'tong_thoiluong')
+    op.drop_column('lichhen', 'so_dichvu')
+    op.drop_column('lichhen', 'ten_dichvu')
+    op.drop_column('lichhen', 'dichvu_dau')
@@ -0,0 +1,56 @@
+"""Index hộp thư chat: keyset theo tin nhắn cuối + partial index tin chưa đọc
+
+Revision ID: 9d4f2a6c8e15
+Revises: 5c7e1b9a4d20
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4f2a6c8e15'
+down_revision = '5c7e1b9a4d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_hoithoai_inbox', 'hoithoai',
+            [sa.text('tin_nhan_cuoi_thoi_gian DESC NULLS LAST'), sa.text('maht DESC')],
+            postgresql_concurrently=True, if_not_exists=True
+        )
+        op.create_index(
+            'ix_hoithoai_manv_inbox', 'hoithoai',
+            ['manv', sa.text('tin_nhan_cuoi_thoi_gian DESC NULLS LAST'), sa.text('maht DESC')],
+            postgresql_concurrently=True, if_not_exists=True
+        )
+        op.create_index(
+            'ix_hoithoai_makh', 'hoithoai', ['makh'],
+            postgresql_concurrently=True, if_not_exists=True
+        )
+        op.create_index(
+            'ix_tinnhan_unread_khach', 'tinnhan', ['maht'],
+            postgresql_where=sa.text('da_doc = false AND nguoigui_makh IS NOT NULL'),
+            postgresql_concurrently=True, if_not_exists=True
+        )
+        op.create_index(
+            'ix_tinnhan_unread_nhanvien', 'tinnhan', ['maht'],
+            postgresql_where=sa.text('da_doc = false AND nguoigui_manv IS NOT NULL'),
+            postgresql_concurrently=True, if_not_exists=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table in (
+            ('ix_tinnhan_unread_nhanvien', 'tinnhan'),
+            ('ix_tinnhan_unread_khach', 'tinnhan'),
+            ('ix_hoithoai_makh', 'hoithoai'),
+            ('ix_hoithoai_manv_inbox', 'hoithoai'),
+            ('ix_hoithoai_inbox', 'hoithoai'),
+        ):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,32 @@
+"""Bảng tepluutru: đếm tham chiếu tệp lưu theo nội dung
+
+Revision ID: a9c4e6b2d731
+Revises: f5a1d3c8e207
+Create Date: 2026-10-18 18:00:00.000000
+
+Ảnh đại diện cũ (tên theo người dùng) không được đưa vào bảng: vẫn phục vụ như trước.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9c4e6b2d731'
+down_revision = 'f5a1d3c8e207'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'tepluutru',
+        sa.Column('khoa', sa.String(length=255), nullable=False),
+        sa.Column('kichthuoc', sa.BigInteger(), nullable=False),
+        sa.Column('soluot', sa.Integer(), server_default='1', nullable=False),
+        sa.Column('ngaytao', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('khoa')
+    )
+
+
+def downgrade():
+    op.drop_table('tepluutru')
@@ -0,0 +1,53 @@
+"""Tìm kiếm toàn văn không dấu trên tinnhan.noidung (tsvector sinh tự động + GIN)
+
+Revision ID: b7a3e5c9d012
+Revises: 9d4f2a6c8e15
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7a3e5c9d012'
+down_revision = '9d4f2a6c8e15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+
+    # Cấu hình 'simple' (không stemming - tiếng Việt không có) + bỏ dấu:
+    # "Đổi lịch" -> 'doi' 'lich', khớp cả khi khách gõ không dấu.
+    op.execute("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'vn_unaccent') THEN
+                CREATE TEXT SEARCH CONFIGURATION vn_unaccent (COPY = simple);
+                ALTER TEXT SEARCH CONFIGURATION vn_unaccent
+                    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, simple;
+            END IF;
+        END
+        $$
+    """)
+
+    # Cột sinh tự động: ghi lại toàn bảng một lần (chạy ngoài giờ cao điểm)
+    op.execute("""
+        ALTER TABLE tinnhan
+        ADD COLUMN noidung_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('vn_unaccent'::regconfig, coalesce(noidung, ''))) STORED
+    """)
+
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tinnhan_noidung_tsv "
+            "ON tinnhan USING gin (noidung_tsv)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_tinnhan_noidung_tsv")
+    op.execute("ALTER TABLE tinnhan DROP COLUMN IF EXISTS noidung_tsv")
+    op.execute("DROP TEXT SEARCH CONFIGURATION IF EXISTS vn_unaccent")
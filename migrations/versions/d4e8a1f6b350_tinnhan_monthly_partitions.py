@@ -0,0 +1,152 @@
+"""Phân vùng tinnhan theo tháng trên thoigiangui + bảng lưu trữ tinnhan_luutru
+
+Revision ID: d4e8a1f6b350
+Revises: b7a3e5c9d012
+Create Date: 2026-10-18 14:00:00.000000
+
+Dựng lại tinnhan thành bảng PARTITION BY RANGE (thoigiangui) và chép toàn bộ dữ
+liệu sang: chạy trong giờ bảo trì (chat bị khóa tới khi migration commit).
+- Khóa chính đổi thành (matn, thoigiangui) - bảng phân vùng bắt buộc chứa cột phân vùng.
+- thoigiangui NOT NULL (tin cũ thiếu thời gian lấy thời điểm chạy migration).
+- Giữ nguyên sequence matn, cột sinh noidung_tsv và các index (tạo trên bảng cha,
+  tự có ở mọi phân vùng).
+Phân vùng các tháng sau do tinnhan_partition_service tạo trước; cần PostgreSQL 14+.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4e8a1f6b350'
+down_revision = 'b7a3e5c9d012'
+branch_labels = None
+depends_on = None
+
+COLUMNS = 'matn, maht, noidung, thoigiangui, nguoigui_makh, nguoigui_manv, da_doc'
+INDEXES = ('ix_tinnhan_maht_matn', 'ix_tinnhan_unread_khach',
+           'ix_tinnhan_unread_nhanvien', 'ix_tinnhan_noidung_tsv')
+TSV_COLUMN = ("noidung_tsv tsvector GENERATED ALWAYS AS "
+              "(to_tsvector('vn_unaccent'::regconfig, coalesce(noidung, ''))) STORED")
+
+
+def _move_sequence(source, target):
+    """Chuyển sequence của matn (serial) từ bảng source sang bảng target."""
+    op.execute(f"""
+        DO $$
+        DECLARE seq text := pg_get_serial_sequence('{source}', 'matn');
+        BEGIN
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY NONE', seq);
+            EXECUTE format('ALTER TABLE {target} ALTER COLUMN matn SET DEFAULT nextval(%L::regclass)', seq);
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY {target}.matn', seq);
+        END
+        $$
+    """)
+
+
+def _create_indexes():
+    op.execute("CREATE INDEX ix_tinnhan_maht_matn ON tinnhan (maht, matn)")
+    op.execute("CREATE INDEX ix_tinnhan_unread_khach ON tinnhan (maht) "
+               "WHERE da_doc = false AND nguoigui_makh IS NOT NULL")
+    op.execute("CREATE INDEX ix_tinnhan_unread_nhanvien ON tinnhan (maht) "
+               "WHERE da_doc = false AND nguoigui_manv IS NOT NULL")
+    op.execute("CREATE INDEX ix_tinnhan_noidung_tsv ON tinnhan USING gin (noidung_tsv)")
+
+
+def _detach_old_table(old_name):
+    op.execute(f"ALTER TABLE tinnhan RENAME TO {old_name}")
+    op.execute(f"ALTER TABLE {old_name} RENAME CONSTRAINT tinnhan_pkey TO {old_name}_pkey")
+    for index in INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {index}")
+
+
+def upgrade():
+    _detach_old_table('tinnhan_cu')
+
+    op.execute(f"""
+        CREATE TABLE tinnhan (
+            matn integer NOT NULL,
+            maht integer NOT NULL REFERENCES hoithoai (maht),
+            noidung text NOT NULL,
+            thoigiangui timestamp without time zone NOT NULL,
+            nguoigui_makh integer REFERENCES khachhang (makh),
+            nguoigui_manv integer REFERENCES nhanvien (manv),
+            da_doc boolean NOT NULL DEFAULT false,
+            {TSV_COLUMN},
+            CONSTRAINT tinnhan_pkey PRIMARY KEY (matn, thoigiangui)
+        ) PARTITION BY RANGE (thoigiangui)
+    """)
+    _move_sequence('tinnhan_cu', 'tinnhan')
+
+    # Một phân vùng / tháng từ tin cũ nhất tới 2 tháng sau tháng hiện tại
+    op.execute("""
+        DO $$
+        DECLARE
+            m date;
+            stop date := (date_trunc('month', localtimestamp) + interval '3 months')::date;
+        BEGIN
+            SELECT date_trunc('month', coalesce(min(thoigiangui), localtimestamp))::date
+            INTO m FROM tinnhan_cu;
+            WHILE m < stop LOOP
+                EXECUTE format('CREATE TABLE %I PARTITION OF tinnhan FOR VALUES FROM (%L) TO (%L)',
+                               'tinnhan_p' || to_char(m, 'YYYY_MM'), m, (m + interval '1 month')::date);
+                m := (m + interval '1 month')::date;
+            END LOOP;
+        END
+        $$
+    """)
+    op.execute("CREATE TABLE tinnhan_default PARTITION OF tinnhan DEFAULT")
+
+    op.execute(f"""
+        INSERT INTO tinnhan ({COLUMNS})
+        SELECT matn, maht, noidung, coalesce(thoigiangui, localtimestamp),
+               nguoigui_makh, nguoigui_manv, coalesce(da_doc, false)
+        FROM tinnhan_cu
+    """)
+    # Tạo index sau khi chép (nhanh hơn cập nhật index từng dòng)
+    _create_indexes()
+    op.execute("DROP TABLE tinnhan_cu")
+
+    # Lưu trữ: heap thường, không FK / tsvector / partial index - chỉ để tra cứu lại
+    op.execute("""
+        CREATE TABLE tinnhan_luutru (
+            matn integer PRIMARY KEY,
+            maht integer NOT NULL,
+            noidung text NOT NULL,
+            thoigiangui timestamp without time zone NOT NULL,
+            nguoigui_makh integer,
+            nguoigui_manv integer,
+            da_doc boolean NOT NULL DEFAULT false
+        )
+    """)
+    op.execute("CREATE INDEX ix_tinnhan_luutru_maht_matn ON tinnhan_luutru (maht, matn)")
+    op.execute("ANALYZE tinnhan")
+
+
+def downgrade():
+    _detach_old_table('tinnhan_phanvung')
+
+    op.execute(f"""
+        CREATE TABLE tinnhan (
+            matn integer NOT NULL,
+            maht integer NOT NULL REFERENCES hoithoai (maht),
+            noidung text NOT NULL,
+            thoigiangui timestamp without time zone,
+            nguoigui_makh integer REFERENCES khachhang (makh),
+            nguoigui_manv integer REFERENCES nhanvien (manv),
+            da_doc boolean NOT NULL DEFAULT false,
+            {TSV_COLUMN},
+            CONSTRAINT tinnhan_pkey PRIMARY KEY (matn)
+        )
+    """)
+    _move_sequence('tinnhan_phanvung', 'tinnhan')
+
+    # Tin đã lưu trữ quay lại bảng chính (FK có thể đã mất nếu hội thoại bị xóa: bỏ qua các tin đó)
+    op.execute(f"""
+        INSERT INTO tinnhan ({COLUMNS})
+        SELECT {COLUMNS} FROM tinnhan_phanvung
+        UNION ALL
+        SELECT {COLUMNS} FROM tinnhan_luutru l
+        WHERE EXISTS (SELECT 1 FROM hoithoai h WHERE h.maht = l.maht)
+    """)
+    _create_indexes()
+    op.execute("DROP TABLE tinnhan_phanvung")
+    op.execute("DROP TABLE tinnhan_luutru")
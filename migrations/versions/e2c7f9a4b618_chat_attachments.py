@@ -0,0 +1,44 @@
+"""Bảng tepdinhkem: tệp đính kèm tin nhắn chat
+
+Revision ID: e2c7f9a4b618
+Revises: d4e8a1f6b350
+Create Date: 2026-10-18 16:00:00.000000
+
+matn không có FK: khóa chính của tinnhan (phân vùng) là (matn, thoigiangui).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2c7f9a4b618'
+down_revision = 'd4e8a1f6b350'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'tepdinhkem',
+        sa.Column('matdk', sa.Integer(), nullable=False),
+        sa.Column('maht', sa.Integer(), nullable=False),
+        sa.Column('matn', sa.Integer(), nullable=False),
+        sa.Column('tenfile', sa.String(length=255), nullable=False),
+        sa.Column('loai', sa.String(length=100), nullable=False),
+        sa.Column('kichthuoc', sa.BigInteger(), nullable=False),
+        sa.Column('duongdan', sa.String(length=255), nullable=False),
+        sa.Column('anhnho', sa.String(length=255), nullable=True),
+        sa.Column('rong', sa.Integer(), nullable=True),
+        sa.Column('cao', sa.Integer(), nullable=True),
+        sa.Column('ngaytao', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['maht'], ['hoithoai.maht']),
+        sa.PrimaryKeyConstraint('matdk')
+    )
+    op.create_index('ix_tepdinhkem_matn', 'tepdinhkem', ['matn'])
+    op.create_index('ix_tepdinhkem_maht', 'tepdinhkem', ['maht'])
+
+
+def downgrade():
+    op.drop_index('ix_tepdinhkem_maht', table_name='tepdinhkem')
+    op.drop_index('ix_tepdinhkem_matn', table_name='tepdinhkem')
+    op.drop_table('tepdinhkem')
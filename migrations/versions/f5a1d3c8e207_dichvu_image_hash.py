@@ -0,0 +1,28 @@
+"""dichvu.anhdichvu_hash: md5 của ảnh dịch vụ (cột sinh tự động)
+
+Revision ID: f5a1d3c8e207
+Revises: e2c7f9a4b618
+Create Date: 2026-10-18 17:00:00.000000
+
+ETag / tham số ?v= của /api/services/<madv>/image, đọc được mà không cần kéo blob.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5a1d3c8e207'
+down_revision = 'e2c7f9a4b618'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        ALTER TABLE dichvu
+        ADD COLUMN IF NOT EXISTS anhdichvu_hash text
+        GENERATED ALWAYS AS (md5(anhdichvu)) STORED
+    """)
+
+
+def downgrade():
+    op.execute("ALTER TABLE dichvu DROP COLUMN IF EXISTS anhdichvu_hash")
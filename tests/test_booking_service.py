@@ -0,0 +1,69 @@
+# tests/test_booking_service.py
+"""Quy tắc lặp của lịch hẹn: booking_service.expand_recurrence."""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app.services import booking_service
+from app.services.booking_service import MAX_BATCH_ITEMS, expand_recurrence
+
+START = datetime(2026, 11, 2, 9, 30)   # thứ Hai
+
+
+def test_daily_count():
+    assert expand_recurrence(START, {"freq": "daily", "count": 3}) == [
+        START, START + timedelta(days=1), START + timedelta(days=2)
+    ]
+
+
+def test_weekly_interval():
+    assert expand_recurrence(START, {"freq": "weekly", "interval": 2, "count": 3}) == [
+        START, START + timedelta(weeks=2), START + timedelta(weeks=4)
+    ]
+
+
+def test_until_is_inclusive():
+    result = expand_recurrence(START, {"freq": "weekly", "until": "2026-11-16"})
+    assert result == [START, START + timedelta(weeks=1), START + timedelta(weeks=2)]
+
+
+def test_count_and_until_stop_at_whichever_comes_first():
+    assert len(expand_recurrence(START, {"freq": "daily", "count": 2, "until": "2026-11-30"})) == 2
+    assert len(expand_recurrence(START, {"freq": "daily", "count": 10, "until": "2026-11-04"})) == 3
+
+
+def test_keeps_time_of_day_across_month_and_year():
+    result = expand_recurrence(datetime(2026, 12, 29, 18, 0), {"freq": "daily", "count": 5})
+    assert [d.date() for d in result][-1] == date(2027, 1, 2)
+    assert all((d.hour, d.minute) == (18, 0) for d in result)
+
+
+def test_count_up_to_batch_limit():
+    assert len(expand_recurrence(START, {"freq": "daily", "count": MAX_BATCH_ITEMS})) == MAX_BATCH_ITEMS
+
+
+@pytest.mark.parametrize("rule", [
+    {"freq": "daily", "count": MAX_BATCH_ITEMS + 1},
+    {"freq": "daily", "until": "2030-01-01"},
+])
+def test_more_than_batch_limit_is_rejected(rule):
+    with pytest.raises(ValueError):
+        expand_recurrence(START, rule)
+
+
+@pytest.mark.parametrize("rule", [
+    None,
+    {},
+    {"freq": "monthly", "count": 3},
+    {"freq": "weekly"},
+    {"freq": "weekly", "interval": -1, "count": 3},
+    {"freq": "weekly", "interval": "x", "count": 3},
+    {"freq": "weekly", "until": "16/11/2026"},
+])
+def test_invalid_rules_raise_value_error(rule):
+    with pytest.raises(ValueError):
+        expand_recurrence(START, rule)
+
+
+def test_recurrence_steps_cover_documented_frequencies():
+    assert set(booking_service.RECURRENCE_STEPS) == {"daily", "weekly"}
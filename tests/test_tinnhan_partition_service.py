@@ -0,0 +1,130 @@
+# tests/test_tinnhan_partition_service.py
+"""Cắt tỉa phân vùng tinnhan: since_bound / before_bound trên danh sách Partition cố định."""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app.services import tinnhan_partition_service as partitions
+from app.services.tinnhan_partition_service import CLOSED_GRACE, MATN_SLACK
+
+
+def _partition(year, month, min_matn, max_matn, closed):
+    start = date(year, month, 1)
+    return partitions.Partition(
+        partitions.partition_name(start), start, partitions.add_months(start, 1),
+        min_matn, max_matn, closed
+    )
+
+
+@pytest.fixture
+def use_ranges(monkeypatch):
+    def apply(*ranges):
+        monkeypatch.setattr(partitions, 'partition_ranges', lambda: list(ranges))
+    return apply
+
+
+# Tháng 1, 2 đã đóng; tháng 3 đang mở. matn cách xa nhau hơn MATN_SLACK.
+JAN = _partition(2026, 1, 1, 10000, True)
+FEB = _partition(2026, 2, 10001, 20000, True)
+MAR_OPEN = _partition(2026, 3, 20001, 25000, False)
+
+
+def test_no_partitions_disables_pruning(use_ranges):
+    use_ranges()
+    assert partitions.since_bound(100) is None
+    assert partitions.before_bound(100) is None
+
+
+# ========== since_bound ==========
+def test_since_bound_skips_closed_partitions_at_or_below_matn(use_ranges):
+    use_ranges(JAN, FEB, MAR_OPEN)
+    assert partitions.since_bound(0) == datetime(2026, 1, 1)
+    assert partitions.since_bound(9999) == datetime(2026, 1, 1)
+    # max_matn của tháng 1 = 10000: không còn tin nào > 10000 trong tháng 1
+    assert partitions.since_bound(10000) == datetime(2026, 2, 1)
+    assert partitions.since_bound(20000) == datetime(2026, 3, 1)
+
+
+def test_since_bound_keeps_open_partition_whatever_its_matn(use_ranges):
+    use_ranges(JAN, FEB, MAR_OPEN)
+    assert partitions.since_bound(10 ** 9) == datetime(2026, 3, 1)
+
+
+def test_since_bound_with_empty_open_partitions(use_ranges):
+    use_ranges(JAN, _partition(2026, 2, None, None, False), _partition(2026, 3, None, None, False))
+    assert partitions.since_bound(10000) == datetime(2026, 2, 1)
+    assert partitions.since_bound(5) == datetime(2026, 1, 1)
+
+
+def test_since_bound_with_only_default_partition_left(use_ranges):
+    # Cron ngừng tạo phân vùng: tin mới rơi vào tinnhan_default, mọi phân vùng tháng đã đóng
+    use_ranges(JAN, FEB)
+    assert partitions.since_bound(20000) is None
+
+
+def test_since_bound_crosses_year_boundary(use_ranges):
+    use_ranges(_partition(2025, 12, 1, 10000, True), _partition(2026, 1, 10001, None, False))
+    assert partitions.since_bound(10000) == datetime(2026, 1, 1)
+    assert partitions.since_bound(500) == datetime(2025, 12, 1)
+
+
+# ========== before_bound ==========
+def test_before_bound_stops_after_last_partition_holding_older_messages(use_ranges):
+    use_ranges(JAN, FEB, MAR_OPEN)
+    assert partitions.before_bound(15000) == datetime(2026, 3, 1)
+    # min_matn của tháng 2 = 10001: không có tin < 10001 trong tháng 2
+    assert partitions.before_bound(10001) == datetime(2026, 2, 1)
+
+
+def test_before_bound_includes_everything_when_last_partition_matches(use_ranges):
+    use_ranges(JAN, FEB, MAR_OPEN)
+    assert partitions.before_bound(25000) is None
+
+
+def test_before_bound_widens_open_partition_by_matn_slack(use_ranges):
+    use_ranges(JAN, FEB, MAR_OPEN)
+    # Giao dịch commit muộn có thể ghi vào tháng 3 matn nhỏ hơn 20001 tới MATN_SLACK
+    assert partitions.before_bound(MAR_OPEN.min_matn - MATN_SLACK) == datetime(2026, 3, 1)
+    assert partitions.before_bound(MAR_OPEN.min_matn - MATN_SLACK + 1) is None
+
+
+def test_before_bound_with_empty_open_partitions(use_ranges):
+    use_ranges(JAN, _partition(2026, 2, None, None, False), _partition(2026, 3, None, None, False))
+    # Phân vùng mở rỗng chỉ nhận tin > matn lớn nhất đã thấy (10000) trừ MATN_SLACK
+    assert partitions.before_bound(10000 - MATN_SLACK) == datetime(2026, 2, 1)
+    assert partitions.before_bound(10000 - MATN_SLACK + 1) is None
+
+
+def test_before_bound_older_than_every_partition_reads_default_only(use_ranges):
+    # Tin cũ hơn mọi phân vùng chỉ có thể nằm trong tinnhan_default (trước tháng đầu tiên)
+    use_ranges(FEB, MAR_OPEN)
+    assert partitions.before_bound(10001) == datetime(2026, 2, 1)
+
+
+def test_before_bound_with_populated_default_partition(use_ranges):
+    # tinnhan_default giữ tin sau tháng 2 (chưa có phân vùng): matn của chúng > mọi tin tháng 1, 2
+    use_ranges(JAN, FEB)
+    assert partitions.before_bound(10 ** 9) is None
+    assert partitions.before_bound(5000) == datetime(2026, 2, 1)
+
+
+def test_before_bound_crosses_year_boundary(use_ranges):
+    use_ranges(
+        _partition(2025, 11, 1, 10000, True),
+        _partition(2025, 12, 10001, 20000, True),
+        _partition(2026, 1, 30001, None, False),
+    )
+    assert partitions.before_bound(15000) == datetime(2026, 1, 1)
+
+
+# ========== đóng phân vùng ==========
+def test_partition_closes_only_after_grace_period():
+    month_end = datetime(2026, 2, 1)
+    assert not partitions._is_closed(date(2026, 1, 1), month_end)
+    assert not partitions._is_closed(date(2026, 1, 1), month_end + CLOSED_GRACE - timedelta(seconds=1))
+    assert partitions._is_closed(date(2026, 1, 1), month_end + CLOSED_GRACE)
+
+
+def test_december_partition_closes_in_january():
+    assert not partitions._is_closed(date(2025, 12, 1), datetime(2025, 12, 31, 23, 59))
+    assert partitions._is_closed(date(2025, 12, 1), datetime(2026, 1, 1) + CLOSED_GRACE)